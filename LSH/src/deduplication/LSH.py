@@ -164,13 +164,17 @@
 
 
 import hashlib
+import logging
 import re
 from collections import defaultdict
 from itertools import combinations
-from utils.utils import clean_document, shingle, minhash
+from utils.utils import clean_document, shingle, minhash, remove_exact_duplicates
+from utils.instrumentation import span
 from joblib import Parallel, delayed
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 class LSH:
     """Locality Sensitive Hashing (LSH) using MinHash and Banding for approximate near-duplicate detection."""
 
@@ -186,60 +190,62 @@ class LSH:
         self.signatures = {}  # To store MinHash signatures for each document
         self.cleaned_docs = {}
         self.candidate_pairs = set()
+        self.unique_docs = {}  # Representatives of the exact-duplicate groups
+        self.exact_duplicates = {}  # Representative ID -> IDs of its exact duplicates
 
-    # def remove_duplicates(self, docs):
-    #     """Remove exact duplicates from the documents."""
-    #     unique_docs = {}
-    #     duplicates = defaultdict(list)
-    #     for doc_id, doc in docs.items():
-    #         if doc not in unique_docs:
-    #             unique_docs[doc_id] = doc
-    #         else:
-    #             duplicates[unique_docs[doc]] = doc_id
-    #     self.cleaned_docs = unique_docs
-    #     self.exact_duplicates = duplicates
+    def remove_duplicates(self, docs):
+        """Remove exact duplicates from the documents by hashing their normalized text."""
+        self.unique_docs, self.exact_duplicates = remove_exact_duplicates(docs)
 
-    def compute_minhash_signatures(self, docs):
-        """Compute MinHash signatures in batches for efficiency and reduced memory usage."""
-        # self.remove_duplicates(docs)  # Remove duplicates to minimize processing
-        self.cleaned_docs = {doc_id: clean_document(doc) for doc_id, doc in docs.items()}
+    def compute_minhash_signatures(self, docs, n_jobs=-1):
+        """Compute MinHash signatures in batches on `n_jobs` workers (-1 uses all cores) for efficiency and reduced memory usage."""
+        with span("clean") as stage:
+            self.remove_duplicates(docs)  # Only representatives of exact duplicates are signed
+            self.cleaned_docs = {doc_id: clean_document(doc) for doc_id, doc in self.unique_docs.items()}
+            stage.items = len(self.unique_docs)
         # self.shingle_sets = {doc_id: shingle(doc, self.k) for doc_id, doc in self.cleaned_docs.items()}
         # self.shingle_sets = {doc_id: shingle(doc, self.k) for doc_id, doc in self.cleaned_docs.items()}
         doc_ids = list(self.cleaned_docs.keys())
         
         for start in range(0, len(doc_ids), self.batch_size):
             batch_ids = doc_ids[start:start + self.batch_size]
-            batch_shingles = {doc_id: shingle(self.cleaned_docs[doc_id], self.k) for doc_id in batch_ids}
-            batch_signatures = Parallel(n_jobs=-1)(delayed(minhash)(shingles, self.num_hashes) for doc_id, shingles in batch_shingles.items())
+            with span("shingle", len(batch_ids)):
+                batch_shingles = {doc_id: shingle(self.cleaned_docs[doc_id], self.k) for doc_id in batch_ids}
+            with span("sign", len(batch_ids)):
+                batch_signatures = Parallel(n_jobs=n_jobs)(delayed(minhash)(shingles, self.num_hashes) for doc_id, shingles in batch_shingles.items())
             
             # Store each signature as a list in the dictionary
             for doc_id, signature in zip(batch_ids, batch_signatures):
                 self.signatures[doc_id] = signature
             
-            print(f"Processed batch: {start} to {start + len(batch_ids)}")
+            logger.info("Processed batch: %d to %d", start, start + len(batch_ids))
 
         return self.signatures
 
-    def banding(self):
-        """Apply LSH banding to find candidate pairs."""
+    def banding(self, signatures=None):
+        """Apply LSH banding to find candidate pairs, using the stored signatures unless others are given."""
         self.candidate_pairs.clear()  # Reset candidate pairs for fresh processing
+        self.index.clear()
+        if signatures is None:
+            signatures = self.signatures
 
-        # Process each signature and apply banding
-        for doc_id, signature in self.signatures.items():
-            for band_idx in range(self.num_bands):
-                start = band_idx * self.rows_per_band
-                band = tuple(signature[start:start + self.rows_per_band])  # Convert band into a tuple for hashing
-                band_hash = hashlib.md5(str(band).encode()).hexdigest()  # Hash the band
+        with span("band", len(signatures)):
+            # Process each signature and apply banding
+            for doc_id, signature in signatures.items():
+                for band_idx in range(self.num_bands):
+                    start = band_idx * self.rows_per_band
+                    band = tuple(signature[start:start + self.rows_per_band])  # Convert band into a tuple for hashing
+                    band_hash = hashlib.md5(str(band).encode()).hexdigest()  # Hash the band
 
-                # Store doc_id in the index for this band
-                self.index[(band_idx, band_hash)].append(doc_id)
+                    # Store doc_id in the index for this band
+                    self.index[(band_idx, band_hash)].append(doc_id)
 
-        # Identify candidate pairs by looking for documents that share bands
-        for doc_ids in self.index.values():
-            if len(doc_ids) > 1:
-                for i in range(len(doc_ids)):
-                    for j in range(i + 1, len(doc_ids)):
-                        self.candidate_pairs.add((doc_ids[i], doc_ids[j]))
+            # Identify candidate pairs by looking for documents that share bands
+            for doc_ids in self.index.values():
+                if len(doc_ids) > 1:
+                    for i in range(len(doc_ids)):
+                        for j in range(i + 1, len(doc_ids)):
+                            self.candidate_pairs.add((doc_ids[i], doc_ids[j]))
 
         return self.candidate_pairs
 
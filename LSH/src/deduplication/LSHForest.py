@@ -1,7 +1,48 @@
-from collections import defaultdict
-from itertools import combinations
+import numpy as np
+from joblib import Parallel, delayed
 from deduplication.LSH import LSH
-from utils.utils import split_dict, majority_vote
+from utils.utils import majority_vote, prefix_ranges, pack_pairs, unpack_pairs, split_columns, stack_signatures
+from utils.instrumentation import span
+
+
+def band_tree(matrix, columns, num_bands, rows_per_band):
+    """
+    Bands one tree of the forest and returns its candidate pairs.
+
+    The tree works on the view `matrix[:, columns]` and bands its first `num_bands * rows_per_band`
+    columns. For each band the rows are sorted lexicographically, so documents sharing the band form
+    contiguous runs, and every pair inside a run is a candidate.
+
+    Args:
+        matrix (numpy.ndarray): The `(num_docs, num_hashes)` signature matrix, shared by all trees.
+        columns (slice): Signature columns assigned to this tree (see `utils.split_columns`).
+        num_bands (int): Number of bands for the banding technique.
+        rows_per_band (int): Number of rows in each band.
+
+    Returns:
+        numpy.ndarray: Sorted, unique int64 codes of the candidate pairs (see `utils.pack_pairs`).
+    """
+    num_docs = len(matrix)
+    tree = matrix[:, columns]
+    codes = []
+    for band_idx in range(num_bands):
+        block = tree[:, band_idx * rows_per_band:(band_idx + 1) * rows_per_band]
+        order = np.lexsort(block.T[::-1])
+        rows = block[order]
+
+        boundaries = np.flatnonzero((rows[1:] != rows[:-1]).any(axis=1)) + 1
+        starts = np.concatenate(([0], boundaries))
+        sizes = np.diff(np.concatenate((starts, [num_docs])))
+        # Runs of equal size are paired together, one (runs, size) block at a time
+        for size in np.unique(sizes[sizes > 1]):
+            members = order[starts[sizes == size][:, None] + np.arange(size)]
+            first, second = np.triu_indices(size, 1)
+            codes.append(pack_pairs(members[:, first].ravel(), members[:, second].ravel(), num_docs))
+
+    if not codes:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(codes))
+
 
 class LSHForest(LSH):
     """
@@ -10,8 +51,15 @@ class LSHForest(LSH):
     The LSHForest class extends the LSH class to support the creation of multiple 
     trees in the forest, allowing for more robust detection of candidate pairs. 
     Each tree corresponds to an independent LSH index, with results combined via majority voting.
+
+    For similarity search the forest also keeps one prefix tree per tree: the signature
+    slice of every document, sorted lexicographically up to `max_depth` hash values. A
+    query descends each tree by binary search and then ascends all trees together,
+    collecting documents that share shorter and shorter prefixes until it has enough
+    neighbours. The prefix length adapts to the query, so (b, r) do not have to be
+    chosen in advance and one index serves any similarity threshold.
     """
-    def __init__(self, num_hashes=200, num_bands=10, rows_per_band=4, num_trees=5, k=5):
+    def __init__(self, num_hashes=200, num_bands=10, rows_per_band=4, num_trees=5, k=5, max_depth=None, n_jobs=-1, interleave=False):
         """
         Initializes an LSHForest instance.
 
@@ -21,52 +69,130 @@ class LSHForest(LSH):
             rows_per_band (int): Number of rows in each band.
             num_trees (int): Number of LSH trees in the forest.
             k (int): Parameter for the LSH superclass, indicating the number of nearest neighbors to consider.
+            max_depth (int): Maximum prefix length of the prefix trees. Defaults to `num_hashes // num_trees`.
+            n_jobs (int): Number of parallel workers used to band the trees (-1 uses all cores).
+            interleave (bool): Assign hash functions to trees round-robin instead of in contiguous ranges.
         """
-        super().__init__(num_hashes, num_bands, rows_per_band, k)
+        assert num_bands * rows_per_band <= num_hashes // num_trees, "Each tree needs num_bands * rows_per_band hash functions"
+        # Each tree bands its own slice of the signature, so the base class only checks one slice
+        super().__init__(num_bands * rows_per_band, num_bands, rows_per_band, k)
+        self.num_hashes = num_hashes
         self.num_trees = num_trees
         """num_trees (int): Number of LSH trees in the forest."""
+        self.tree_columns = split_columns(num_hashes, num_trees, interleave)
+        """tree_columns (list): The slice of signature columns (hash functions) assigned to each tree."""
+        self.max_depth = max_depth if max_depth is not None else num_hashes // num_trees
+        """max_depth (int): Maximum prefix length (hash values per tree) stored in each prefix tree."""
+        assert self.max_depth <= num_hashes // num_trees, "max_depth must not exceed the hash functions per tree"
+        self.trees = []
+        """trees (list): One `(order, prefixes)` entry per tree, where `prefixes` holds every document's signature
+            prefix sorted lexicographically and `order` maps each sorted prefix back to its position in `doc_ids`."""
+        self.doc_ids = []
+        """doc_ids (list): Document IDs in the order their signatures were added to the trees."""
+        self.signature_matrix = None
+        """signature_matrix (numpy.ndarray): Signatures of the indexed documents, used to rank query candidates."""
+        self.n_jobs = n_jobs
+        """n_jobs (int): Number of parallel workers used to band the trees."""
         
     def banding(self, signatures):
         """
         Performs the banding technique across multiple LSH trees and identifies candidate pairs.
 
-        The signatures are split across multiple trees (LSH indices), and candidate pairs 
-        are identified within each tree using the banding technique. The candidate pairs 
-        from all trees are combined using a majority voting mechanism to form the final set 
-        of candidate pairs.
+        The signatures are stacked into one matrix and each tree bands its own column slice
+        of it (see `tree_columns`). Trees are banded in parallel workers that all receive the
+        same matrix (joblib memory-maps large arrays instead of copying them) and take a view
+        of their slice, so memory does not grow with `num_trees`. Each worker returns its
+        candidate pairs as a sorted array of packed int64 codes. The candidate pairs from all
+        trees are combined using a majority voting mechanism to form the final set of
+        candidate pairs.
 
         Args:
             signatures (dict): A dictionary where keys are document IDs and values are MinHash signatures (lists of hash values).
 
         Returns:
-            set: A set of candidate document pairs (as tuples of document IDs) that share similar bands.
+            list: Candidate document pairs (as tuples of document IDs) found by a majority of the trees.
         """
         
-        # Split the signature dictionary across the specified number of trees.
-        signature_lists = split_dict(signatures, self.num_trees)
-        candidate_sets = []
-        
-        # Iterate over each subset of signatures, treating each as a separate LSH tree.
-        for sig in signature_lists:
-            index = defaultdict(list)
-            candidate_pairs = set()
-            
-            # Process each document's signature within the current tree.
-            for doc_id, sig in sig.items():
-                for band_idx in range(self.num_bands):
-                    start = band_idx * self.rows_per_band
-                    band = tuple(sig[start:start + self.rows_per_band])
-                    index[(band_idx, band)].append(doc_id)
-
-            # Identify candidate pairs from documents that share the same band entry.
-            for doc_ids in index.values():
-                if len(doc_ids) > 1:
-                    candidate_pairs.update(combinations(doc_ids, 2))
-            
-            # Add the candidate pairs from the current tree to the list of candidate sets.
-            candidate_sets.append(candidate_pairs)
-        
-        # Use majority voting across all candidate sets from the different trees.
-        self.candidate_pairs = majority_vote(candidate_sets)
+        # Prefix trees are rebuilt from the new signatures on the next query.
+        self.trees = []
+
+        with span("band", len(signatures)):
+            doc_ids, matrix = stack_signatures(signatures, self.num_hashes)
+
+            # Each tree bands its own slice of the signature.
+            candidate_sets = Parallel(n_jobs=self.n_jobs)(
+                delayed(band_tree)(matrix, columns, self.num_bands, self.rows_per_band)
+                for columns in self.tree_columns
+            )
+
+            # Use majority voting across all candidate sets from the different trees.
+            codes = majority_vote(candidate_sets)
+            first, second = unpack_pairs(codes, len(doc_ids))
+            self.candidate_pairs = [(doc_ids[a], doc_ids[b]) for a, b in zip(first.tolist(), second.tolist())]
         
-        return self.candidate_pairs
\ No newline at end of file
+        return self.candidate_pairs
+
+    def build_trees(self, signatures):
+        """
+        Builds the prefix trees used for top-k queries.
+
+        Tree `t` is built from the first `max_depth` hash functions in `tree_columns[t]`, so the
+        trees are independent. Each tree is stored as a sorted array of signature prefixes,
+        which supports the same descent as a trie with a binary search per level.
+
+        Args:
+            signatures (dict): A dictionary where keys are document IDs and values are MinHash signatures (lists of hash values).
+        """
+        self.doc_ids, self.signature_matrix = stack_signatures(signatures, self.num_hashes)
+
+        self.trees = []
+        for columns in self.tree_columns:
+            prefixes = self.signature_matrix[:, columns][:, :self.max_depth]
+            order = np.lexsort(prefixes.T[::-1])
+            self.trees.append((order, prefixes[order]))
+
+    def query(self, signature, top_k=10, threshold=None):
+        """
+        Finds the top-k neighbours of a MinHash signature with a synchronous ascent over all trees.
+
+        Each tree is descended to the longest prefix it shares with the query. Starting from
+        the deepest level reached by any tree, documents sharing a prefix of the current length
+        are collected from every tree that reached it, and the level is shortened by one until
+        at least `top_k` candidates are found or only single-value prefixes remain. The
+        candidates are ranked by the fraction of MinHash values they share with the query.
+
+        Args:
+            signature (list): The MinHash signature of the query document.
+            top_k (int): Number of neighbours to return.
+            threshold (float): Optional minimum estimated Jaccard similarity of the returned neighbours.
+
+        Returns:
+            list: Up to `top_k` `(doc_id, similarity)` tuples, most similar first.
+        """
+        if not self.trees:
+            self.build_trees(self.signatures)
+
+        query = np.asarray(signature, dtype=np.uint64)
+        paths = []
+        for columns, (_, prefixes) in zip(self.tree_columns, self.trees):
+            paths.append(prefix_ranges(prefixes, query[columns][:self.max_depth]))
+
+        candidates = set()
+        depth = max(len(path) for path in paths) - 1
+        while depth > 0:
+            for (order, _), path in zip(self.trees, paths):
+                if len(path) > depth:
+                    lo, hi = path[depth]
+                    candidates.update(order[lo:hi].tolist())
+            if len(candidates) >= top_k:
+                break
+            depth -= 1
+
+        positions = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (self.signature_matrix[positions] == query).mean(axis=1)
+        ranked = np.argsort(-similarity, kind='stable')[:top_k]
+
+        neighbours = [(self.doc_ids[positions[i]], float(similarity[i])) for i in ranked]
+        if threshold is not None:
+            neighbours = [(doc_id, sim) for doc_id, sim in neighbours if sim >= threshold]
+        return neighbours
@@ -1,8 +1,9 @@
 import hashlib
 import re
 from collections import defaultdict
-from itertools import combinations
-from utils.utils import clean_document, shingle, minhash
+from itertools import combinations, product
+from utils.utils import clean_document, shingle, minhash, remove_exact_duplicates, pack_bands, prefix_ranges, stack_signatures
+from utils.instrumentation import span
 import numpy as np
 from joblib import Parallel, delayed
 
@@ -12,10 +13,12 @@ class LSHImproved:
 
     LSH Improved uses a multi-probe approach to traditional locality-sensitive
     hashing to reduce the number of required hash tables, ultimately saving space 
-    and improving efficiency. This class supports various banding methods for probing
+    and improving efficiency. Every document is indexed exactly once per band;
+    probing of nearby buckets happens at query time, so the index does not grow
+    with the number of probes. This class supports various banding methods for probing
     nearby bands, allowing customizable deduplication and similarity search.
     """
-    def __init__(self, num_hashes=100, num_bands=20, rows_per_band=5, k=5, num_probes = 4, banding_method='nearby_banding'):
+    def __init__(self, num_hashes=100, num_bands=20, rows_per_band=5, k=5, num_probes = 4, banding_method='query_directed', seed=42, min_shared_rows=None):
         """
         Initializes the LSHImproved instance with the specified number of hash functions, bands, and shingle size, number of probes, and banding strategy.
 
@@ -29,8 +32,11 @@ class LSHImproved:
         """num_bands (int): Number of bands used for LSH banding."""
         self.rows_per_band = rows_per_band
         """rows_per_band (int): Number of rows in each band (bands * rows_per_band must equal num_hashes)."""
-        self.index = defaultdict(list)
-        """index (defaultdict): A dictionary used to store bands and document IDs for candidate identification."""
+        self.index = []
+        """index (list): One `(order, rows)` entry per band, where `rows` holds the band rows of every document
+            sorted lexicographically and `order` maps each sorted row back to its position in `doc_ids`."""
+        self.doc_ids = []
+        """doc_ids (list): Document IDs in the order their signatures were indexed."""
         self.unique_docs = {}
         """unique_docs (dict): A dictionary of unique documents (after removing exact duplicates)."""
         self.cleaned_docs = {}
@@ -39,21 +45,33 @@ class LSHImproved:
         """candidate_pairs (set): A set of candidate document pairs found using LSH."""
         self.exact_duplicates = {}
         """exact_duplicates (dict): A dictionary of exact duplicates, mapping original doc IDs to duplicate doc IDs."""
+        self.num_probes = num_probes
+        """num_probes (int): Probe budget, i.e. the number of neighbouring buckets read per band on each side of a query."""
         self.banding_method = banding_method
-        """banding_method: The banding method to use for hash perturbation.
-            Options are 'nearby_banding', 'bit_flip', and 'gaussian'."""
+        """banding_method: The method used to choose the buckets probed at query time.
+            Options are 'query_directed' (deterministic neighbouring buckets), 'nearby_banding', 'bit_flip', and 'gaussian'."""
+        self.min_shared_rows = max(1, rows_per_band - 1) if min_shared_rows is None else min_shared_rows
+        """min_shared_rows (int): Leading rows a neighbouring bucket must share with a query to be probed by
+            'query_directed'. Sharing fewer rows makes a band behave like a shorter one and lets dissimilar
+            documents through, so the default is all rows of the band but the last."""
+        self.band_keys = []
+        """band_keys (list): For the random perturbation methods, one `(keys, positions)` entry per band holding the
+            sorted packed band keys and the sorted-row position each key belongs to."""
+        self.seed = seed
+        """seed (int): Seed of the random generator used by the perturbation methods."""
+        self.rng = np.random.default_rng(seed)
+        """rng (numpy.random.Generator): Random generator used by the perturbation methods."""
 
         self.k = k
         """k (int): The shingle size (number of words or characters in each shingle)."""
         assert self.num_hashes == self.num_bands * self.rows_per_band, "Hash functions must equal bands * rows_per_band"
     
-    # Keeping remove duplicates the same
     def remove_duplicates(self, docs):
         """Removes exact duplicates from the provided documents and stores the unique ones.
         
-        This method scans through the provided documents, identifying and removing exact duplicates.
-        It stores the first occurrence of each document in the `unique_docs` attribute and tracks duplicates
-        in the `exact_duplicates` attribute.
+        Documents are grouped by a 128-bit hash of their normalized text (see
+        `utils.utils.remove_exact_duplicates`). The first occurrence of each document is stored
+        in the `unique_docs` attribute and the duplicates are tracked in the `exact_duplicates` attribute.
         
         Args:
             docs (dict): A dictionary where keys are document IDs and values are document contents.
@@ -62,19 +80,9 @@ class LSHImproved:
             - Populates the `unique_docs` dictionary with unique documents.
             - Populates the `exact_duplicates` dictionary with mappings from original document IDs to their duplicates.
         """
-        seen_docs = {}
-        for doc_id, doc in docs.items():
-            if doc not in seen_docs:
-                self.unique_docs[doc_id] = doc
-                seen_docs[doc] = doc_id  # Track first occurrence of the document
-            else:
-                # Track exact duplicates
-                original_id = seen_docs[doc]
-                if original_id not in self.exact_duplicates:
-                    self.exact_duplicates[original_id] = []
-                self.exact_duplicates[original_id].append(doc_id)
+        self.unique_docs, self.exact_duplicates = remove_exact_duplicates(docs)
 
-    def compute_minhash_signatures(self, docs):
+    def compute_minhash_signatures(self, docs, n_jobs=-1):
         """Computes MinHash signatures for each unique document using parallel processing.
         
         This method performs the following steps:
@@ -85,6 +93,7 @@ class LSHImproved:
         
         Args:
             docs (dict): A dictionary where keys are document IDs and values are document contents.
+            n_jobs (int): Number of parallel workers for the MinHash signatures (-1 uses all cores).
         
         Returns:
             dict: A dictionary where keys are document IDs and values are the MinHash signatures (lists of hash values).
@@ -94,142 +103,306 @@ class LSHImproved:
             - Populates the `shingle_sets` dictionary with shingles for each document.
             - Populates the `signatures` dictionary with MinHash signatures for each document.
         """
-        self.remove_duplicates(docs)
-        self.cleaned_docs = {doc_id: clean_document(doc) for doc_id, doc in self.unique_docs.items()}
-        self.shingle_sets = {doc_id: shingle(doc, self.k) for doc_id, doc in self.cleaned_docs.items()}
+        with span("clean") as stage:
+            self.remove_duplicates(docs)
+            self.cleaned_docs = {doc_id: clean_document(doc) for doc_id, doc in self.unique_docs.items()}
+            stage.items = len(self.unique_docs)
+        with span("shingle", len(self.cleaned_docs)):
+            self.shingle_sets = {doc_id: shingle(doc, self.k) for doc_id, doc in self.cleaned_docs.items()}
         
         # Parallel computation of MinHash signatures
-        signatures = Parallel(n_jobs=-1)( delayed(minhash)(shingles, self.num_hashes) for doc_id, shingles in self.shingle_sets.items())
+        with span("sign", len(self.shingle_sets)):
+            signatures = Parallel(n_jobs=n_jobs)( delayed(minhash)(shingles, self.num_hashes) for doc_id, shingles in self.shingle_sets.items())
         self.signatures = dict(zip(self.shingle_sets.keys(), signatures))
 
         return self.signatures
     
     
     # Creating nearby_banding
-    def nearby_banding(self, band, num_probes):
+    def nearby_banding(self, rows, num_probes):
         """
-        This method creates multiple variations of the input band by applying 
-        perturbations to its elements via modulus calculations. 
+        This method creates multiple variations of every input band by applying 
+        perturbations to one of its elements via modulus calculations. All
+        perturbations of the band are drawn in one call from `self.rng`.
 
         Args:
-            band (tuple): A tuple representing the original hash band, where each 
-                        element corresponds to a hash value.
-            num_probes (int): The number of perturbations (nearby bands) to generate. 
+            rows (numpy.ndarray): An `(n, rows_per_band)` uint64 array of band rows,
+                        one row per document.
+            num_probes (int): The number of perturbations (nearby bands) to generate per row. 
 
         Returns:
-            list: A list of tuples, each representing a perturbed version of the 
-                original band. The number of tuples returned is equal to 
-                `num_probes`.
+            numpy.ndarray: An `(n, num_probes, rows_per_band)` array holding the
+                perturbed versions of each original band.
         """
-    
+        perturbed, n_idx, p_idx, cols = self._perturbation_sites(rows, num_probes)
+
         # We identify "nearby" neighbors by making perturbations in the hash key
-        perturbed_bands = []
+        shifts = self.rng.integers(1, 10, size=cols.shape, dtype=np.uint64)
+        perturbed[n_idx, p_idx, cols] = (perturbed[n_idx, p_idx, cols] + shifts) % np.uint64(100)
+        # ^^ used modules perturbation in this case, but there other options we can change
+        return perturbed
 
-        for _ in range(num_probes):
-            changed_band = list(band)
+    def bit_flip(self, rows, num_probes):
+        """
+        This method creates multiple variations of every input band by flipping the
+        lowest bit of one randomly chosen hash token. All perturbations of the band
+        are drawn in one call from `self.rng`.
 
-            #picking random band to change
-            i = np.random.randint(0, len(changed_band))
-            changed_band[i] = (changed_band[i] + np.random.randint(1, 10)) % 100 
-            # ^^ used modules perturbation in this case, but there other options we can change
+        Args:
+            rows (numpy.ndarray): An `(n, rows_per_band)` uint64 array of band rows,
+                        one row per document.
+            num_probes (int): The number of perturbations (nearby bands) to generate per row. 
 
-            #appending to list 
-            perturbed_bands.append(tuple(changed_band))
-        
-        return perturbed_bands
+        Returns:
+            numpy.ndarray: An `(n, num_probes, rows_per_band)` array holding the
+                perturbed versions of each original band.
+        """
+        perturbed, n_idx, p_idx, cols = self._perturbation_sites(rows, num_probes)
+        perturbed[n_idx, p_idx, cols] ^= np.uint64(1)
+        return perturbed
+    
+    def gaussian(self, rows, num_probes, std_dev=1.0):
+        """
+        This method creates multiple variations of every input band by adding
+        gaussian noise, rounded to an integer, to one randomly chosen hash token.
+        All perturbations of the band are drawn in one call from `self.rng`.
 
-    def bit_flip(self, band, num_probes):
+        Args:
+            rows (numpy.ndarray): An `(n, rows_per_band)` uint64 array of band rows,
+                        one row per document.
+            num_probes (int): The number of perturbations (nearby bands) to generate per row. 
+            std_dev (float): Standard deviation of the noise.
+
+        Returns:
+            numpy.ndarray: An `(n, num_probes, rows_per_band)` array holding the
+                perturbed versions of each original band.
         """
-        This method creates multiple variations of the input band by applying 
-        perturbations to its elements via randomized bit flips within the hash token. 
+        perturbed, n_idx, p_idx, cols = self._perturbation_sites(rows, num_probes)
+
+        # Adding the noise as a wrapped uint64 keeps the token an exact integer hash
+        noise = np.rint(self.rng.normal(0, std_dev, size=cols.shape)).astype(np.int64)
+        perturbed[n_idx, p_idx, cols] += noise.view(np.uint64)
+        return perturbed
+
+    def _perturbation_sites(self, rows, num_probes):
+        """
+        Copies every band `num_probes` times and picks the element each copy perturbs.
+
+        Returns:
+            tuple: The `(n, num_probes, rows_per_band)` copies and the index arrays
+            addressing the chosen element of each copy.
+        """
+        rows = np.asarray(rows, dtype=np.uint64)
+        perturbed = np.repeat(rows[:, None, :], num_probes, axis=1)
+        cols = self.rng.integers(0, rows.shape[1], size=(rows.shape[0], num_probes))
+        n_idx, p_idx = np.ogrid[:rows.shape[0], :num_probes]
+        return perturbed, n_idx, p_idx, cols
+
+    def perturbed_keys(self, rows):
+        """
+        Generates the packed band keys of all perturbations of a block of band rows.
 
         Args:
-            band (tuple): A tuple representing the original hash band, where each 
-                        element corresponds to a hash value.
-            num_probes (int): The number of perturbations (nearby bands) to generate. 
+            rows (numpy.ndarray): An `(n, rows_per_band)` uint64 array of band rows.
 
         Returns:
-            list: A list of tuples, each representing a perturbed version of the 
-                original band. The number of tuples returned is equal to 
-                `num_probes`.
+            numpy.ndarray: An `(n, num_probes)` uint64 array of packed perturbed band keys.
         """
-        perturbed_bands = []
+        return pack_bands(self._perturb_fn()(rows, self.num_probes))
 
-        #flipping the bits in the hash 
-        for _ in range(num_probes):
-            p_band = list(band)
-            i = np.random.randint(0, len(p_band)) 
-            p_band[i] ^= 1  # Flip a bit at the random index
-            perturbed_bands.append(tuple(p_band))
+    def _perturb_fn(self):
+        """Returns the random perturbation function selected by `self.banding_method`."""
+        if self.banding_method == 'nearby_banding':
+            return self.nearby_banding
+        elif self.banding_method == 'bit_flip':
+            return self.bit_flip
+        elif self.banding_method == 'gaussian':
+            return lambda band, num_probes: self.gaussian(band, num_probes)
+        raise ValueError(f"Unknown banding method: {self.banding_method}")
 
-        return perturbed_bands
-    
-    def gaussian(self, band, num_probes, std_dev=1.0):
+    def _descend(self, band_idx, band):
         """
-        This method creates multiple variations of the input band by applying 
-        perturbations to its elements via gaussian noise. 
+        Binary-searches a band into the sorted rows of one band, one row at a time.
 
         Args:
-            band (tuple): A tuple representing the original hash band, where each 
-                        element corresponds to a hash value.
-            num_probes (int): The number of perturbations (nearby bands) to generate. 
+            band_idx (int): Index of the band to search.
+            band (tuple): The band rows of the query.
 
         Returns:
-            list: A list of tuples, each representing a perturbed version of the 
-                original band. The number of tuples returned is equal to 
-                `num_probes`.
+            tuple: `(lo, hi, depth)` where `depth` is the number of leading rows matched and
+            `[lo, hi)` is the range of sorted rows sharing them. When `depth` is smaller than
+            the band length, `lo == hi` is the position where the query would be inserted.
         """
-        perturbed_bands = []
+        _, rows = self.index[band_idx]
+        ranges = prefix_ranges(rows, band)
+        depth = len(ranges) - 1
+        lo, hi = ranges[-1]
+        if depth < len(band):
+            lo = hi = lo + int(np.searchsorted(rows[lo:hi, depth], band[depth]))
+        return lo, hi, depth
+
+    def _shared_rows(self, band, row):
+        """Counts the leading rows that a query band shares with an indexed band row."""
+        shared = 0
+        for a, b in zip(band, row):
+            if a != b:
+                break
+            shared += 1
+        return shared
 
-        #adding gaussian "noise" so that hash is slightly altered
-        for _ in range(num_probes):
-            p_band = list(band)
-            i = np.random.randint(0, len(p_band))
-            noise = np.random.normal(0, std_dev)  # adding Gaussian noise
-            p_band[i] += noise
-            perturbed_bands.append(tuple(p_band))
+    def probe_sequence(self, band_idx, band):
+        """
+        Yields the buckets of one band probed for a query, in probing order.
 
-        return perturbed_bands
+        The first bucket is the exact match (if any). It is followed by the
+        neighbouring buckets in lexicographic order, alternating sides, each
+        side ordered by the number of leading rows it shares with the query.
+        At most `num_probes` neighbours are read per side, and only buckets that
+        share at least `min_shared_rows` leading rows are probed. With one of the random
+        perturbation methods, the perturbed bands are looked up instead.
+
+        Args:
+            band_idx (int): Index of the band to probe.
+            band (tuple): The band rows of the query.
+
+        Yields:
+            numpy.ndarray: Positions (into `doc_ids`) of the documents in each probed bucket.
+        """
+        order, rows = self.index[band_idx]
+        lo, hi, depth = self._descend(band_idx, band)
+        if depth == len(band):
+            yield order[lo:hi]
+
+        if self.banding_method != 'query_directed':
+            keys, positions = self.band_keys[band_idx]
+            for key in self.perturbed_keys(np.array([band], dtype=np.uint64))[0]:
+                k_lo, k_hi = np.searchsorted(keys, key, side='left'), np.searchsorted(keys, key, side='right')
+                if k_hi > k_lo:
+                    yield order[positions[k_lo:k_hi]]
+            return
+
+        left, right = lo, hi
+        for _ in range(self.num_probes):
+            if left > 0 and self._shared_rows(band, rows[left - 1]) >= self.min_shared_rows:
+                b_lo, b_hi, _ = self._descend(band_idx, tuple(rows[left - 1]))
+                yield order[b_lo:b_hi]
+                left = b_lo
+            else:
+                left = -1
+            if 0 <= right < len(rows) and self._shared_rows(band, rows[right]) >= self.min_shared_rows:
+                b_lo, b_hi, _ = self._descend(band_idx, tuple(rows[right]))
+                yield order[b_lo:b_hi]
+                right = b_hi
+            else:
+                right = -1
+            if left < 0 and right < 0:
+                break
+
+    def probe(self, signature):
+        """
+        Finds the candidate neighbours of a MinHash signature by multi-probing every band.
+
+        Args:
+            signature (list): The MinHash signature of the query document.
+
+        Returns:
+            set: Document IDs found in the probed buckets.
+        """
+        candidates = set()
+        for band_idx in range(self.num_bands):
+            start = band_idx * self.rows_per_band
+            band = tuple(signature[start:start + self.rows_per_band])
+            for bucket in self.probe_sequence(band_idx, band):
+                candidates.update(self.doc_ids[pos] for pos in bucket)
+        return candidates
+
+    def index_size(self):
+        """Returns the size of the banding index in bytes."""
+        size = sum(order.nbytes + rows.nbytes for order, rows in self.index)
+        return size + sum(keys.nbytes + positions.nbytes for keys, positions in self.band_keys)
 
-    #Changing the banding method so it checks neighboring bands
     def banding(self, signatures):
         """
-        This method organizes the MinHash signatures into bands and applies a perturbation 
-        strategy to generate nearby bands for each document. It populates an index of candidate 
-        pairs of documents that are likely to be similar based on their perturbed bands.
+        This method indexes every document once per band and collects candidate
+        pairs by multi-probing each document's neighbouring buckets.
+
+        Each band is stored as the band rows of all documents sorted lexicographically,
+        so a bucket is a contiguous run of equal rows and its nearest neighbours are the
+        runs next to it that share the most leading rows. Documents in the same bucket
+        are candidate pairs, and so are documents in buckets up to `num_probes` runs
+        apart that share at least `min_shared_rows` leading rows. Probing only widens
+        which buckets are read, so the index size does not depend on `num_probes`.
 
-        The banding method used is determined by the `self.banding_method` attribute, which 
-        can be one of the following: 'nearby_banding', 'bit_flip', or 'gaussian'.
+        The probing strategy is determined by the `self.banding_method` attribute, which 
+        can be one of the following: 'query_directed', 'nearby_banding', 'bit_flip', or 'gaussian'.
 
         Args:
             signatures (dict): A dictionary where keys are document IDs and values are MinHash signatures (lists or tuples of hash values) for each document.
 
         Returns:
             set: A set of tuples, where each tuple contains two document IDs that are identified 
-            as candidate pairs based on their bands and perturbations.
+            as candidate pairs based on their bands and probes.
         """
-        if self.banding_method == 'nearby_banding':
-            perturb_fn = self.nearby_banding
-        elif self.banding_method == 'bit_flip':
-            perturb_fn = self.bit_flip
-        elif self.banding_method == 'gaussian':
-            perturb_fn = lambda band, num_probes: self.gaussian(band, num_probes)
-        else:
-            raise ValueError(f"Unknown banding method: {self.banding_method}")
+        if self.banding_method != 'query_directed':
+            self._perturb_fn()  # Fail early on an unknown method
 
-        # Process signatures and apply perturbations
-        for doc_id, sig in signatures.items():
+        with span("band", len(signatures)):
+            self.doc_ids, matrix = stack_signatures(signatures, self.num_hashes)
+
+            self.index = []
+            self.band_keys = []
+            self.rng = np.random.default_rng(self.seed)
+            pairs = set()
             for band_idx in range(self.num_bands):
                 start = band_idx * self.rows_per_band
-                band = tuple(sig[start:start + self.rows_per_band])
-                self.index[(band_idx, band)].append(doc_id)
+                block = matrix[:, start:start + self.rows_per_band]
+                order = np.lexsort(block.T[::-1])
+                rows = block[order]
+                self.index.append((order, rows))
+
+                if self.banding_method != 'query_directed':
+                    keys = pack_bands(rows)
+                    positions = np.argsort(keys, kind='stable')
+                    keys = keys[positions]
+                    self.band_keys.append((keys, positions))
+
+                    # Look up every perturbation of the band at once
+                    probes = self.perturbed_keys(rows).ravel()
+                    sources = np.repeat(np.arange(len(rows)), self.num_probes)
+                    k_lo = np.searchsorted(keys, probes, side='left')
+                    k_hi = np.searchsorted(keys, probes, side='right')
+                    hits = np.flatnonzero(k_hi > k_lo)
+                    for source, h_lo, h_hi in zip(sources[hits], k_lo[hits], k_hi[hits]):
+                        a = int(order[source])
+                        pairs.update((min(a, b), max(a, b)) for b in order[positions[h_lo:h_hi]].tolist() if a != b)
+
+                # Buckets are runs of equal rows; `shared` is the number of leading rows
+                # each bucket shares with the one before it.
+                changed = rows[1:] != rows[:-1]
+                boundaries = np.flatnonzero(changed.any(axis=1)) + 1
+                starts = np.concatenate(([0], boundaries, [len(rows)]))
+                shared = changed[boundaries - 1].argmax(axis=1)
+
+                for i in range(len(starts) - 1):
+                    members = order[starts[i]:starts[i + 1]]
+                    pairs.update(combinations(sorted(members.tolist()), 2))
+
+                    if self.banding_method != 'query_directed':
+                        continue
 
-                neighboring_bands = perturb_fn(band, self.num_probes)
-                for neighbor in neighboring_bands:
-                    self.index[(band_idx, neighbor)].append(doc_id)
+                    common = self.rows_per_band
+                    for j in range(i + 1, min(i + 1 + self.num_probes, len(starts) - 1)):
+                        common = min(common, shared[j - 1])
+                        if common < self.min_shared_rows:
+                            break
+                        neighbors = order[starts[j]:starts[j + 1]]
+                        pairs.update((min(a, b), max(a, b)) for a, b in product(members.tolist(), neighbors.tolist()))
 
-        for doc_ids in self.index.values():
-            if len(doc_ids) > 1:
-                self.candidate_pairs.update(combinations(doc_ids, 2))
+            self.candidate_pairs = {(self.doc_ids[a], self.doc_ids[b]) for a, b in pairs}
+        return self.candidate_pairs
 
-        return self.candidate_pairs
\ No newline at end of file
+    def find_candidates_for_text(self, text):
+        """Find candidate neighbours for an input text by computing its MinHash signature and multi-probing every band."""
+        cleaned_text = clean_document(text)
+        shingles = shingle(cleaned_text, self.k)
+        return self.probe(minhash(shingles, self.num_hashes))
@@ -1,14 +1,16 @@
 import argparse
 import time
-from utils.utils import read_tsv
+from utils.utils import read_tsv, iter_tsv
 from deduplication.LSH import LSH
 from deduplication.LSHImproved import LSHImproved
 from deduplication.LSHForest import LSHForest
 from deduplication.dedup import Baseline
+from deduplication.tuning import tune_parameters, estimate_cost, format_estimate
 from utils.use_cases import collection_deduplication, nearest_neighbor_search
+from utils.instrumentation import Instrumentation, set_instrumentation, span
+from utils.profiling import StageProfiler, MODES
 import logging
 import os
-import psutil
 import sys
 
 
@@ -41,12 +43,25 @@ if __name__ == "__main__":
         -s, --save (str): Optional. Whether to output results to a text file ('y' or 'n').
         -e, --example (str): Optional. Document to query.
         -n, --numhash (int): Optional. Number of hash functions to use.
-        -b, --numband (int): Optional. Number of bands.
+        -b, --numband (int): Optional. Number of bands, or 'auto' to choose bands and rows per band from --threshold.
         -r, --row (int): Optional. Number of rows per band.
         -k, --shinlen (int): Optional. Length of shingles.
         -c, --treesize (int): Optional. Size of the tree.
+        -q, --topk (int): Optional. Number of neighbours returned by an LSH_forest 'ann' query.
         -m, --method (str): Optional. Default is 'LSH'. Specifies the method to use. 
                             Options: 'baseline', 'LSH', 'LSH_mp', 'LSH_forest'.
+        -M, --memory-budget (int): Optional. Megabytes of hashes the streaming 'baseline' keeps in memory before spilling to disk.
+        --threshold (float): Optional. Target Jaccard similarity for '-b auto'.
+        --fn-weight, --fp-weight (float): Optional. Weights of false negatives and false positives for '-b auto'.
+        --max-seconds (float): Optional. Time budget of the run. Runs projected to exceed it are refused.
+        --max-memory (int): Optional. Memory budget of the run in megabytes. Runs projected to exceed it are refused.
+        --dry-run: Optional. Project the candidate pairs, index size, memory and runtime from a sample and exit.
+        --force: Optional. Run even when the projection exceeds --max-seconds or --max-memory.
+        --report (str): Optional. Path of a JSON report of the time, CPU time, memory and throughput of every stage.
+        --prometheus (str): Optional. Path of the same figures in the Prometheus text format.
+        --profile (str): Optional. Profile every stage: 'cpu' (cProfile), 'sample' (stack sampling) or 'memory' (tracemalloc).
+        --profile-dir (str): Optional. Default is 'profiles'. Directory of the per-stage profiles.
+        --profile-top (int): Optional. Default is 25. Rows of the per-stage top-N tables.
 
     Returns:
         Namespace: An object containing the parsed arguments.
@@ -56,20 +71,34 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--save", required=False, help="Output to txt y/n")
     parser.add_argument("-e", "--example", required=False, help="Document to Query")
     parser.add_argument("-n", "--numhash", required=False, help="Number of hash functions")
-    parser.add_argument("-b", "--numband", required=False, help="Number of bands")
+    parser.add_argument("-b", "--numband", required=False, help="Number of bands, or 'auto'")
     parser.add_argument("-r", "--row", required=False, help="Rows per band")
     parser.add_argument("-k", "--shinlen", required=False, help="Length of Shingles")
     parser.add_argument("-c", "--treesize", required=False, help="Tree size")
+    parser.add_argument("-q", "--topk", required=False, default=10, type=int, help="Number of neighbours for LSH_forest ann queries")
     parser.add_argument("-m", "--method", required=False, default="LSH", choices=['baseline', 'LSH', 'LSH_mp', 'LSH_forest'], help="Method - choose 'basline', 'LSH', 'LSH_mp' or 'LSH_forest'")
+    parser.add_argument("-M", "--memory-budget", required=False, default=256, type=int, help="Megabytes of hashes held in memory by the streaming baseline")
+    parser.add_argument("--threshold", required=False, default=0.8, type=float, help="Target Jaccard similarity for -b auto")
+    parser.add_argument("--fn-weight", required=False, default=0.5, type=float, help="Weight of false negatives for -b auto")
+    parser.add_argument("--fp-weight", required=False, default=0.5, type=float, help="Weight of false positives for -b auto")
+    parser.add_argument("--max-seconds", required=False, type=float, help="Time budget in seconds")
+    parser.add_argument("--max-memory", required=False, type=int, help="Memory budget in megabytes")
+    parser.add_argument("--dry-run", action="store_true", help="Estimate the cost of the run from a sample and exit")
+    parser.add_argument("--force", action="store_true", help="Run even when the estimate exceeds the budgets")
+    parser.add_argument("--report", required=False, help="Path of a JSON report of every stage")
+    parser.add_argument("--prometheus", required=False, help="Path of the stage metrics in Prometheus text format")
+    parser.add_argument("--profile", required=False, choices=MODES, help="Profile every stage")
+    parser.add_argument("--profile-dir", required=False, default="profiles", help="Directory of the per-stage profiles")
+    parser.add_argument("--profile-top", required=False, default=25, type=int, help="Rows of the per-stage top-N tables")
 
     args = parser.parse_args()
     method = args.method
 
-    def log_memory_usage(message="Memory usage"):
-        process = psutil.Process(os.getpid())
-        mem_info = process.memory_info()
-        logging.info(f"{message}: {mem_info.rss / (1024 * 1024):.2f} MB")
-    
+    # Every stage (read, clean, shingle, sign, band, cluster, write) is logged as it ends
+    profiler = StageProfiler(args.profile, args.profile_dir, args.profile_top) if args.profile else None
+    instrumentation = Instrumentation(run=f"deduplication-{method}", metadata=vars(args), log_spans=True, profiler=profiler)
+    set_instrumentation(instrumentation)
+
     if method == "LSH_forest":
         default_num_hashes = 200
         default_num_bands = 10
@@ -85,26 +114,27 @@ if __name__ == "__main__":
 
     # Assign either the provided values or the default ones
     num_hashes = int(args.numhash) if args.numhash is not None else default_num_hashes
-    num_bands = int(args.numband) if args.numband is not None else default_num_bands
+    auto = str(args.numband).lower() == 'auto'
+    num_bands = default_num_bands if args.numband is None or auto else int(args.numband)
     rows_per_band = int(args.row) if args.row is not None else default_rows_per_band
     k = int(args.shinlen) if args.shinlen is not None else default_k
     num_trees = int(args.treesize) if args.treesize is not None else default_num_trees
     
-    # Check whether the initial condition is met
-    if method == "LSH":
-        if num_hashes != num_bands * rows_per_band:
-            logging.error("Hash functions must equal bands * rows_per_band")
-            sys.exit(1)
-
-    elif method == "LSH_forest":
-        if num_hashes/num_trees != num_bands * rows_per_band:
-            logging.error("Invalid tree size")
-            sys.exit(1)
+    # Check whether the initial condition is met (auto mode chooses valid parameters itself)
+    if not auto:
+        if method == "LSH":
+            if num_hashes != num_bands * rows_per_band:
+                logging.error("Hash functions must equal bands * rows_per_band")
+                sys.exit(1)
+
+        elif method == "LSH_forest":
+            if num_hashes // num_trees < num_bands * rows_per_band:
+                logging.error("Invalid tree size")
+                sys.exit(1)
         
     def model(docs, num_hashes=num_hashes, num_bands=num_bands, rows_per_band=rows_per_band, k=k, method=method, num_trees = num_trees):
         """Use LSH for collection deduplication."""
 
-        start_time = time.time() 
         if method == "LSH_mp":
             logging.info("Initializing LSH with %d hashes, %d bands, and %d rows per band", num_hashes, num_bands, rows_per_band)
             logging.info("Using LSHImproved with multi-probe lookup.")
@@ -119,67 +149,90 @@ if __name__ == "__main__":
             logging.info("Initializing LSH with %d hashes, %d bands, and %d rows per band", num_hashes, num_bands, rows_per_band)
             logging.info("Using basic LSH.")
             lsh = LSH(num_hashes=num_hashes, num_bands=num_bands, rows_per_band=rows_per_band, k=k)
-       
-        initialization_time = time.time() - start_time  #step 1 
-        logging.info("LSH initialization time: %.2f seconds", initialization_time)
 
         logging.info("Computing MinHash signatures for the documents.")
-        
-        start_time_minhash = time.time()  # Start timing MinHash signature computation
         signatures = lsh.compute_minhash_signatures(docs)
-        end_time_minhash = time.time()  # End timing MinHash signature computation
-        logging.info("MinHash signatures computed in %.2f seconds.", end_time_minhash - start_time_minhash)
 
         logging.info("Applying LSH banding technique.")
-        start_time_banding = time.time()  # Start timing LSH banding
         lsh.banding(signatures)
-        end_time_banding = time.time()  # End timing LSH banding
-        logging.info("LSH banding completed in %.2f seconds.", end_time_banding - start_time_banding)
 
         return lsh
 
     logging.info("Reading input file from %s", args.indir)
-    start_time_reading = time.time()  # Start timing file reading
-    tsv_dict = read_tsv(args.indir)
-    end_time_reading = time.time()  # End timing file reading
-    logging.info("Input file read in %.2f seconds.", end_time_reading - start_time_reading)
+    if method == 'baseline' and (args.case).lower() == 'deduplication':
+        # The baseline streams the file, so the corpus does not have to fit in memory
+        tsv_dict = iter_tsv(args.indir)
+    else:
+        with span("read") as stage:
+            tsv_dict = read_tsv(args.indir)
+            stage.items = len(tsv_dict)
 
     logging.info("Starting the deduplication process.")
     start_time_total = time.time()  # Start timing the entire deduplication process
+    memory_budget = args.max_memory * 1024 * 1024 if args.max_memory else None
     if method == 'baseline':
+        if args.dry_run:
+            logging.info("The baseline streams the file and keeps at most %d MB of hashes in memory; nothing to estimate.", args.memory_budget)
+            sys.exit(0)
         lsh = Baseline()
     else:
-        lsh = model(tsv_dict)
+        if auto:
+            logging.info("Tuning bands and rows per band for threshold %.2f on a sample.", args.threshold)
+            tuned = tune_parameters(tsv_dict, args.threshold, num_hashes, k, num_trees if method == "LSH_forest" else 1,
+                                    args.fn_weight, args.fp_weight, args.max_seconds, memory_budget)
+            num_hashes, num_bands, rows_per_band = tuned["num_hashes"], tuned["num_bands"], tuned["rows_per_band"]
+            logging.info("Auto-tuned parameters: %d hashes, %d bands, %d rows per band (expected recall %.3f)",
+                         num_hashes, num_bands, rows_per_band, tuned["expected_recall"])
+        if args.dry_run or args.max_seconds is not None or memory_budget is not None:
+            logging.info("Estimating the cost of the run on a sample.")
+            estimate = estimate_cost(tsv_dict, num_hashes, num_bands, rows_per_band, k, num_trees if method == "LSH_forest" else 1,
+                                     time_budget=args.max_seconds, memory_budget=memory_budget)
+            for line in format_estimate(estimate):
+                logging.info(line)
+            if args.dry_run:
+                sys.exit(1 if estimate["over_budget"] else 0)
+            if estimate["over_budget"] and args.force:
+                logging.warning("Projected %s exceeds the budget; running anyway (--force).", " and ".join(estimate["over_budget"]))
+            elif estimate["over_budget"]:
+                logging.error("Projected %s exceeds the budget; refusing to run (use --force to override).", " and ".join(estimate["over_budget"]))
+                sys.exit(1)
+        lsh = model(tsv_dict, num_hashes=num_hashes, num_bands=num_bands, rows_per_band=rows_per_band)
     
     if (args.case).lower() == 'deduplication':
-        start_time_deduplication = time.time()  # Start timing deduplication
         if method =='baseline':
-            clusters = lsh.collection_deduplication(tsv_dict)
+            # Clusters come out of the merge one at a time and are written as they arrive
+            clusters = lsh.stream_clusters(tsv_dict, memory_budget=args.memory_budget * 1024 * 1024)
         else:
-            clusters = collection_deduplication(lsh)
-        end_time_deduplication = time.time()  # End timing deduplication
+            clusters = collection_deduplication(lsh).values()
 
+        num_clusters = num_documents = 0
+        output_file = None
         if args.save == 'y':
             name = os.path.splitext(os.path.basename(args.indir))[0]
-            method = args.method
-            with open(f'./output/{name}-{method}.txt', 'w') as f:
-                for cluster_id, doc_ids in clusters.items():
+            output_file = open(f'./output/{name}-{method}.txt', 'w')
+        # For the baseline this also reads and merges the file as the clusters stream out
+        with span("write") as stage:
+            for doc_ids in clusters:
+                num_clusters += 1
+                num_documents += len(doc_ids)
+                if output_file:
                     # Join the doc_ids with spaces and write to the file
                     doc_ids_str = ' '.join(map(str, doc_ids))
-                    f.write(f"{doc_ids_str}\n")
+                    output_file.write(f"{doc_ids_str}\n")
+            stage.items = num_clusters
+        if output_file:
+            output_file.close()
 
-        logging.info("Deduplication process completed in %.2f seconds.", end_time_deduplication - start_time_deduplication)
-        logging.info("Input Documents: %d", len(tsv_dict))
+        logging.info("Input Documents: %d", num_documents)
         if method =='baseline':
             pass
         else:
-            logging.info("Unique Documents: %d", len(lsh.unique_docs))       
-        logging.info("Clusters Formed: %d", len(clusters))
+            logging.info("Unique Documents: %d", len(lsh.unique_docs))
+            logging.info("Exact Duplicates: %d", sum(len(ids) for ids in lsh.exact_duplicates.values()))
+        logging.info("Clusters Formed: %d", num_clusters)
     elif (args.case).lower() == 'ann':
-        start_time_ann = time.time()  # Start timing nearest neighbor search
-        candidates = nearest_neighbor_search(args.example, lsh)
-        end_time_ann = time.time()  # End timing nearest neighbor search
-        logging.info("Nearest neighbors search completed in %.2f seconds.", end_time_ann - start_time_ann)
+        with span("query", 1):
+            candidates = nearest_neighbor_search(args.example, lsh, top_k=args.topk)
         logging.info(f"Nearest neighbors for the query : {candidates}")
     else:
         logging.error("Enter either deduplication or ann for -t")
@@ -187,7 +240,15 @@ if __name__ == "__main__":
     end_time_total = time.time()  # End timing the entire process
     logging.info("Total deduplication process took %.2f seconds.", end_time_total - start_time_total)
 
-    log_memory_usage("Final memory usage")
+    instrumentation.log_summary(logging.getLogger())
+    if args.report:
+        instrumentation.write_json(args.report)
+    if args.prometheus:
+        instrumentation.write_prometheus(args.prometheus)
+    if profiler is not None:
+        paths = profiler.dump()
+        profiler.close()
+        logging.info("Wrote %d profile files to %s", len(paths), args.profile_dir)
 
 
 # python -m deduplication -d './data/onek.tsv' -t 'deduplication' -s 'y'
@@ -0,0 +1,285 @@
+"""
+End-to-end benchmark of the deduplication methods.
+
+Every method runs on the first `size` documents of a corpus, one stage at a time, in a
+fresh process so that peak memory is measured per run. Stages are recorded as the spans
+of `utils.instrumentation` (clean, shingle, sign, band, cluster), the names the CLI and
+`load.py` report. Run from the `src` directory:
+
+    python -m deduplication.bench --data ../data/files/onek.tsv --sizes 1000 --output bench.json
+
+Each size is read from the first `--data` file that has enough documents; sizes without
+one are skipped (`utils.synthetic_corpus` generates corpora of any size). Two result
+files, e.g. from two commits, are compared with
+
+    python -m deduplication.bench --compare old.json new.json
+
+which prints the change of every metric and exits with status 1 if a run got slower,
+bigger or used more memory than the tolerance allows.
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from deduplication.dedup import Baseline, RECORD_DTYPE
+from deduplication.LSH import LSH
+from deduplication.LSHImproved import LSHImproved
+from deduplication.LSHForest import LSHForest
+from utils.utils import iter_tsv
+from utils.use_cases import collection_deduplication
+from utils.instrumentation import Instrumentation, set_instrumentation, span, peak_rss_mb
+
+METHODS = {"Baseline": Baseline, "LSH": LSH, "LSHImproved": LSHImproved, "LSHForest": LSHForest}
+"""METHODS (dict): The benchmarked deduplication classes by name"""
+
+DEFAULT_PARAMS = {
+    "Baseline": {},
+    "LSH": {"num_hashes": 100, "num_bands": 20, "rows_per_band": 5, "k": 8},
+    "LSHImproved": {"num_hashes": 100, "num_bands": 20, "rows_per_band": 5, "k": 8},
+    "LSHForest": {"num_hashes": 200, "num_bands": 10, "rows_per_band": 4, "num_trees": 5, "k": 8},
+}
+"""DEFAULT_PARAMS (dict): Constructor arguments of each method, the CLI defaults of `python -m deduplication`"""
+
+SIZES = (1000, 10000, 100000, 1000000)
+
+TIMED_METRICS = ("total_seconds", "peak_rss_mb", "index_bytes")
+"""TIMED_METRICS (tuple): Result metrics where an increase is a regression, besides the stage times"""
+
+
+def index_bytes(model, num_docs):
+    """
+    Returns the size of a method's index in bytes.
+
+    For `LSHImproved` this is the size of its sorted band rows, for `LSHForest` its
+    prefix trees and for `Baseline` its 24-byte hash records. For `LSH` it is only an
+    estimate: the `sys.getsizeof` of its dictionary of band hashes (keys, hash strings
+    and ID lists, not the IDs themselves), see `index_bytes_estimated`.
+    """
+    if isinstance(model, Baseline):
+        return RECORD_DTYPE.itemsize * num_docs
+    if isinstance(model, LSHImproved):
+        return model.index_size()
+    if isinstance(model, LSHForest):
+        return sum(order.nbytes + prefixes.nbytes for order, prefixes in model.trees)
+    return sys.getsizeof(model.index) + sum(sys.getsizeof(key) + sys.getsizeof(key[1]) + sys.getsizeof(doc_ids)
+                                            for key, doc_ids in model.index.items())
+
+
+def index_bytes_estimated(model):
+    """Whether `index_bytes` of a model is a `sys.getsizeof` estimate rather than a measured size."""
+    return not isinstance(model, (Baseline, LSHImproved, LSHForest))
+
+
+def run_method(method, docs, n_jobs=-1, keep_clusters=False, **params):
+    """
+    Runs one deduplication method on a corpus and measures every stage.
+
+    The run records to its own `Instrumentation`, so the stages are the spans of
+    `compute_minhash_signatures` (clean, which includes exact deduplication, shingle and
+    sign), `banding` (band) and `utils.use_cases.collection_deduplication` (cluster). The
+    band stage of `LSHForest` includes building its prefix trees, which are its index.
+    `Baseline` has the cluster stage (`Baseline.collection_deduplication`) and the sign
+    stage of its hashing inside it, so its stage times add up to more than the total.
+
+    Args:
+        method (str): A key of `METHODS`.
+        docs (dict): Document IDs to document strings.
+        n_jobs (int): Number of parallel workers for the MinHash stage (-1 uses all cores).
+        keep_clusters (bool): Also return the clusters themselves, as `cluster_members`.
+        **params: Constructor arguments, `DEFAULT_PARAMS[method]` if none are given.
+
+    Returns:
+        dict: `method`, `size`, `params`, `stages` (`seconds` of wall time, `cpu_seconds`,
+        `rss_delta_mb` and `items` per span name), `total_seconds` (wall time of the run),
+        `peak_rss_mb`, `candidate_pairs`, `index_bytes`, `index_bytes_estimated` (True when
+        `index_bytes` is an estimate, see `index_bytes`) and `clusters`.
+    """
+    params = params or DEFAULT_PARAMS[method]
+    model = METHODS[method](**params)
+    instrumentation = Instrumentation(run=f"bench-{method}")
+    previous = set_instrumentation(instrumentation)
+    start = time.perf_counter()
+    try:
+        if method == "Baseline":
+            with span("cluster", len(docs)):
+                clusters = model.collection_deduplication(docs)
+            candidate_pairs = 0
+        else:
+            model.banding(model.compute_minhash_signatures(docs, n_jobs=n_jobs))
+            if isinstance(model, LSHForest):
+                with span("band", len(model.signatures)):
+                    model.build_trees(model.signatures)
+            clusters = collection_deduplication(model)
+            candidate_pairs = len(model.candidate_pairs)
+    finally:
+        set_instrumentation(previous)
+    total_seconds = time.perf_counter() - start
+
+    stages = {name: {"seconds": totals.wall_seconds, "cpu_seconds": totals.cpu_seconds,
+                     "rss_delta_mb": totals.rss_delta_mb, "items": totals.items}
+              for name, totals in instrumentation.spans.items()}
+
+    result = {
+        "method": method,
+        "size": len(docs),
+        "params": params,
+        "stages": stages,
+        "total_seconds": total_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "candidate_pairs": candidate_pairs,
+        "index_bytes": index_bytes(model, len(docs)),
+        "index_bytes_estimated": index_bytes_estimated(model),
+        "clusters": len(clusters),
+    }
+    if keep_clusters:
+        result["cluster_members"] = list(clusters.values())
+    return result
+
+
+def _run_file(method, path, size, n_jobs, params):
+    docs = dict(itertools.islice(iter_tsv(path), size))
+    result = run_method(method, docs, n_jobs, **params)
+    result["data"] = path
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(methods=None, sizes=SIZES, data=(), n_jobs=-1, output=None):
+    """
+    Runs every method at every size, each run in a fresh process.
+
+    Args:
+        methods: names of the methods to run, all of `METHODS` by default
+        sizes: numbers of documents
+        data: paths of TSV corpora; each size uses the first one with enough documents
+        n_jobs: number of parallel workers for the MinHash stage (-1 for all cores)
+        output: path of the JSON results file, None to skip writing
+
+    Returns:
+        dict: `commit`, `created`, `python`, `platform`, `cpu_count` and `results`, one
+        `run_method` result (plus its `data` path) per run.
+    """
+    methods = methods or list(METHODS)
+    num_docs = {path: sum(1 for _ in iter_tsv(path)) for path in data}
+
+    results = []
+    # A spawned process per run, so the peak RSS of one run does not carry over to the next.
+    # Executor workers are not daemonic, so the MinHash stage can still start joblib workers.
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        path = next((path for path in data if num_docs[path] >= size), None)
+        if path is None:
+            logging.warning("Skipping size %d: no corpus has that many documents", size)
+            continue
+        for method in methods:
+            logging.info("Running %s on %d documents from %s", method, size, path)
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                result = executor.submit(_run_file, method, path, size, n_jobs, DEFAULT_PARAMS[method]).result()
+            logging.info("%s on %d documents took %.2f seconds, peak RSS %.1f MB",
+                         method, size, result["total_seconds"], result["peak_rss_mb"])
+            results.append(result)
+
+    report = {
+        "commit": _git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+    return report
+
+
+def compare(old, new, tolerance=0.1, min_seconds=0.05):
+    """
+    Compares two `run_benchmark` reports run by run.
+
+    Runs are matched on (method, size). A stage time, the total time, the peak RSS or the
+    index size is a regression when it grew by more than `tolerance`; times that changed by
+    less than `min_seconds` are treated as noise.
+
+    Args:
+        old (dict): The reference report.
+        new (dict): The report to check.
+        tolerance (float): Allowed relative increase.
+        min_seconds (float): Smallest time difference that can be a regression.
+
+    Returns:
+        list: One dict per compared metric with `method`, `size`, `metric`, `old`, `new`,
+        `change` (relative), `regression` and `estimated` (an `index_bytes` estimate, see
+        `index_bytes`).
+    """
+    reference = {(result["method"], result["size"]): result for result in old["results"]}
+    rows = []
+    for result in new["results"]:
+        before = reference.get((result["method"], result["size"]))
+        if before is None:
+            continue
+        metrics = [(f"{name}_seconds", before["stages"][name]["seconds"], stage["seconds"])
+                   for name, stage in result["stages"].items() if name in before["stages"]]
+        metrics += [(metric, before[metric], result[metric]) for metric in TIMED_METRICS + ("candidate_pairs", "clusters")]
+        # Reports written before the flag existed only estimated the LSH index
+        estimated = result.get("index_bytes_estimated", result["method"] == "LSH")
+        for metric, old_value, new_value in metrics:
+            change = (new_value - old_value) / old_value if old_value else 0.0
+            regression = metric not in ("candidate_pairs", "clusters") and change > tolerance
+            if metric.endswith("seconds") and new_value - old_value < min_seconds:
+                regression = False
+            rows.append({"method": result["method"], "size": result["size"], "metric": metric,
+                         "old": old_value, "new": new_value, "change": change, "regression": regression,
+                         "estimated": metric == "index_bytes" and estimated})
+    return rows
+
+
+def format_report(rows):
+    """Formats the rows of `compare` as a text table; estimated figures are marked as such."""
+    lines = [f"{'method':<12} {'size':>8} {'metric':<22} {'old':>14} {'new':>14} {'change':>8}"]
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        metric = f"{row['metric']} (estimate)" if row.get("estimated") else row["metric"]
+        lines.append(f"{row['method']:<12} {row['size']:>8} {metric:<22} {row['old']:>14.4g} "
+                     f"{row['new']:>14.4g} {row['change']:>+8.1%}{flag}")
+    num_regressions = sum(row["regression"] for row in rows)
+    lines.append(f"{num_regressions} regression(s) in {len(rows)} compared metrics")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Benchmark the deduplication methods")
+    parser.add_argument("--methods", nargs="+", choices=list(METHODS), default=list(METHODS), help="Methods to run (default: all)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(SIZES), help="Numbers of documents")
+    parser.add_argument("--data", nargs="+", default=[], help="TSV corpora; each size uses the first with enough documents")
+    parser.add_argument("--jobs", type=int, default=-1, help="Workers for the MinHash stage (-1 for all cores)")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two results files instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative increase before a metric is a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as old_file, open(args.compare[1]) as new_file:
+            rows = compare(json.load(old_file), json.load(new_file), args.tolerance)
+        print(format_report(rows))
+        sys.exit(1 if any(row["regression"] for row in rows) else 0)
+
+    if not args.data:
+        parser.error("--data is required unless --compare is given")
+    run_benchmark(args.methods, args.sizes, args.data, args.jobs, args.output)
@@ -1,11 +1,267 @@
+import json
 import math
+import struct
 import mmh3
 import bitarray
 from nltk import ngrams
+import numpy as np
 import random
+from itertools import chain
+from collections import deque
 
-class BloomFilter:
-    def __init__(self, n: int, f: float):
+MASK64 = (1 << 64) - 1
+
+
+def hash_pairs(items):
+    """
+    Hashes every item once with 128-bit MurmurHash3.
+
+    `mmh3.hash64` returns the 128-bit x64 MurmurHash3 digest as its two 64-bit halves,
+    which serve as the two base hashes of Kirsch-Mitzenmacher double hashing.
+
+    Args:
+        items: iterable of strings
+
+    Returns:
+        numpy.ndarray: An `(len(items), 2)` uint64 array of hash halves.
+    """
+    halves = chain.from_iterable(mmh3.hash64(item, signed=False) for item in items)
+    return np.fromiter(halves, dtype=np.uint64).reshape(-1, 2)
+
+
+def km_indices(h1, h2, k, m):
+    """
+    Derives k bit indices per item with Kirsch-Mitzenmacher double hashing, `(h1 + i * h2) % m`.
+
+    The arithmetic wraps at 64 bits, the same as `(h1 + i * h2) & MASK64` on Python ints.
+
+    Args:
+        h1, h2: uint64 arrays of base hashes, one entry per item
+        k: number of indices per item
+        m: size of the bit array
+
+    Returns:
+        numpy.ndarray: An `(len(h1), k)` uint64 array of bit indices.
+    """
+    i = np.arange(k, dtype=np.uint64)
+    return (h1[:, None] + i * h2[:, None]) % np.uint64(m)
+
+
+def new_bit_array(m):
+    """
+    Creates a zeroed bit array of at least m bits together with a uint64 word view of it.
+
+    The bit array is little-endian and padded to whole 64-bit words, so bit `i` is bit
+    `i % 64` of word `i // 64`. Both objects share the same memory: single bits can be set
+    through the bitarray and whole batches through the word view.
+
+    Returns:
+        tuple: `(bit_array, words)`
+    """
+    bit_array = bitarray.bitarray(((m + 63) // 64) * 64, endian='little')
+    bit_array.setall(0)
+    return bit_array, np.frombuffer(bit_array, dtype=np.uint64)
+
+
+def set_bits(words, indices):
+    """Sets the given bit indices (any shape) in a uint64 word array."""
+    # ufunc.at does not check for read-only arrays (e.g. a filter opened from a read-only mapping)
+    if not words.flags.writeable:
+        raise ValueError("The filter is read-only")
+    indices = indices.ravel()
+    np.bitwise_or.at(words, indices >> np.uint64(6), np.uint64(1) << (indices & np.uint64(63)))
+
+
+def check_bits(words, indices):
+    """Returns, for each row of an `(items, k)` index array, whether all of its bits are set."""
+    bits = (words[indices >> np.uint64(6)] >> (indices & np.uint64(63))) & np.uint64(1)
+    return bits.astype(bool).all(axis=1)
+
+
+def read_packed(words, slot, width):
+    """Returns the `width`-bit value stored in `slot` of a bit-packed uint64 word array."""
+    bit = slot * width
+    word, offset = bit >> 6, bit & 63
+    value = int(words[word]) >> offset
+    if offset + width > 64:
+        value |= int(words[word + 1]) << (64 - offset)
+    return value & ((1 << width) - 1)
+
+
+def write_packed(words, slot, width, value):
+    """Stores a `width`-bit value in `slot` of a bit-packed uint64 word array."""
+    mask = (1 << width) - 1
+    bit = slot * width
+    word, offset = bit >> 6, bit & 63
+    words[word] = (int(words[word]) & ~(mask << offset) | (value << offset)) & MASK64
+    if offset + width > 64:
+        shift = 64 - offset
+        words[word + 1] = int(words[word + 1]) & ~(mask >> shift) | (value >> shift)
+
+
+def read_packed_many(words, slots, width):
+    """Vectorized `read_packed` for an array of slots (any shape)."""
+    bit = slots.astype(np.uint64) * np.uint64(width)
+    word, offset = bit >> np.uint64(6), bit & np.uint64(63)
+    value = words[word] >> offset
+    # The high part comes from the next word; a shift by 64 is undefined, so mask it out
+    high = words[word + np.uint64(1)] << ((np.uint64(64) - offset) & np.uint64(63))
+    value |= np.where(offset == 0, np.uint64(0), high)
+    return value & np.uint64((1 << width) - 1)
+
+
+def fill_packed_many(words, slots, width, values):
+    """Stores values in empty (zero) slots of a bit-packed uint64 word array."""
+    bit = slots.astype(np.uint64) * np.uint64(width)
+    word, offset = bit >> np.uint64(6), bit & np.uint64(63)
+    values = values.astype(np.uint64)
+    np.bitwise_or.at(words, word, values << offset)
+    high = np.where(offset == 0, np.uint64(0), values >> ((np.uint64(64) - offset) & np.uint64(63)))
+    np.bitwise_or.at(words, word + np.uint64(1), high)
+
+
+FILE_MAGIC = b"BLOOMF01"
+
+
+class PersistentFilter:
+    """
+    Persistence shared by the filters that keep their table in a uint64 word array.
+
+    A saved filter is a small header followed by the raw 64-bit words of the table:
+    the magic bytes `BLOOMF01`, a little-endian uint32 header length, a JSON header with
+    the class name and the fields in `header_fields`, and zero padding up to a multiple
+    of 8 bytes. Because the words start at an aligned offset, `open` can memory-map them,
+    so several processes (e.g. Flask workers) share one read-only copy of the filter.
+    """
+    header_fields = ("n", "f", "m")
+    """header_fields (tuple): Attributes saved in the header."""
+
+    def _header(self):
+        return {field: getattr(self, field) for field in self.header_fields}
+
+    def save(self, path):
+        """
+        Writes the filter to a file.
+
+        Args:
+            path: destination file path
+        """
+        header = json.dumps({"class": type(self).__name__, **self._header()}).encode()
+        padding = -(len(FILE_MAGIC) + 4 + len(header)) % 8
+        with open(path, "wb") as file:
+            file.write(FILE_MAGIC + struct.pack("<I", len(header)) + header + b"\0" * padding)
+            file.write(self.words.tobytes())
+
+    @classmethod
+    def open(cls, path, mmap=True, writable=False):
+        """
+        Loads a filter written by `save`.
+
+        Args:
+            path: file path
+            mmap: memory-map the bit array instead of reading it into memory
+            writable: with `mmap`, open the mapping read-write so `add` updates the file
+
+        Returns:
+            The filter, with the same parameters (and hash seeds) as the saved one.
+
+        Raises:
+            ValueError: If the file is not a saved filter of this class.
+        """
+        with open(path, "rb") as file:
+            magic = file.read(len(FILE_MAGIC))
+            if magic != FILE_MAGIC:
+                raise ValueError(f"{path} is not a saved filter")
+            (length,) = struct.unpack("<I", file.read(4))
+            header = json.loads(file.read(length))
+        if header.pop("class") != cls.__name__:
+            raise ValueError(f"{path} does not contain a {cls.__name__}")
+
+        offset = len(FILE_MAGIC) + 4 + length
+        offset += -offset % 8
+        num_words = cls._num_words(header)
+        if mmap:
+            words = np.memmap(path, dtype=np.uint64, mode="r+" if writable else "r", offset=offset, shape=(num_words,))
+        else:
+            words = np.fromfile(path, dtype=np.uint64, offset=offset, count=num_words)
+        return cls._from_words(header, words)
+
+    def flush(self):
+        """Writes pending changes of a filter opened with `mmap=True, writable=True` to its file."""
+        if isinstance(self.words, np.memmap):
+            self.words.flush()
+
+    @staticmethod
+    def _num_words(header):
+        """Returns the number of words of the table described by a header (`m` bits)."""
+        return (header["m"] + 63) // 64
+
+
+class BitArrayFilter(PersistentFilter):
+    """
+    Persistence, merging and fill statistics shared by the filters that store a plain bit array.
+    """
+    header_fields = ("n", "f", "m", "k")
+    """header_fields (tuple): Attributes saved in the header; filters must agree on them to be merged."""
+
+    @classmethod
+    def _from_words(cls, header, words):
+        """Builds a filter around an existing word array without re-deriving its parameters."""
+        bloom = cls.__new__(cls)
+        for field, value in header.items():
+            setattr(bloom, field, value)
+        bloom.words = words
+        bloom.bit_array = bitarray.bitarray(buffer=words, endian="little")
+        bloom.n_bytes = words.nbytes
+        return bloom
+
+    def _merge(self, other, op):
+        if type(other) is not type(self) or other._header() != self._header():
+            raise ValueError("Only filters of the same class built with the same parameters can be merged")
+        return type(self)._from_words(self._header(), op(self.words, other.words))
+
+    def union(self, other):
+        """
+        Returns a filter containing every item of both filters, e.g. to combine per-shard filters.
+
+        Args:
+            other: a filter of the same class with the same parameters
+
+        Raises:
+            ValueError: If the filters are not compatible.
+        """
+        return self._merge(other, np.bitwise_or)
+
+    def intersection(self, other):
+        """
+        Returns a filter approximating the items common to both filters. It answers True for
+        every common item; its false positive rate is at most that of either input.
+
+        Args:
+            other: a filter of the same class with the same parameters
+
+        Raises:
+            ValueError: If the filters are not compatible.
+        """
+        return self._merge(other, np.bitwise_and)
+
+    def fill_ratio(self):
+        """Returns the fraction of bits of the bit array that are set."""
+        return self.bit_array.count() / self.m
+
+    def estimated_fpr(self):
+        """Returns the false positive rate implied by the current fill ratio, `fill_ratio ** k`."""
+        return self.fill_ratio() ** self.k
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+
+class BloomFilter(BitArrayFilter):
+    def __init__(self, n: int, f: float, k: int = None):
         """
         Creates a Bloom Filter object.
         """
@@ -15,28 +271,59 @@ class BloomFilter:
         """f (int): Desired false positive rate"""
         self.m = int(-math.log(self.f) * self.n / (math.log(2)**2))
         """m (int): Size of bit array"""
-        self.k = int(self.m * math.log(2) / self.n)
-        """k (int): Number of hash functions"""
-        self.n_bytes = (self.m + 7) // 8
+        self.k = k or int(self.m * math.log(2) / self.n)
+        """k (int): Number of hash functions, derived from m and n unless given"""
+        self.bit_array, self.words = new_bit_array(self.m)
+        """bit_array: The bit array; words: uint64 view of the same memory for batch operations"""
+        self.n_bytes = self.words.nbytes
         """n_bytes (int): Number of bytes required to store bit array"""
-        self.bit_array = bitarray.bitarray(self.n_bytes * 8)
-        """bit_array: Create the bit array"""
-        self.bit_array.setall(0)  # Set all bits to 0
+
+    def _item_ngrams(self, item):
+        """Lists the 1- to 3-word n-grams of an item, each generated and joined exactly once."""
+        tokens = item.lower().split()
+        pieces = []
+        for n in range(1, 4):  # You could make this range flexible
+            pieces.extend(" ".join(piece) for piece in ngrams(tokens, n))
+        return pieces
+
+    def _ngrams(self, items):
+        """
+        Lists the 1- to 3-word n-grams of every item.
+
+        Returns:
+            tuple: All n-grams in item order, and the number of n-grams of each item.
+        """
+        pieces = []
+        counts = []
+        for item in items:
+            item_pieces = self._item_ngrams(item)
+            pieces.extend(item_pieces)
+            counts.append(len(item_pieces))
+        return pieces, np.array(counts, dtype=np.int64)
+
+    def _present(self, pieces):
+        """Returns, for each n-gram, whether all of its k bits are set."""
+        return check_bits(self.words, self._indices(pieces))
+
+    def _indices(self, pieces):
+        """Returns the `(len(pieces), k)` bit indices of a list of n-grams."""
+        pairs = hash_pairs(pieces)
+        return km_indices(pairs[:, 0], pairs[:, 1], self.k, self.m)
 
     def add(self, item: str):
         """
         Adds an item to the bloom filter.
+
+        The n-grams are generated once and each is hashed once; the k indices of
+        all n-grams are derived from the two halves of their hashes by double
+        hashing and set together.
         
         Args:
             item: the string to add
         """
-        tokens = item.lower().split()
-        for i in range(self.k):
-            for n in range(1, 4):  # You could make this range flexible
-                n_grams = ngrams(tokens, n)
-                for piece in n_grams:
-                    index = mmh3.hash(" ".join(piece), i) % self.m
-                    self.bit_array[index] = 1
+        pieces = self._item_ngrams(item)
+        if pieces:
+            set_bits(self.words, self._indices(pieces))
 
     def query(self, item: str) -> bool:
         """
@@ -48,22 +335,67 @@ class BloomFilter:
         Returns:
             bool: True if item might be in the bloom filter, False if it definitely isn't
         """
-        tokens = item.lower().split()
-        for i in range(self.k):
-            for n in range(1, 4):
-                n_grams = ngrams(tokens, n)
-                for piece in n_grams:
-                    index = mmh3.hash(" ".join(piece), i) % self.m
-                    if not self.bit_array[index]:
-                        return False
-        return True
+        pieces = self._item_ngrams(item)
+        return not pieces or bool(self._present(pieces).all())
+
+    def containment(self, item: str) -> float:
+        """
+        Scores how much of an item the bloom filter has seen.
+
+        Because every n-gram is added separately, the fraction of an item's n-grams that
+        are present is a cheap fuzzy similarity: near-duplicates of added items score close
+        to 1 even though `query` rejects them. Like `query`, it can only overestimate.
+
+        Args:
+            item: the string to score
 
+        Returns:
+            float: Fraction of the item's n-grams present in the filter (1.0 for an empty item)
+        """
+        pieces = self._item_ngrams(item)
+        if not pieces:
+            return 1.0
+        return float(self._present(pieces).mean())
+
+    def add_many(self, items):
+        """
+        Adds a batch of items to the bloom filter.
+
+        Every n-gram of every item is hashed once and its k bits are set in bulk.
+
+        Args:
+            items: iterable of strings to add
+        """
+        pieces, _ = self._ngrams(items)
+        if pieces:
+            set_bits(self.words, self._indices(pieces))
+
+    def query_many(self, items):
+        """
+        Checks a batch of items against the bloom filter.
 
+        Args:
+            items: iterable of strings to query
 
-class BloomFilter_KM_Opt:
+        Returns:
+            numpy.ndarray: One bool per item, True if the item might be in the bloom filter
+        """
+        pieces, counts = self._ngrams(items)
+        result = np.ones(len(counts), dtype=bool)
+        if pieces:
+            present = self._present(pieces)
+            # An item is present only if all of its n-grams are
+            item_of_piece = np.repeat(np.arange(len(counts)), counts)
+            missing = np.bincount(item_of_piece, weights=~present, minlength=len(counts))
+            result = missing == 0
+        return result
+
+
+
+class BloomFilter_KM_Opt(BitArrayFilter):
     # This class includes the Bloom Filter with the Kirsch-Mitzenmacher-Optimization
 
-    def __init__(self, n: int, f: float):
+    def __init__(self, n: int, f: float, k: int = None):
         """
         Creates a Bloom Filter object with Kirsch-Mitzenmacher-Optimization.
         """
@@ -73,14 +405,12 @@ class BloomFilter_KM_Opt:
         """f (int): Desired false positive rate"""
         self.m = int(-math.log(self.f) * self.n / (math.log(2)**2))
         """m (int): Size of bit array"""
-        self.k = int(self.m * math.log(2) / self.n)
-        """k (int): Number of hash functions"""
-        self.n_bytes = (self.m + 7) // 8
+        self.k = k or int(self.m * math.log(2) / self.n)
+        """k (int): Number of hash functions, derived from m and n unless given"""
+        self.bit_array, self.words = new_bit_array(self.m)
+        """bit_array: The bit array; words: uint64 view of the same memory for batch operations"""
+        self.n_bytes = self.words.nbytes
         """n_bytes (int): Number of bytes required to store bit array"""
-        self.bit_array = bitarray.bitarray(self.n_bytes * 8)
-        """bit_array: Create the bit array"""
-        self.bit_array.setall(0)
-        """Set all bits to 0"""
 
     def add(self, item: str):
         """
@@ -89,13 +419,12 @@ class BloomFilter_KM_Opt:
         Args:
             item: the string to add
         """
-        # Compute the two primary hash values
-        h1 = mmh3.hash(item, 0)
-        h2 = mmh3.hash(item, 1)
+        # Compute the two primary hash values (halves of one 128-bit hash)
+        h1, h2 = mmh3.hash64(item, signed=False)
 
         # Use linear combinations of h1 and h2 to set k indices
         for i in range(self.k):
-            index = (h1 + i * h2) % self.m
+            index = ((h1 + i * h2) & MASK64) % self.m
             self.bit_array[index] = 1
 
     def query(self, item: str) -> bool:
@@ -108,24 +437,50 @@ class BloomFilter_KM_Opt:
         Returns:
             bool: True if item might be in the bloom filter, False if it definitely isn't
         """
-        # Compute the two primary hash values
-        h1 = mmh3.hash(item, 0)
-        h2 = mmh3.hash(item, 1)
+        # Compute the two primary hash values (halves of one 128-bit hash)
+        h1, h2 = mmh3.hash64(item, signed=False)
 
         # Check the linear combinations of h1 and h2 for the k indices
         for i in range(self.k):
-            index = (h1 + i * h2) % self.m
+            index = ((h1 + i * h2) & MASK64) % self.m
             if not self.bit_array[index]:
                 return False
         return True
+
+    def add_many(self, items):
+        """
+        Adds a batch of items to the Bloom filter, hashing each item once and setting all bits in bulk.
+
+        Args:
+            items: iterable of strings to add
+        """
+        pairs = hash_pairs(items)
+        set_bits(self.words, km_indices(pairs[:, 0], pairs[:, 1], self.k, self.m))
+
+    def query_many(self, items):
+        """
+        Checks a batch of items against the Bloom filter.
+
+        Args:
+            items: iterable of strings to query
+
+        Returns:
+            numpy.ndarray: One bool per item, True if the item might be in the bloom filter
+        """
+        pairs = hash_pairs(items)
+        return check_bits(self.words, km_indices(pairs[:, 0], pairs[:, 1], self.k, self.m))
     
 
-class BloomFilter_Uni_Hash:
+class BloomFilter_Uni_Hash(BitArrayFilter):
     # This class includes the Bloom Filter with the Universal Hashing
+    header_fields = ("n", "f", "m", "k", "seeds")
 
-    def __init__(self, n: int, f: float):
+    def __init__(self, n: int, f: float, k: int = None, seed: int = 0):
         """
         Creates a Bloom Filter object.
+
+        The hash coefficients are drawn from `seed`, so filters built separately (e.g. one
+        per shard) with the same parameters and seed can be merged with `union`.
         """
         self.n = n
         """n (int): Max # of elements"""
@@ -133,24 +488,40 @@ class BloomFilter_Uni_Hash:
         """f (int): Desired false positive rate"""
         self.m = int(-math.log(self.f) * self.n / (math.log(2)**2))
         """m (int): Size of bit array"""
-        self.k = int(self.m * math.log(2) / self.n)
-        """k (int): Number of hash functions"""
-        self.n_bytes = (self.m + 7) // 8
+        self.k = k or int(self.m * math.log(2) / self.n)
+        """k (int): Number of hash functions, derived from m and n unless given"""
+        self.bit_array, self.words = new_bit_array(self.m)
+        """bit_array: The bit array; words: uint64 view of the same memory for batch operations"""
+        self.n_bytes = self.words.nbytes
         """n_bytes (int): Number of bytes required to store bit array"""
-        self.bit_array = bitarray.bitarray(self.n_bytes * 8)
-        """bit_array: Create the bit array"""
-        self.bit_array.setall(0)  # Set all bits to 0
-        self.seeds = [random.randint(0, 10**6) for _ in range(self.k)]
+        rng = random.Random(seed)
+        self.seeds = [[rng.getrandbits(64) | 1, rng.getrandbits(64)] for _ in range(self.k)]
+        """seeds (list): Random (a, b) coefficients of the k hash functions `a * h1 + b * h2`, drawn from the seed"""
+
+    def _index(self, h1, h2, i):
+        a, b = self.seeds[i]
+        return ((a * h1 + b * h2) & MASK64) % self.m
+
+    def _indices(self, items):
+        """Returns the `(len(items), k)` bit indices of a batch of items."""
+        pairs = hash_pairs(items)
+        a = np.array([seed[0] for seed in self.seeds], dtype=np.uint64)
+        b = np.array([seed[1] for seed in self.seeds], dtype=np.uint64)
+        return (a * pairs[:, :1] + b * pairs[:, 1:]) % np.uint64(self.m)
 
     def add(self, item: str):
         """
         Adds an item to the bloom filter Universal Hashing.
+
+        Each of the k hash functions is a random linear combination of the two
+        halves of one 128-bit hash of the item.
         
         Args:
             item: the string to add
         """
+        h1, h2 = mmh3.hash64(item, signed=False)
         for i in range(self.k): 
-            index = mmh3.hash(item, self.seeds[i]) % self.m 
+            index = self._index(h1, h2, i)
             self.bit_array[index] = 1
 
     def query(self, item: str) -> bool:
@@ -163,57 +534,810 @@ class BloomFilter_Uni_Hash:
         Returns:
             bool: True if item might be in the bloom filter, False if it definitely isn't
         """
+        h1, h2 = mmh3.hash64(item, signed=False)
         for i in range(self.k): 
-            index = mmh3.hash(item, self.seeds[i]) % self.m 
+            index = self._index(h1, h2, i)
             if self.bit_array[index] == 0: 
                 return False 
         return True
+
+    def add_many(self, items):
+        """
+        Adds a batch of items to the bloom filter, hashing each item once and setting all bits in bulk.
+
+        Args:
+            items: iterable of strings to add
+        """
+        set_bits(self.words, self._indices(items))
+
+    def query_many(self, items):
+        """
+        Checks a batch of items against the bloom filter.
+
+        Args:
+            items: iterable of strings to query
+
+        Returns:
+            numpy.ndarray: One bool per item, True if the item might be in the bloom filter
+        """
+        return check_bits(self.words, self._indices(items))
     
 
 
+class BlockedBloomFilter(BitArrayFilter):
+    # This class includes the cache-line Blocked Bloom Filter (Putze et al., 2007)
+
+    block_bits = 512
+    """block_bits (int): Size of a block, one 64-byte cache line"""
+
+    def __init__(self, n: int, f: float, k: int = None):
+        """
+        Creates a Blocked Bloom Filter object.
+
+        The bit array is split into 512-bit blocks. The first hash picks a block and all k bits
+        of the item are set inside it, so a lookup touches a single cache line instead of k
+        random ones. Bits crowd together in popular blocks, so the false positive rate is a
+        bit higher than a standard Bloom filter of the same size.
+        """
+        self.n = n
+        """n (int): Max # of elements"""
+        self.f = f
+        """f (float): Desired false positive rate"""
+        m = int(-math.log(self.f) * self.n / (math.log(2)**2))
+        self.m = max(1, math.ceil(m / self.block_bits)) * self.block_bits
+        """m (int): Size of bit array, rounded up to whole blocks"""
+        self.k = k or int(m * math.log(2) / self.n)
+        """k (int): Number of bits set per item, derived from m and n unless given"""
+        self.bit_array, self.words = new_bit_array(self.m)
+        """bit_array: The bit array; words: uint64 view of the same memory for batch operations"""
+        self.n_bytes = self.words.nbytes
+        """n_bytes (int): Number of bytes required to store bit array"""
+
+    @property
+    def num_blocks(self):
+        """num_blocks (int): Number of 512-bit blocks"""
+        return self.m // self.block_bits
+
+    def _block_indices(self, h1, h2):
+        # The block comes from the top half of h1 by multiply-shift (no division); the k
+        # offsets inside it come from double hashing on the halves of h2, with an odd step
+        base = ((h1 >> 32) * self.num_blocks >> 32) * self.block_bits
+        g1, g2 = h2 & 0xFFFFFFFF, (h2 >> 32) | 1
+        return [base + ((g1 + i * g2) & (self.block_bits - 1)) for i in range(self.k)]
+
+    def _block_indices_many(self, items):
+        """Returns the `(items, k)` bit indices of a batch, all k of an item inside one block."""
+        pairs = hash_pairs(items)
+        h1, h2 = pairs[:, 0], pairs[:, 1]
+        base = ((h1 >> np.uint64(32)) * np.uint64(self.num_blocks) >> np.uint64(32)) * np.uint64(self.block_bits)
+        g1, g2 = h2 & np.uint64(0xFFFFFFFF), (h2 >> np.uint64(32)) | np.uint64(1)
+        i = np.arange(self.k, dtype=np.uint64)
+        return base[:, None] + ((g1[:, None] + i * g2[:, None]) & np.uint64(self.block_bits - 1))
+
+    def add(self, item: str):
+        """
+        Adds an item to the Blocked Bloom filter.
+
+        Args:
+            item: the string to add
+        """
+        for index in self._block_indices(*mmh3.hash64(item, signed=False)):
+            self.bit_array[index] = 1
+
+    def query(self, item: str) -> bool:
+        """
+        Checks if an item might be in the Blocked Bloom filter (may have false positives).
+
+        Args:
+            item: the string to query
+
+        Returns:
+            bool: True if item might be in the bloom filter, False if it definitely isn't
+        """
+        return all(self.bit_array[index] for index in self._block_indices(*mmh3.hash64(item, signed=False)))
+
+    def add_many(self, items):
+        """
+        Adds a batch of items to the Blocked Bloom filter, setting all bits in bulk.
+
+        Args:
+            items: iterable of strings to add
+        """
+        set_bits(self.words, self._block_indices_many(items))
+
+    def query_many(self, items):
+        """
+        Checks a batch of items against the Blocked Bloom filter. The k words read for an item
+        all lie in the same cache line.
+
+        Args:
+            items: iterable of strings to query
+
+        Returns:
+            numpy.ndarray: One bool per item, True if the item might be in the bloom filter
+        """
+        return check_bits(self.words, self._block_indices_many(items))
+
+
+class ScalableBloomFilter:
+    # This class includes the Scalable Bloom Filter (Almeida et al., 2007)
+
+    def __init__(self, n: int, f: float, growth: int = 2, ratio: float = 0.5):
+        """
+        Creates a Scalable Bloom Filter that grows past its initial capacity.
+
+        The filter is a chain of Kirsch-Mitzenmacher Bloom filters. Items go into the
+        newest one; when it has taken as many items as it was sized for, a new filter is
+        appended with `growth` times the capacity and `ratio` times the error rate. The
+        error rates form a geometric series starting at `f * (1 - ratio)`, so the compound
+        false positive rate stays below `f` however many items are added.
+        """
+        self.n = n
+        """n (int): Capacity of the first filter"""
+        self.f = f
+        """f (float): Error budget: maximum false positive rate of the whole chain"""
+        self.growth = growth
+        """growth (int): Capacity multiplier of each new filter"""
+        self.ratio = ratio
+        """ratio (float): Error-rate multiplier (tightening ratio) of each new filter"""
+        self.filters = []
+        """filters (list): The chain of BloomFilter_KM_Opt filters, oldest first"""
+        self.counts = []
+        """counts (list): Number of items added to each filter"""
+        self._grow()
+
+    def _grow(self):
+        stage = len(self.filters)
+        capacity = self.n * self.growth ** stage
+        error = self.f * (1 - self.ratio) * self.ratio ** stage
+        self.filters.append(BloomFilter_KM_Opt(capacity, error))
+        self.counts.append(0)
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def add(self, item: str) -> bool:
+        """
+        Adds an item unless the filter (probably) contains it already.
+
+        Args:
+            item: the string to add
+
+        Returns:
+            bool: True if the item was already (probably) present, False if it was added
+        """
+        if self.query(item):
+            return True
+        if self.counts[-1] >= self.filters[-1].n:
+            self._grow()
+        self.filters[-1].add(item)
+        self.counts[-1] += 1
+        return False
+
+    def query(self, item: str) -> bool:
+        """
+        Checks if an item might be in any filter of the chain.
+
+        Args:
+            item: the string to query
+
+        Returns:
+            bool: True if item might be in the filter, False if it definitely isn't
+        """
+        return any(bloom.query(item) for bloom in self.filters)
+
+    def query_many(self, items):
+        """
+        Checks a batch of items against every filter of the chain.
+
+        Args:
+            items: list of strings to query
+
+        Returns:
+            numpy.ndarray: One bool per item, True if the item might be in the filter
+        """
+        result = np.zeros(len(items), dtype=bool)
+        for bloom in self.filters:
+            result |= bloom.query_many(items)
+        return result
+
+    def add_many(self, items):
+        """
+        Adds a batch of items, skipping those the filter (probably) contains already.
+
+        Args:
+            items: list of strings to add
+
+        Returns:
+            numpy.ndarray: One bool per item, True if it was already (probably) present
+        """
+        items = list(items)
+        present = self.query_many(items)
+        # Items repeated inside the batch are only counted once
+        new_items = list(dict.fromkeys(item for item, seen in zip(items, present) if not seen))
+        while new_items:
+            room = self.filters[-1].n - self.counts[-1]
+            if room <= 0:
+                self._grow()
+                continue
+            batch, new_items = new_items[:room], new_items[room:]
+            self.filters[-1].add_many(batch)
+            self.counts[-1] += len(batch)
+        return present
+
+    def fill_ratio(self):
+        """Returns the fraction of bits set in the newest filter, the one currently taking items."""
+        return self.filters[-1].fill_ratio()
+
+    def estimated_fpr(self):
+        """
+        Returns the false positive rate of the whole chain implied by the filters' current fill ratios.
+
+        A query is a false positive if any filter answers True, so the compound rate is
+        `1 - prod(1 - fpr_i)`.
+        """
+        return 1 - math.prod(1 - bloom.estimated_fpr() for bloom in self.filters)
+
+    @property
+    def n_bytes(self):
+        """n_bytes (int): Number of bytes used by all bit arrays of the chain"""
+        return sum(bloom.n_bytes for bloom in self.filters)
+
+
 class BloomFilter_QF:
-    # This class includes the Bloom Filter with the Quotient Filter
+    # This class includes the Quotient Filter (Bender et al., 2012)
+
+    max_load = 0.75
+    """max_load (float): Fraction of occupied slots at which the table doubles"""
 
     def __init__(self, n: int, f: float):
         """
-        Creates a Bloom Filter object.
+        Creates a Quotient Filter object.
+
+        Each item is hashed to a fingerprint of `q + r` bits. The top `q` bits (the quotient)
+        select one of `2**q` slots and the low `r` bits (the remainder) are stored. The
+        remainders of one quotient are kept sorted in a run; runs that collide are pushed
+        to the right (linear probing) and form clusters. Three metadata bits per slot,
+        occupied, continuation and shifted, tell which quotient each stored remainder
+        belongs to, so items are never overwritten and can be deleted.
+
+        When the table passes `max_load` it doubles by moving one bit of every fingerprint
+        from the remainder into the quotient, without rehashing the items. The false
+        positive rate, roughly `load * 2**-r`, therefore doubles with every resize.
+        """
+        self.n = n
+        """n (int): Max # of elements before the first resize"""
+        self.f = f
+        """f (float): Desired false positive rate"""
+        self.q = max(1, math.ceil(math.log2(self.n / self.max_load)))
+        """q (int): Number of quotient bits, the table has 2**q slots"""
+        self.r = max(1, math.ceil(-math.log2(self.f)))
+        """r (int): Number of remainder bits stored per slot"""
+        if self.q + self.r > 64:
+            raise ValueError("Fingerprints are limited to 64 bits, lower n or raise f")
+        self.fingerprint_mask = (1 << (self.q + self.r)) - 1
+        """fingerprint_mask (int): Mask of the q + r fingerprint bits, fixed across resizes"""
+        self.count = 0
+        """count (int): Number of stored fingerprints"""
+        self._allocate()
+
+    def _allocate(self):
+        self.size = 1 << self.q
+        """size (int): Number of slots"""
+        self.slot_mask = self.size - 1
+        self.remainder_mask = (1 << self.r) - 1
+        self.occupied = bitarray.bitarray(self.size, endian='little')
+        """occupied (bitarray): Bit i is set if some stored fingerprint has quotient i"""
+        self.continuation = bitarray.bitarray(self.size, endian='little')
+        """continuation (bitarray): Bit i is set if slot i continues the run of the slot before it"""
+        self.shifted = bitarray.bitarray(self.size, endian='little')
+        """shifted (bitarray): Bit i is set if the remainder in slot i is not in its quotient's slot"""
+        for bits in (self.occupied, self.continuation, self.shifted):
+            bits.setall(0)
+        # One spare word so that reading a remainder that straddles two words never overruns
+        self.remainders = np.zeros((self.size * self.r + 63) // 64 + 1, dtype=np.uint64)
+        """remainders (numpy.ndarray): The r-bit remainders of all slots, bit-packed into uint64 words"""
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def n_bytes(self):
+        """n_bytes (int): Number of bytes used by the remainders and the metadata bits"""
+        return self.remainders.nbytes + 3 * self.size // 8
+
+    def load_factor(self):
+        """Returns the fraction of slots in use."""
+        return self.count / self.size
+
+    def estimated_fpr(self):
+        """Returns the false positive rate expected at the current load, `1 - exp(-load / 2**r)`."""
+        return 1 - math.exp(-self.load_factor() / 2 ** self.r)
+
+    def _fingerprint(self, item):
+        return mmh3.hash64(item, signed=False)[0] & self.fingerprint_mask
+
+    def _fingerprints(self, items):
+        return hash_pairs(items)[:, 0] & np.uint64(self.fingerprint_mask)
+
+    def _get(self, slot):
+        return read_packed(self.remainders, slot, self.r)
+
+    def _set(self, slot, value):
+        write_packed(self.remainders, slot, self.r, value)
+
+    def _next(self, slot):
+        return (slot + 1) & self.slot_mask
+
+    def _is_empty(self, slot):
+        return not (self.occupied[slot] or self.continuation[slot] or self.shifted[slot])
+
+    def _is_cluster_start(self, slot):
+        return self.occupied[slot] and not self.continuation[slot] and not self.shifted[slot]
+
+    def _run_start(self, quotient):
+        """Returns the slot where the run of `quotient` starts, or would start if it is empty."""
+        # Walk back to the start of the cluster, then forward one run per occupied quotient
+        b = quotient
+        while self.shifted[b]:
+            b = (b - 1) & self.slot_mask
+        s = b
+        while b != quotient:
+            s = self._next(s)
+            while self.continuation[s]:
+                s = self._next(s)
+            b = self._next(b)
+            while not self.occupied[b]:
+                b = self._next(b)
+        return s
+
+    def _find(self, quotient, remainder):
+        """Returns the slot holding `remainder` in the run of `quotient`, or None."""
+        if not self.occupied[quotient]:
+            return None
+        s = self._run_start(quotient)
+        while True:
+            stored = self._get(s)
+            if stored == remainder:
+                return s
+            if stored > remainder:
+                return None
+            s = self._next(s)
+            if not self.continuation[s]:
+                return None
+
+    def _insert(self, fingerprint):
+        quotient, remainder = fingerprint >> self.r, fingerprint & self.remainder_mask
+        self.count += 1
+        if self._is_empty(quotient):
+            self.occupied[quotient] = 1
+            self._set(quotient, remainder)
+            return
+
+        run_exists = self.occupied[quotient]
+        self.occupied[quotient] = 1
+        s = start = self._run_start(quotient)
+        if run_exists:
+            # Keep the run sorted: stop at the first larger remainder or past the run's end
+            while self._get(s) < remainder:
+                s = self._next(s)
+                if not self.continuation[s]:
+                    break
+        continuation = run_exists and s != start
+        # A new smallest remainder takes over the run's head, the old head becomes a continuation
+        displaced_head = run_exists and s == start
+        shifted = s != quotient
+
+        # Shift the rest of the cluster one slot to the right, up to the first empty slot
+        while True:
+            empty = self._is_empty(s)
+            moved = (self._get(s), self.continuation[s])
+            self._set(s, remainder)
+            self.continuation[s] = continuation
+            self.shifted[s] = shifted
+            if empty:
+                return
+            remainder, continuation = moved
+            continuation = continuation or displaced_head
+            displaced_head = False
+            shifted = True
+            s = self._next(s)
+
+    def _delete(self, fingerprint):
+        quotient, remainder = fingerprint >> self.r, fingerprint & self.remainder_mask
+        s = self._find(quotient, remainder)
+        if s is None:
+            return False
+        run_head = not self.continuation[s]
+        if run_head and not self.continuation[self._next(s)]:
+            self.occupied[quotient] = 0  # It was the only remainder of its run
+
+        # Shift the rest of the cluster one slot to the left, stopping at an empty slot or at a
+        # remainder already in its own slot. `run_quotient` tracks whose run is being moved.
+        current, run_quotient = s, quotient
+        while True:
+            following = self._next(current)
+            if self._is_empty(following) or self._is_cluster_start(following):
+                self._set(current, 0)
+                self.continuation[current] = 0
+                self.shifted[current] = 0
+                break
+            if not self.continuation[following]:
+                run_quotient = self._next(run_quotient)
+                while not self.occupied[run_quotient]:
+                    run_quotient = self._next(run_quotient)
+            self._set(current, self._get(following))
+            self.continuation[current] = self.continuation[following]
+            self.shifted[current] = current != run_quotient
+            current = following
+
+        if run_head:
+            self.continuation[s] = 0  # The next remainder of the run is its new head
+        self.count -= 1
+        return True
+
+    def fingerprints(self):
+        """
+        Yields every stored fingerprint, reconstructed from its slot's quotient and its remainder.
+
+        Returns:
+            generator: Fingerprints (ints), grouped by cluster.
+        """
+        if not self.count:
+            return
+        start = next(slot for slot in range(self.size) if self._is_empty(slot))
+        pending = deque()
+        for offset in range(self.size):
+            slot = (start + offset) & self.slot_mask
+            if self._is_empty(slot):
+                continue
+            if self.occupied[slot]:
+                pending.append(slot)
+            if not self.continuation[slot]:
+                quotient = pending.popleft()
+            yield (quotient << self.r) | self._get(slot)
+
+    def resize(self, doublings: int = 1):
+        """
+        Doubles the number of slots `doublings` times without rehashing the items.
+
+        The fingerprints are kept: each doubling moves their top remainder bit into the quotient.
+
+        Args:
+            doublings: how many times to double the table
+        """
+        if doublings >= self.r:
+            raise ValueError(f"Cannot grow the filter: only {self.r} remainder bits left")
+        stored = list(self.fingerprints())
+        self.q += doublings
+        self.r -= doublings
+        self.count = 0
+        self._allocate()
+        for fingerprint in stored:
+            self._insert(fingerprint)
+
+    def _reserve(self, extra):
+        doublings = 0
+        while self.count + extra > self.max_load * (self.size << doublings):
+            doublings += 1
+        if doublings:
+            self.resize(doublings)
+
+    def add(self, item: str):
+        """
+        Adds an item to the quotient filter. Adding an item twice stores it twice.
+
+        Args:
+            item: the string to add
+        """
+        self._reserve(1)
+        self._insert(self._fingerprint(item))
+
+    def add_many(self, items):
+        """
+        Adds a batch of items, hashing them in one pass and growing the table at most once.
+
+        Args:
+            items: list of strings to add
+        """
+        fingerprints = self._fingerprints(items)
+        self._reserve(len(fingerprints))
+        for fingerprint in fingerprints.tolist():
+            self._insert(fingerprint)
+
+    def query(self, item: str) -> bool:
+        """
+        Checks if an item might be in the quotient filter (may have false positives).
+
+        Args:
+            item: the string to query
+
+        Returns:
+            bool: True if item might be in the filter, False if it definitely isn't
+        """
+        fingerprint = self._fingerprint(item)
+        return self._find(fingerprint >> self.r, fingerprint & self.remainder_mask) is not None
+
+    def query_many(self, items):
+        """
+        Checks a batch of items. Items whose quotient slot is not occupied are rejected in bulk.
+
+        Args:
+            items: list of strings to query
+
+        Returns:
+            numpy.ndarray: One bool per item, True if the item might be in the filter
+        """
+        fingerprints = self._fingerprints(items)
+        quotients = fingerprints >> np.uint64(self.r)
+        occupied = np.unpackbits(np.frombuffer(self.occupied, dtype=np.uint8), bitorder='little')
+        result = np.zeros(len(fingerprints), dtype=bool)
+        for i in np.flatnonzero(occupied[quotients]):
+            fingerprint = int(fingerprints[i])
+            result[i] = self._find(fingerprint >> self.r, fingerprint & self.remainder_mask) is not None
+        return result
+
+    def delete(self, item: str) -> bool:
+        """
+        Removes one copy of an item from the quotient filter.
+
+        Only delete items that were added: deleting an item that merely collides with a
+        stored fingerprint removes that fingerprint instead.
+
+        Args:
+            item: the string to remove
+
+        Returns:
+            bool: True if a matching fingerprint was removed, False if none was stored
+        """
+        return self._delete(self._fingerprint(item))
+
+
+class CuckooFilter(PersistentFilter):
+    # This class includes the Cuckoo Filter (Fan et al., 2014)
+
+    bucket_size = 4
+    """bucket_size (int): Fingerprints per bucket"""
+    max_load = 0.95
+    """max_load (float): Fraction of slots in use at `n` items"""
+    max_kicks = 500
+    """max_kicks (int): Evictions tried before an insert gives up"""
+    header_fields = ("n", "f", "m", "fingerprint_bits", "num_buckets", "seed", "victim")
+
+    def __init__(self, n: int, f: float, seed: int = 42):
+        """
+        Creates a Cuckoo Filter object.
+
+        Every item is stored as a short fingerprint in one of two candidate buckets of
+        `bucket_size` slots. The second bucket is derived from the first and the fingerprint
+        alone, so stored fingerprints can be moved (kicked out) to make room without the
+        original item, and removed again with `delete`. Fingerprints are bit-packed into a
+        uint64 NumPy array; at low false positive rates this takes less space than a Bloom
+        filter.
         """
         self.n = n
         """n (int): Max # of elements"""
         self.f = f
-        """f (int): Desired false positive rate"""
-        self.m = int(-math.log(self.f) * self.n / (math.log(2)**2))
-        """m (int): Size of bit array"""
-        self.quotient_size = int(math.log2(self.m)) 
-        self.remainder_size = 32 - self.quotient_size # Assuming 32-bit hash values 
-        self.filter = [None] * (2**self.quotient_size)     
-
-    def _hash(self, item): 
-        h = mmh3.hash(item) 
-        quotient = h >> self.remainder_size 
-        remainder = h & ((1 << self.remainder_size) - 1) 
-        
-        return quotient, remainder
+        """f (float): Desired false positive rate"""
+        self.fingerprint_bits = min(32, math.ceil(math.log2(2 * self.bucket_size / self.f)))
+        """fingerprint_bits (int): Bits per fingerprint; a lookup compares 2 * bucket_size of them"""
+        self.num_buckets = max(1, math.ceil(self.n / (self.bucket_size * self.max_load)))
+        """num_buckets (int): Number of buckets"""
+        self.m = self.num_buckets * self.bucket_size * self.fingerprint_bits
+        """m (int): Size of the fingerprint table in bits"""
+        self.words = np.zeros(self._num_words({"m": self.m}), dtype=np.uint64)
+        """words (numpy.ndarray): The bit-packed fingerprint table, 0 marks an empty slot"""
+        self.n_bytes = self.words.nbytes
+        """n_bytes (int): Number of bytes required to store the table"""
+        self.seed = seed
+        """seed (int): Seed of the random choices made while kicking out fingerprints"""
+        self.rng = random.Random(seed)
+        self.victim = None
+        """victim (list): `[bucket, fingerprint]` left over by a failed insert, None while the filter has room"""
+        self.count = 0
+        """count (int): Number of stored fingerprints"""
+
+    @staticmethod
+    def _num_words(header):
+        # One spare word so that reading the last slot never overruns
+        return (header["m"] + 63) // 64 + 1
+
+    @classmethod
+    def _from_words(cls, header, words):
+        cuckoo = cls.__new__(cls)
+        for field, value in header.items():
+            setattr(cuckoo, field, value)
+        cuckoo.words = words
+        cuckoo.n_bytes = words.nbytes
+        cuckoo.rng = random.Random(cuckoo.seed)
+        slots = np.arange(cuckoo.num_buckets * cuckoo.bucket_size)
+        cuckoo.count = int(np.count_nonzero(read_packed_many(words, slots, cuckoo.fingerprint_bits)))
+        cuckoo.count += cuckoo.victim is not None
+        return cuckoo
+
+    def __len__(self):
+        return self.count
+
+    def load_factor(self):
+        """Returns the fraction of slots in use."""
+        return self.count / (self.num_buckets * self.bucket_size)
+
+    def estimated_fpr(self):
+        """Returns the false positive rate expected at the current load."""
+        matches = 2 * self.bucket_size * self.load_factor()
+        return 1 - (1 - 1 / ((1 << self.fingerprint_bits) - 1)) ** matches
+
+    def _hash(self, item):
+        h1, h2 = mmh3.hash64(item, signed=False)
+        # Fingerprints are never 0, which marks an empty slot
+        return h2 % ((1 << self.fingerprint_bits) - 1) + 1, h1 % self.num_buckets
+
+    def _hash_many(self, items):
+        h = hash_pairs(items)
+        fingerprints = h[:, 1] % np.uint64((1 << self.fingerprint_bits) - 1) + np.uint64(1)
+        return fingerprints, h[:, 0] % np.uint64(self.num_buckets)
+
+    def _alt_bucket(self, bucket, fingerprint):
+        # bucket + alt = hash(fingerprint) (mod num_buckets), so applying it twice returns to
+        # the first bucket for any number of buckets, not just powers of two
+        return ((fingerprint * 0xc6a4a7935bd1e995 & MASK64) - bucket) % self.num_buckets
+
+    def _alt_bucket_many(self, buckets, fingerprints):
+        num_buckets = np.uint64(self.num_buckets)
+        hashed = fingerprints * np.uint64(0xc6a4a7935bd1e995) % num_buckets
+        return (hashed + num_buckets - buckets) % num_buckets
+
+    def _slots(self, bucket):
+        return range(bucket * self.bucket_size, (bucket + 1) * self.bucket_size)
+
+    def _put(self, bucket, fingerprint):
+        for slot in self._slots(bucket):
+            if not read_packed(self.words, slot, self.fingerprint_bits):
+                write_packed(self.words, slot, self.fingerprint_bits, fingerprint)
+                return True
+        return False
+
+    def _insert(self, fingerprint, bucket):
+        if self.victim is not None:
+            raise ValueError("The cuckoo filter is full")
+        self.count += 1
+        alt = self._alt_bucket(bucket, fingerprint)
+        if self._put(bucket, fingerprint) or self._put(alt, fingerprint):
+            return
+
+        # Both buckets are full: evict a random fingerprint and move it to its other bucket
+        bucket = self.rng.choice((bucket, alt))
+        for _ in range(self.max_kicks):
+            slot = bucket * self.bucket_size + self.rng.randrange(self.bucket_size)
+            evicted = read_packed(self.words, slot, self.fingerprint_bits)
+            write_packed(self.words, slot, self.fingerprint_bits, fingerprint)
+            fingerprint = evicted
+            bucket = self._alt_bucket(bucket, fingerprint)
+            if self._put(bucket, fingerprint):
+                return
+        # Keep the last evicted fingerprint aside so that no item is lost
+        self.victim = [bucket, fingerprint]
 
     def add(self, item: str):
         """
-        Adds an item to the bloom filter.
-        
+        Adds an item to the cuckoo filter. Adding an item twice stores it twice.
+
         Args:
             item: the string to add
+
+        Raises:
+            ValueError: If the filter is full.
+        """
+        self._insert(*self._hash(item))
+
+    def add_many(self, items):
         """
-        quotient, remainder = self._hash(item) 
-        self.filter[quotient] = remainder 
+        Adds a batch of items.
+
+        Items are hashed in one pass and every item that finds a free slot in one of its two
+        buckets is written with a single scatter; only the remaining ones go through the
+        sequential kick-out insertion.
+
+        Args:
+            items: list of strings to add
+
+        Raises:
+            ValueError: If the filter is full.
+        """
+        fingerprints, first = self._hash_many(items)
+        second = self._alt_bucket_many(first, fingerprints)
+        offsets = np.arange(self.bucket_size, dtype=np.uint64)
+        pending = np.arange(len(fingerprints))
+        for buckets in (first, second):
+            if not len(pending) or self.victim is not None:
+                break
+            target = buckets[pending]
+            # Rank of each item among the pending items aiming at the same bucket
+            order = np.argsort(target, kind='stable')
+            sorted_target = target[order]
+            starts = np.flatnonzero(np.r_[True, sorted_target[1:] != sorted_target[:-1]])
+            rank = np.empty(len(target), dtype=np.int64)
+            rank[order] = np.arange(len(target)) - np.repeat(starts, np.diff(np.r_[starts, len(target)]))
+
+            # The item of rank i takes the (i + 1)-th free slot of its bucket, if there is one
+            slots = target[:, None] * np.uint64(self.bucket_size) + offsets
+            free = read_packed_many(self.words, slots, self.fingerprint_bits) == 0
+            chosen = (np.cumsum(free, axis=1) == rank[:, None] + 1) & free
+            placed = chosen.any(axis=1)
+            fill_packed_many(self.words, slots[placed, chosen[placed].argmax(axis=1)],
+                             self.fingerprint_bits, fingerprints[pending[placed]])
+            self.count += int(placed.sum())
+            pending = pending[~placed]
+
+        for i in pending.tolist():
+            self._insert(int(fingerprints[i]), int(first[i]))
 
     def query(self, item: str) -> bool:
         """
-        Checks if an item might be in the bloom filter (may have false positives).
-        
+        Checks if an item might be in the cuckoo filter (may have false positives).
+
         Args:
             item: the string to query
-        
+
         Returns:
-            bool: True if item might be in the bloom filter, False if it definitely isn't
+            bool: True if item might be in the filter, False if it definitely isn't
+        """
+        fingerprint, bucket = self._hash(item)
+        return self._locate(fingerprint, bucket) is not None
+
+    def query_many(self, items):
+        """
+        Checks a batch of items by comparing all slots of both buckets at once.
+
+        Args:
+            items: list of strings to query
+
+        Returns:
+            numpy.ndarray: One bool per item, True if the item might be in the filter
+        """
+        fingerprints, first = self._hash_many(items)
+        second = self._alt_bucket_many(first, fingerprints)
+        offsets = np.arange(self.bucket_size, dtype=np.uint64)
+        size = np.uint64(self.bucket_size)
+        slots = np.concatenate([first[:, None] * size + offsets, second[:, None] * size + offsets], axis=1)
+        result = (read_packed_many(self.words, slots, self.fingerprint_bits) == fingerprints[:, None]).any(axis=1)
+        if self.victim is not None:
+            bucket, fingerprint = self.victim
+            result |= (fingerprints == fingerprint) & ((first == bucket) | (second == bucket))
+        return result
+
+    def _locate(self, fingerprint, bucket):
+        """Returns the slot holding the fingerprint in either bucket, -1 for the victim, or None."""
+        alt = self._alt_bucket(bucket, fingerprint)
+        for slot in chain(self._slots(bucket), self._slots(alt)):
+            if read_packed(self.words, slot, self.fingerprint_bits) == fingerprint:
+                return slot
+        if self.victim is not None and self.victim[1] == fingerprint and self.victim[0] in (bucket, alt):
+            return -1
+        return None
+
+    def delete(self, item: str) -> bool:
         """
-        quotient, remainder = self._hash(item) 
-        return self.filter[quotient] == remainder
\ No newline at end of file
+        Removes one copy of an item from the cuckoo filter, e.g. when its document is deleted.
+
+        Only delete items that were added: deleting an item that merely collides with a
+        stored fingerprint removes that fingerprint instead.
+
+        Args:
+            item: the string to remove
+
+        Returns:
+            bool: True if a matching fingerprint was removed, False if none was stored
+        """
+        slot = self._locate(*self._hash(item))
+        if slot is None:
+            return False
+        self.count -= 1
+        victim, self.victim = self.victim, None
+        if slot >= 0:
+            write_packed(self.words, slot, self.fingerprint_bits, 0)
+            if victim is not None:
+                # Room was freed, so the leftover fingerprint can be placed again
+                self.count -= 1
+                self._insert(victim[1], victim[0])
+        return True
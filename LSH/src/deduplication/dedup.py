@@ -1,6 +1,19 @@
 import hashlib
+import heapq
+import itertools
+import math
+import os
+import tempfile
+import xxhash
+import numpy as np
 from collections import Counter
 from collections import defaultdict
+from utils.instrumentation import span
+
+RECORD_DTYPE = np.dtype([("hi", "<u8"), ("lo", "<u8"), ("id", "<i8")])
+"""RECORD_DTYPE (numpy.dtype): A document's 128-bit content hash, as two uint64 halves, and its ID"""
+
+HASH_BATCH = 65536
 
 class Baseline:
     def __init__(self):
@@ -13,34 +26,106 @@ class Baseline:
         Used to track unique document hashes and identify duplicates in the dataset.
         """
 
-    def collection_deduplication(self,documents_dict):
+    def collection_deduplication(self, documents_dict, memory_budget=256 * 1024 * 1024, tmp_dir=None):
         """
         Groups documents into clusters based on identical content.
         
         Args:
             documents_dict: Dictionary where keys are document IDs and values are document strings.
+            memory_budget: Bytes of hash records held in memory before they are spilled to disk.
+            tmp_dir: Directory for the spilled runs, the system default if None.
         
         Returns:
             clusters: Dictionary where each key is a cluster ID and the value is a list of document IDs
                     that are considered duplicates or similar.
         """
-        # Create a dictionary to store clusters (hash to list of document IDs)
-        hash_to_docs = defaultdict(list)
-        
-        # Group documents by their MD5 hash (you can replace this with LSH or any other similarity function)
-        for doc_id, document in documents_dict.items():
-            hash_value = hashlib.md5(document.encode()).hexdigest()
-            hash_to_docs[hash_value].append(doc_id)
-        
-        # Convert the hash groupings into cluster IDs
-        clusters = {}
-        cluster_id = 1  # Simple counter for cluster IDs
-        
-        for doc_ids in hash_to_docs.values():
-            clusters[cluster_id] = doc_ids
-            cluster_id += 1
-        
-        return clusters
+        return dict(enumerate(self.stream_clusters(documents_dict, memory_budget, tmp_dir), 1))
+
+    def stream_clusters(self, documents, memory_budget=256 * 1024 * 1024, tmp_dir=None):
+        """
+        Groups a stream of documents into clusters of identical content, without holding the corpus in memory.
+
+        Each document is reduced to a 24-byte record: its xxh3-128 hash as two uint64 halves and
+        its integer ID. Records are collected until they fill `memory_budget`, then sorted and
+        written to a run file in `tmp_dir`. The runs are merged in sorted order, reading each
+        through a memory map, and consecutive equal hashes form a cluster. Without spills the
+        records are sorted in memory and nothing touches the disk.
+
+        Args:
+            documents: An iterable of (document ID, document string) pairs, such as `utils.utils.iter_tsv`,
+                or a dictionary of document IDs to strings. IDs must be integers.
+            memory_budget: Bytes of hash records held in memory before they are spilled to disk.
+            tmp_dir: Directory for the spilled runs, the system default if None.
+
+        Yields:
+            list: The document IDs of one cluster, in ascending order. Clusters come in hash order
+            and every document is in exactly one cluster.
+        """
+        if isinstance(documents, dict):
+            documents = documents.items()
+        capacity = max(1, memory_budget // RECORD_DTYPE.itemsize)
+        buffer = np.empty(capacity, dtype=RECORD_DTYPE)
+
+        with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+            runs, size = [], 0
+            # Clusters are merged lazily as the caller reads them, so only hashing and spilling are timed here
+            with span("sign") as stage:
+                for batch in self._hash_batches(documents, min(HASH_BATCH, capacity)):
+                    if size + len(batch) > capacity:
+                        runs.append(self._write_run(buffer[:size], run_dir, len(runs)))
+                        size = 0
+                    buffer[size:size + len(batch)] = batch
+                    size += len(batch)
+                    stage.items += len(batch)
+
+            if not runs:
+                records = self._sort_records(buffer[:size])
+                yield from self._group_records(zip(records["hi"].tolist(), records["lo"].tolist(), records["id"].tolist()))
+                return
+            if size:
+                runs.append(self._write_run(buffer[:size], run_dir, len(runs)))
+            del buffer
+
+            # Every run streams through a block of its own, so the merge stays within the budget
+            block = max(1, capacity // len(runs))
+            readers = [self._read_run(path, block) for path in runs]
+            yield from self._group_records(heapq.merge(*readers))
+
+    @staticmethod
+    def _hash_batches(documents, batch_size):
+        """Hashes documents with xxh3-128 and yields them as arrays of `RECORD_DTYPE` records."""
+        documents = iter(documents)
+        while True:
+            batch = [(digest >> 64, digest & 0xFFFFFFFFFFFFFFFF, doc_id)
+                     for doc_id, document in itertools.islice(documents, batch_size)
+                     for digest in (xxhash.xxh3_128_intdigest(document.encode()),)]
+            if not batch:
+                return
+            yield np.array(batch, dtype=RECORD_DTYPE)
+
+    @staticmethod
+    def _sort_records(records):
+        return records[np.lexsort((records["id"], records["lo"], records["hi"]))]
+
+    def _write_run(self, records, run_dir, number):
+        """Sorts the records and writes them to a run file, returning its path."""
+        path = os.path.join(run_dir, f"run{number}.bin")
+        self._sort_records(records).tofile(path)
+        return path
+
+    @staticmethod
+    def _read_run(path, block):
+        """Yields the (hi, lo, id) tuples of a run file, `block` records at a time."""
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r')
+        for start in range(0, len(records), block):
+            chunk = records[start:start + block]
+            yield from zip(chunk["hi"].tolist(), chunk["lo"].tolist(), chunk["id"].tolist())
+
+    @staticmethod
+    def _group_records(records):
+        """Groups sorted (hi, lo, id) tuples by hash into lists of IDs."""
+        for _, group in itertools.groupby(records, key=lambda record: record[:2]):
+            yield [record[2] for record in group]
 
     # Exact Duplicates Baseline
     def detect_duplicates(self, documents):
@@ -112,6 +197,10 @@ class Baseline:
         """
         This function uses word count similarity to find duplicates. If two documents have
         a word overlap greater than the threshold, they are considered duplicates.
+
+        The overlap ratio is the weighted Jaccard similarity of the word counts, shared words
+        (with multiplicity) over all words. Pairs are found with `similarity_join` instead of
+        comparing every pair of documents.
         
         Args:
             documents: A list of document strings.
@@ -120,20 +209,81 @@ class Baseline:
         Returns:
             duplicates: A list of tuples where each tuple contains two documents that are considered duplicates.
         """
-        duplicates = []
+        return [(documents[i], documents[j]) for i, j, _ in self.similarity_join(documents, threshold)]
+
+    def similarity_join(self, documents, threshold=0.8):
+        """
+        Finds every pair of documents whose word overlap ratio is at least `threshold`, exactly,
+        with an AllPairs/PPJoin set-similarity join.
+
+        A bag of words is turned into a set of (word, occurrence) tokens, which has the same
+        Jaccard similarity as the word counts. Tokens get integer ids from rarest to most
+        frequent and every document becomes a sorted list of ids. Documents are processed
+        from shortest to longest and only the first `len - ceil(threshold * len) + 1` ids (the
+        prefix) are probed in and added to an inverted index: two documents above the threshold
+        must share a token in their prefixes. Candidates that are too short (length filter) or
+        cannot reach the required overlap from the positions of their matches (positional
+        filter) are dropped, and the rest are verified exactly. On real text the prefixes hold
+        rare tokens, so the work grows roughly linearly with the collection.
+
+        Args:
+            documents: A list of document strings, or a dictionary of document IDs to strings.
+            threshold: The fraction of word overlap required to consider two documents as duplicates.
+
+        Returns:
+            list: `(i, j, overlap_ratio)` tuples, sorted, with `i` before `j` in `documents`, where
+            `i` and `j` are list positions or dictionary keys.
 
-        for i in range(len(documents)):
-            for j in range(i + 1, len(documents)):
-                doc1_tokens = self.tokenize(documents[i])
-                doc2_tokens = self.tokenize(documents[j])
+        Raises:
+            ValueError: If the threshold is not in (0, 1].
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold must be in (0, 1]")
+        ids = list(documents) if isinstance(documents, dict) else list(range(len(documents)))
+        texts = documents.values() if isinstance(documents, dict) else documents
 
-                total_words = sum((doc1_tokens | doc2_tokens).values())
-                common_words = sum((doc1_tokens & doc2_tokens).values())
+        with span("shingle", len(ids)):
+            records = [[(word, n) for word, count in self.tokenize(text).items() for n in range(count)] for text in texts]
+            frequency = Counter(token for record in records for token in record)
+            token_ids = {token: token_id for token_id, token in enumerate(sorted(frequency, key=frequency.__getitem__))}
+            records = [sorted(map(token_ids.__getitem__, record)) for record in records]
+            lengths = [len(record) for record in records]
 
-                overlap_ratio = common_words / total_words
+        # Bounds are rounded in the safe direction; the final test is the exact ratio
+        eps = 1e-9
+        index = defaultdict(list)  # token id -> [(document, position of the token in it)]
+        start = defaultdict(int)  # token id -> first posting long enough for the current length
+        pairs = []
+        with span("verify", len(records)):
+            for x in sorted(range(len(records)), key=lengths.__getitem__):
+                rx, lx = records[x], lengths[x]
+                if not lx:
+                    continue
+                min_length = math.ceil(threshold * lx - eps)
+                overlaps = {}
+                for i, token in enumerate(rx[:lx - min_length + 1]):
+                    postings = index[token]
+                    # Postings are in order of length, so documents too short for x are too short for all later ones
+                    first = start[token]
+                    while first < len(postings) and lengths[postings[first][0]] < min_length:
+                        first += 1
+                    start[token] = first
+                    for y, j in postings[first:]:
+                        overlap = overlaps.get(y, 0)
+                        if overlap < 0:
+                            continue
+                        ly = lengths[y]
+                        required = math.ceil(threshold / (1 + threshold) * (lx + ly) - eps)
+                        overlaps[y] = overlap + 1 if overlap + 1 + min(lx - i - 1, ly - j - 1) >= required else -1
+                    postings.append((x, i))
 
-                if overlap_ratio >= threshold:
-                    print(f"Duplicate found between: '{documents[i]}' and '{documents[j]}' with overlap ratio: {overlap_ratio}")
-                    duplicates.append((documents[i], documents[j]))
+                tokens = set(rx)
+                for y, overlap in overlaps.items():
+                    if overlap > 0:
+                        common = len(tokens.intersection(records[y]))
+                        ratio = common / (lx + lengths[y] - common)
+                        if ratio >= threshold:
+                            pairs.append((min(x, y), max(x, y), ratio))
 
-        return duplicates
+        pairs.sort()
+        return [(ids[a], ids[b], ratio) for a, b, ratio in pairs]
@@ -0,0 +1,226 @@
+"""
+Quality of deduplication runs against ground truth, and what it costs.
+
+Clusters are compared with ground-truth clusters (see `utils.synthetic_corpus`) by
+pair-level precision, recall and F1 and by cluster purity, computed from the contingency
+table of the two clusterings so no pair is ever enumerated. A sweep runs every
+(method, num_bands, rows_per_band, k) of a grid in parallel with `deduplication.bench`,
+joins the quality with the stage timings and memory of the same run, and reports the
+configurations on the Pareto frontier of quality versus cost. Run from the `src` directory:
+
+    python -m deduplication.evaluate --data corpus.tsv --truth corpus.truth.txt --bands 10 20 --rows 2 5 --k 3 5
+
+or score a cluster file written by the CLI, optionally joined with a `deduplication.bench` run:
+
+    python -m deduplication.evaluate --clusters ../output/corpus-LSH.txt --truth corpus.truth.txt --bench bench.json --method LSH
+"""
+import argparse
+import itertools
+import json
+import os
+from collections import Counter
+import pandas as pd
+import matplotlib.pyplot as plt
+from joblib import Parallel, delayed
+
+from deduplication.bench import run_method, DEFAULT_PARAMS
+from utils.utils import read_tsv
+
+QUALITY_METRICS = ("precision", "recall", "f1", "purity")
+
+
+def read_clusters(path):
+    """Reads a cluster file: one cluster per line, as document IDs separated by spaces."""
+    with open(path) as file:
+        return [list(map(int, line.split())) for line in file if line.strip()]
+
+
+def _pairs(count):
+    return count * (count - 1) // 2
+
+
+def evaluate_clusters(predicted, truth):
+    """
+    Scores predicted clusters against ground-truth clusters.
+
+    A pair of documents is a true positive when both clusterings put it together. Counting
+    pairs through the sizes of the clusters' intersections keeps this linear in the number
+    of documents. Documents missing from `predicted` count as singletons.
+
+    Args:
+        predicted (list): Predicted clusters, each a list of document IDs.
+        truth (list): Ground-truth clusters, each a list of document IDs.
+
+    Returns:
+        dict: `precision`, `recall` and `f1` over pairs, `purity` (the fraction of documents
+        in the most common ground-truth cluster of their predicted cluster), and the
+        `predicted_pairs`, `true_pairs` and `true_positive_pairs` counts.
+    """
+    label = {doc_id: number for number, cluster in enumerate(truth) for doc_id in cluster}
+    true_pairs = sum(_pairs(len(cluster)) for cluster in truth)
+
+    predicted_pairs = true_positive_pairs = majority = 0
+    seen = set()
+    for cluster in predicted:
+        overlap = Counter(label[doc_id] for doc_id in cluster if doc_id in label)
+        predicted_pairs += _pairs(len(cluster))
+        true_positive_pairs += sum(_pairs(count) for count in overlap.values())
+        majority += max(overlap.values(), default=0)
+        seen.update(cluster)
+    majority += len(label.keys() - seen)
+
+    precision = true_positive_pairs / predicted_pairs if predicted_pairs else 1.0
+    recall = true_positive_pairs / true_pairs if true_pairs else 1.0
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "purity": majority / len(label) if label else 1.0,
+        "predicted_pairs": predicted_pairs,
+        "true_pairs": true_pairs,
+        "true_positive_pairs": true_positive_pairs,
+    }
+
+
+def evaluate_run(result, truth):
+    """
+    Joins the quality of a `deduplication.bench` run with its cost.
+
+    Args:
+        result (dict): A `run_method` result made with `keep_clusters=True`.
+        truth (list): Ground-truth clusters.
+
+    Returns:
+        dict: The method and its parameters, the scores of `evaluate_clusters`, the time of
+        every stage (`<stage>_seconds`), `total_seconds`, `peak_rss_mb`, `candidate_pairs`
+        and `index_bytes`.
+    """
+    row = {"method": result["method"], "size": result["size"], **result["params"]}
+    row.update(evaluate_clusters(result["cluster_members"], truth))
+    row.update({f"{name}_seconds": stage["seconds"] for name, stage in result["stages"].items()})
+    for metric in ("total_seconds", "peak_rss_mb", "candidate_pairs", "index_bytes"):
+        row[metric] = result[metric]
+    return row
+
+
+def sweep_params(method, num_bands, rows_per_band, k):
+    """Constructor arguments of a method for one point of the sweep grid."""
+    params = dict(DEFAULT_PARAMS[method])
+    if method == "Baseline":
+        return params
+    params.update(num_bands=num_bands, rows_per_band=rows_per_band, k=k)
+    # Every tree of the forest bands its own num_bands * rows_per_band hash functions
+    params["num_hashes"] = num_bands * rows_per_band * params.get("num_trees", 1)
+    return params
+
+
+def _evaluate_config(docs, truth, method, params):
+    return evaluate_run(run_method(method, docs, n_jobs=1, keep_clusters=True, **params), truth)
+
+
+def sweep(docs, truth, methods=("LSH",), bands=(20,), rows=(5,), shingle_sizes=(8,), n_jobs=-1):
+    """
+    Runs and scores every (method, num_bands, rows_per_band, k) of a grid.
+
+    Configurations run in parallel worker processes, each with a single-process MinHash
+    stage, so their timings are comparable with each other but not with a run that uses
+    all cores. Workers are reused, so `peak_rss_mb` is the peak of the worker up to that
+    run rather than of the run alone. `Baseline` has no parameters and runs once.
+
+    Args:
+        docs (dict): Document IDs to document strings.
+        truth (list): Ground-truth clusters.
+        methods: names of the methods (keys of `deduplication.bench.METHODS`)
+        bands: values of num_bands
+        rows: values of rows_per_band
+        shingle_sizes: values of k
+        n_jobs: number of worker processes (joblib, -1 for all cores)
+
+    Returns:
+        pandas.DataFrame: One `evaluate_run` row per configuration.
+    """
+    configs = [(method, sweep_params(method, b, r, k)) for method in methods
+               for b, r, k in itertools.product(bands, rows, shingle_sizes)]
+    configs = list({json.dumps(config, sort_keys=True): config for config in configs}.values())
+    rows = Parallel(n_jobs=n_jobs)(delayed(_evaluate_config)(docs, truth, method, params) for method, params in configs)
+    return pd.DataFrame(rows)
+
+
+def pareto_frontier(results, quality="f1", cost="total_seconds"):
+    """
+    Returns the configurations no other configuration beats on both quality and cost.
+
+    Args:
+        results (pandas.DataFrame): The output of `sweep`.
+        quality (str): Column to maximize.
+        cost (str): Column to minimize.
+
+    Returns:
+        pandas.DataFrame: The frontier, cheapest first.
+    """
+    ordered = results.sort_values([cost, quality], ascending=[True, False])
+    best, keep = float("-inf"), []
+    for index, value in ordered[quality].items():
+        if value > best:
+            keep.append(index)
+            best = value
+    return ordered.loc[keep]
+
+
+def plot_pareto(results, output_dir, quality="f1", cost="total_seconds"):
+    """Saves a scatter plot of quality versus cost with the Pareto frontier (`pareto.png`)."""
+    frontier = pareto_frontier(results, quality, cost)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for method, rows in results.groupby("method"):
+        ax.scatter(rows[cost], rows[quality], label=method, alpha=0.7)
+    ax.plot(frontier[cost], frontier[quality], color='black', linestyle='--', marker='o', label='Pareto frontier')
+    ax.set_xlabel(cost.replace('_', ' ').capitalize())
+    ax.set_ylabel(quality.capitalize())
+    ax.set_title(f'{quality.capitalize()} vs. {cost.replace("_", " ")}')
+    ax.legend()
+    ax.grid(True)
+    fig.savefig(os.path.join(output_dir, "pareto.png"), format='png')
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score deduplication runs against ground truth")
+    parser.add_argument("--truth", required=True, help="Ground-truth cluster file")
+    parser.add_argument("--clusters", help="Cluster file to score, e.g. from the CLI's ./output")
+    parser.add_argument("--bench", help="deduplication.bench results to join with --clusters")
+    parser.add_argument("--method", help="Method of the --clusters run, to find it in --bench")
+    parser.add_argument("--data", help="TSV corpus to sweep over")
+    parser.add_argument("--methods", nargs="+", default=["LSH"], choices=list(DEFAULT_PARAMS), help="Methods to sweep")
+    parser.add_argument("--bands", nargs="+", type=int, default=[20], help="Values of num_bands")
+    parser.add_argument("--rows", nargs="+", type=int, default=[5], help="Values of rows_per_band")
+    parser.add_argument("--k", nargs="+", type=int, default=[8], help="Shingle sizes")
+    parser.add_argument("--quality", default="f1", choices=QUALITY_METRICS, help="Quality metric of the frontier")
+    parser.add_argument("--cost", default="total_seconds", help="Cost column of the frontier, e.g. peak_rss_mb")
+    parser.add_argument("--jobs", type=int, default=-1, help="Worker processes (-1 for all cores)")
+    parser.add_argument("--output", default="evaluation", help="Directory for results.csv, frontier.csv and pareto.png")
+    args = parser.parse_args()
+
+    truth = read_clusters(args.truth)
+    if args.clusters:
+        row = evaluate_clusters(read_clusters(args.clusters), truth)
+        if args.bench:
+            with open(args.bench) as file:
+                runs = json.load(file)["results"]
+            size = sum(len(cluster) for cluster in truth)
+            run = next((run for run in runs if run["method"] == args.method and run["size"] == size), None)
+            if run is None:
+                parser.error(f"{args.bench} has no {args.method} run on {size} documents")
+            row.update({f"{name}_seconds": stage["seconds"] for name, stage in run["stages"].items()})
+            row.update({metric: run[metric] for metric in ("total_seconds", "peak_rss_mb", "candidate_pairs", "index_bytes")})
+        print(json.dumps(row, indent=2))
+    elif args.data:
+        results = sweep(read_tsv(args.data), truth, args.methods, args.bands, args.rows, args.k, args.jobs)
+        frontier = pareto_frontier(results, args.quality, args.cost)
+        os.makedirs(args.output, exist_ok=True)
+        results.to_csv(os.path.join(args.output, "results.csv"), index=False)
+        frontier.to_csv(os.path.join(args.output, "frontier.csv"), index=False)
+        plot_pareto(results, args.output, args.quality, args.cost)
+        columns = ["method", "num_bands", "rows_per_band", "k", *QUALITY_METRICS, args.cost]
+        print(frontier[[column for column in columns if column in frontier]].to_string(index=False))
+    else:
+        parser.error("either --clusters or --data is required")
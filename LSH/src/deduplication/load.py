@@ -1,4 +1,6 @@
+import logging
 import os
+import sys
 import pymongo
 
 from deduplication.LSH import LSH
@@ -7,6 +9,9 @@ import pandas as pd
 
 from collections import defaultdict
 from utils.utils import UnionFind, clean_document, shingle, minhash
+from deduplication.tuning import estimate_cost, format_estimate
+from utils.instrumentation import Instrumentation, set_instrumentation, span
+from utils.profiling import profiler_from_env
 
 import hashlib
 
@@ -14,13 +19,30 @@ import hashlib
 mongo_host = os.getenv("MONGO_HOST", "localhost")
 mongo_port = int(os.getenv("MONGO_PORT", "27017"))
 
+# Estimate each collection from a sample before indexing it (DEDUP_DRY_RUN=1 only estimates)
+dry_run = os.getenv("DEDUP_DRY_RUN", "0") == "1"
+max_seconds = float(os.getenv("DEDUP_MAX_SECONDS")) if os.getenv("DEDUP_MAX_SECONDS") else None
+max_memory = int(os.getenv("DEDUP_MAX_MEMORY_MB")) * 1024 * 1024 if os.getenv("DEDUP_MAX_MEMORY_MB") else None
+force = os.getenv("DEDUP_FORCE", "0") == "1"
+sample_size = int(os.getenv("DEDUP_SAMPLE_SIZE", "1000"))
+
+# Time and memory of every stage, written as a JSON report and/or Prometheus text at the end if set
+report_path = os.getenv("DEDUP_REPORT")
+prometheus_path = os.getenv("DEDUP_PROMETHEUS")
+# Profile every stage with DEDUP_PROFILE=cpu|sample|memory, written to DEDUP_PROFILE_DIR at the end
+profiler = profiler_from_env()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+instrumentation = Instrumentation(run="load", log_spans=True, profiler=profiler)
+set_instrumentation(instrumentation)
+
 # Connect to MongoDB
 client = pymongo.MongoClient(f"mongodb://{mongo_host}:{mongo_port}")
 db = client['data_db']  # Connect to the database
 
 
 collections = db.list_collection_names()
-filtered_collections = [name for name in collections if (not name.endswith('_index') and name != 'five' and not name.endswith('_signature'))]  # Filter out too short
+filtered_collections = [name for name in collections if (not name.endswith('_index') and name != 'five' and not name.endswith('_signature') and not name.endswith('_duplicates'))]  # Filter out too short
 
 
 # Function to fetch data from a specific collection
@@ -32,6 +54,30 @@ def fetch_data_from_collection(collection_name):
     result_dict = {document['_id']: document['text'] for document in documents}
     return result_dict
 
+
+# Function to fetch a random sample of a collection, so the estimate does not read all of it
+def sample_collection(collection_name, size):
+    documents = db[collection_name].aggregate([{"$sample": {"size": size}}])
+    return {document['_id']: document['text'] for document in documents}
+
+
+if dry_run or max_seconds is not None or max_memory is not None:
+    for i in list(filtered_collections):
+        estimate = estimate_cost(sample_collection(i, sample_size), num_hashes=100, num_bands=20, rows_per_band=5, k=10,
+                                 num_docs=db[i].estimated_document_count(), time_budget=max_seconds,
+                                 memory_budget=max_memory, sample_size=sample_size)
+        print(f"Estimate for {i}:")
+        for line in format_estimate(estimate):
+            print(f"  {line}")
+        if estimate["over_budget"] and not dry_run:
+            if force:
+                print(f"Projected {' and '.join(estimate['over_budget'])} of {i} exceeds the budget; indexing anyway (DEDUP_FORCE=1)")
+            else:
+                print(f"Projected {' and '.join(estimate['over_budget'])} of {i} exceeds the budget; skipping it (DEDUP_FORCE=1 to override)")
+                filtered_collections.remove(i)
+    if dry_run:
+        sys.exit(0)
+
 for i in filtered_collections:
     
     index_name = i + "_index"
@@ -45,7 +91,9 @@ for i in filtered_collections:
 
     print(f"Processing collection: {i}")
 
-    data_dict = fetch_data_from_collection(i)
+    with span("read") as stage:
+        data_dict = fetch_data_from_collection(i)
+        stage.items = len(data_dict)
 
     lsh = LSH(num_hashes=100, num_bands=20, rows_per_band=5, k=10)
     signatures = lsh.compute_minhash_signatures(data_dict)
@@ -60,26 +108,27 @@ for i in filtered_collections:
 
     print(f"Insert to MongoDB : {index_name}")
     
-    documents = []
-    count = 0
-
-    for key, value in lsh.index.items():
-        document = {
-            "index": key[0],
-            "tuple_key": key[1],  # Storing the tuple as a list in MongoDB
-            "values": value
-        }
-        documents.append(document)
-        count += 1
-
-        # If the batch size is reached, insert and reset the documents list
-        if count % 10000 == 0:
+    with span("write", len(lsh.index)):
+        documents = []
+        count = 0
+
+        for key, value in lsh.index.items():
+            document = {
+                "index": key[0],
+                "tuple_key": key[1],  # Storing the tuple as a list in MongoDB
+                "values": value
+            }
+            documents.append(document)
+            count += 1
+
+            # If the batch size is reached, insert and reset the documents list
+            if count % 10000 == 0:
+                collection.insert_many(documents)
+                documents = []  # Clear the batch list after insertion
+
+        # Insert any remaining documents in the final batch
+        if documents:
             collection.insert_many(documents)
-            documents = []  # Clear the batch list after insertion
-
-    # Insert any remaining documents in the final batch
-    if documents:
-        collection.insert_many(documents)
 
     print(f"All {index_name} signatures stored in MongoDB.")
 
@@ -113,7 +162,9 @@ for i in filtered_collections:
     print(f"Processing collection: {index_name}")
 
 
-    data_dict = fetch_data_from_collection(i)
+    with span("read") as stage:
+        data_dict = fetch_data_from_collection(i)
+        stage.items = len(data_dict)
 
     lsh = LSH(num_hashes=100, num_bands=20, rows_per_band=5, k=10)
     signatures = lsh.compute_minhash_signatures(data_dict)
@@ -123,25 +174,36 @@ for i in filtered_collections:
 
     signatures = convert_values_to_strings(signatures)
 
-    documents = []
-    count = 0
-
-    for key, value in signatures.items():
-        document = {
-            "doc": key,
-            "signature": value
-        }
-        documents.append(document)
-        count += 1
-
-        # If the batch size is reached, insert and reset the documents list
-        if count % 10000 == 0:
+    with span("write", len(signatures)):
+        documents = []
+        count = 0
+
+        for key, value in signatures.items():
+            document = {
+                "doc": key,
+                "signature": value
+            }
+            documents.append(document)
+            count += 1
+
+            # If the batch size is reached, insert and reset the documents list
+            if count % 10000 == 0:
+                collection.insert_many(documents)
+                documents = []  # Clear the batch list after insertion
+                print(f"{count} input in mongodb")
+
+        # Insert any remaining documents in the final batch
+        if documents:
             collection.insert_many(documents)
-            documents = []  # Clear the batch list after insertion
-            print(f"{count} input in mongodb")
 
-    # Insert any remaining documents in the final batch
-    if documents:
-        collection.insert_many(documents)
+    print(f"All {index_name} signatures stored in MongoDB.")
+
 
-    print(f"All {index_name} signatures stored in MongoDB.")
\ No newline at end of file
+instrumentation.log_summary()
+if report_path:
+    instrumentation.write_json(report_path)
+if prometheus_path:
+    instrumentation.write_prometheus(prometheus_path)
+if profiler is not None:
+    print(f"Wrote {len(profiler.dump())} profile files to {profiler.output_dir}")
+    profiler.close()
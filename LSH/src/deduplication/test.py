@@ -20,7 +20,7 @@ db = client['data_db']  # Connect to the database
 
 
 collections = db.list_collection_names()
-filtered_collections = [name for name in collections if (not name.endswith('_index') and name != 'five' and not name.endswith('_signature'))]  # Filter out too short
+filtered_collections = [name for name in collections if (not name.endswith('_index') and name != 'five' and not name.endswith('_signature') and not name.endswith('_duplicates'))]  # Filter out too short
 
 
 
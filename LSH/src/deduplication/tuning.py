@@ -0,0 +1,361 @@
+"""
+Automatic choice of the banding parameters (b, r).
+
+A pair of documents with Jaccard similarity `s` shares at least one of `b` bands of `r`
+MinHash values with probability `1 - (1 - s^r)^b`, the S-curve of
+`utils.visualization_lsh.plot_s_curves` (for a forest, a majority of its trees must agree).
+Integrating the curve below a target threshold gives the weight of false positives and
+above it the weight of false negatives. Every (b, r) that fits the hash budget is ranked
+by their weighted sum, and the best few are measured on a sample of the corpus: the sample
+is signed once, banded with each candidate (b, r), and its candidate pairs, signing and
+banding times are extrapolated to the whole collection to check a time or memory budget.
+`estimate_cost` makes the same projection for given parameters, a dry run of a full job.
+"""
+import math
+import sys
+import time
+import numpy as np
+
+from deduplication.LSHForest import band_tree
+from utils.utils import clean_document, shingle, minhash, remove_exact_duplicates, majority_vote, split_columns
+
+INTEGRATION_POINTS = 1000
+# Band collisions of the sample turned into pairs to time that step; later bands are skipped
+PAIR_TIMING_COLLISIONS = 100000
+
+# Sizes of the Python objects the LSH classes keep per hash value, band index entry and candidate pair
+VALUE_BYTES = sys.getsizeof(2 ** 63) + 8
+ENTRY_BYTES = sys.getsizeof((0, "0" * 32)) + sys.getsizeof("0" * 32) + 2 * 8
+PAIR_BYTES = sys.getsizeof((0, 0)) + 2 * 8
+
+
+def candidate_probability(s, num_bands, rows_per_band, num_trees=1):
+    """
+    Probability that a pair with Jaccard similarity `s` becomes a candidate pair.
+
+    Args:
+        s (float or numpy.ndarray): Jaccard similarity.
+        num_bands (int): Number of bands (per tree).
+        rows_per_band (int): Rows in each band.
+        num_trees (int): Trees of an `LSHForest`, which keeps pairs found by more than half of them.
+
+    Returns:
+        float or numpy.ndarray: The probability, for every `s`.
+    """
+    p = 1 - (1 - np.asarray(s, dtype=np.float64) ** rows_per_band) ** num_bands
+    if num_trees == 1:
+        return p
+    votes = num_trees // 2 + 1
+    return sum(math.comb(num_trees, j) * p ** j * (1 - p) ** (num_trees - j) for j in range(votes, num_trees + 1))
+
+
+def error_weights(threshold, num_bands, rows_per_band, num_trees=1):
+    """
+    Integrates the S-curve on both sides of the threshold (midpoint rule).
+
+    Returns:
+        tuple: (false positive weight, the area under the curve below `threshold`;
+        false negative weight, the area above the curve beyond `threshold`)
+    """
+    below = (np.arange(INTEGRATION_POINTS) + 0.5) / INTEGRATION_POINTS * threshold
+    above = threshold + (np.arange(INTEGRATION_POINTS) + 0.5) / INTEGRATION_POINTS * (1 - threshold)
+    false_positive = candidate_probability(below, num_bands, rows_per_band, num_trees).mean() * threshold
+    false_negative = (1 - candidate_probability(above, num_bands, rows_per_band, num_trees)).mean() * (1 - threshold)
+    return float(false_positive), float(false_negative)
+
+
+def expected_recall(threshold, num_bands, rows_per_band, num_trees=1):
+    """Mean candidate probability of pairs above `threshold`, for similarities spread uniformly."""
+    _, false_negative = error_weights(threshold, num_bands, rows_per_band, num_trees)
+    return 1 - false_negative / (1 - threshold) if threshold < 1 else 1.0
+
+
+def rank_parameters(threshold, num_hashes, fn_weight=0.5, fp_weight=0.5, num_trees=1):
+    """
+    Ranks every (b, r) with `b * r` hash functions per tree within the budget.
+
+    Args:
+        threshold (float): Target Jaccard similarity.
+        num_hashes (int): Hash functions available (in total, for a forest).
+        fn_weight (float): Weight of false negatives.
+        fp_weight (float): Weight of false positives.
+        num_trees (int): Trees of an `LSHForest`, 1 otherwise.
+
+    Returns:
+        list: `(error, num_bands, rows_per_band)` tuples, lowest weighted error first.
+    """
+    per_tree = num_hashes // num_trees
+    ranked = []
+    for b in range(1, per_tree + 1):
+        for r in range(1, per_tree // b + 1):
+            false_positive, false_negative = error_weights(threshold, b, r, num_trees)
+            ranked.append((fp_weight * false_positive + fn_weight * false_negative, b, r))
+    ranked.sort()
+    return ranked
+
+
+def bucket_sizes(block):
+    """
+    Sizes of the buckets of one band.
+
+    Args:
+        block (numpy.ndarray): The `(num_docs, rows_per_band)` band rows of a signature matrix.
+
+    Returns:
+        numpy.ndarray: The number of documents in every distinct band value.
+    """
+    return np.diff(_sorted_buckets(block)[1])
+
+
+def _sorted_buckets(block):
+    # Row order that groups equal band values, and the offsets where each group starts (and the last ends)
+    order = np.lexsort(block.T[::-1])
+    rows = block[order]
+    boundaries = np.flatnonzero((rows[1:] != rows[:-1]).any(axis=1)) + 1
+    return order, np.concatenate(([0], boundaries, [len(rows)]))
+
+
+def _time_pairs(order, offsets, candidate_pairs):
+    """Turns the buckets of one band into pairs as `LSH.banding` does and returns the seconds it took."""
+    start = time.perf_counter()
+    for first, end in zip(offsets[:-1], offsets[1:]):
+        if end - first > 1:
+            doc_ids = order[first:end].tolist()
+            for i in range(len(doc_ids)):
+                for j in range(i + 1, len(doc_ids)):
+                    candidate_pairs.add((doc_ids[i], doc_ids[j]))
+    return time.perf_counter() - start
+
+
+def _sample_candidates(matrix, num_bands, rows_per_band, num_trees):
+    trees = [band_tree(matrix, columns, num_bands, rows_per_band) for columns in split_columns(matrix.shape[1], num_trees)]
+    return len(trees[0]) if num_trees == 1 else len(majority_vote(trees))
+
+
+def _sign_sample(docs, num_hashes, k, sample_size, seed, num_docs=None):
+    """Signs a random sample of `docs` (exact duplicates removed) and measures its cost per document."""
+    rng = np.random.default_rng(seed)
+    doc_ids = list(docs)
+    num_docs = len(doc_ids) if num_docs is None else num_docs
+    chosen = rng.choice(len(doc_ids), min(sample_size, len(doc_ids)), replace=False)
+    sample, _ = remove_exact_duplicates({doc_ids[i]: docs[doc_ids[i]] for i in chosen})
+    unique_docs = num_docs * len(sample) / len(chosen)
+
+    start = time.perf_counter()
+    cleaned = [clean_document(doc) for doc in sample.values()]
+    signatures = [minhash(shingle(doc, k), num_hashes) for doc in cleaned]
+    sign_seconds = (time.perf_counter() - start) / max(len(sample) * num_hashes, 1)
+
+    return {
+        "matrix": np.array(signatures, dtype=np.uint64).reshape(len(signatures), num_hashes),
+        "num_docs": num_docs,
+        "unique_docs": unique_docs,
+        # Candidate pairs grow with the square of the collection
+        "pair_scale": unique_docs * (unique_docs - 1) / max(len(sample) * (len(sample) - 1), 1),
+        "sign_seconds": sign_seconds,
+        # The raw documents of every input row and the cleaned text of the unique ones
+        "doc_bytes": (sum(map(sys.getsizeof, sample.values())) + sum(map(sys.getsizeof, cleaned))) / max(len(sample), 1),
+    }
+
+
+def _project(sample, num_bands, rows_per_band, num_trees):
+    """Bands the sample with (b, r) and extrapolates its buckets, pairs, time and memory to the collection."""
+    matrix = sample["matrix"]
+    n, unique_docs, scale = len(matrix), sample["unique_docs"], sample["pair_scale"]
+    # Every hash function is computed, each tree bands the first b * r columns of its split as LSHForest does
+    hashes = matrix.shape[1]
+
+    bands = []
+    timed_pairs, pair_seconds, pairs = 0, 0.0, set()
+    for tree, columns in enumerate(split_columns(hashes, num_trees)):
+        block = matrix[:, columns]
+        for band in range(num_bands):
+            order, offsets = _sorted_buckets(block[:, band * rows_per_band:(band + 1) * rows_per_band])
+            sizes = np.diff(offsets)
+            sample_pairs = int((sizes * (sizes - 1) // 2).sum())
+            if timed_pairs < PAIR_TIMING_COLLISIONS:
+                pair_seconds += _time_pairs(order, offsets, pairs)
+                timed_pairs += sample_pairs
+            bands.append({
+                "tree": tree,
+                "band": band,
+                "buckets": len(sizes),
+                "mean_bucket_size": n / len(sizes),
+                "largest_bucket_fraction": sizes.max() / n,
+                "sample_pairs": sample_pairs,
+                "estimated_pairs": sample_pairs * scale,
+            })
+
+    del pairs
+    # No collision in the sample projects to none in the collection, so the cost per pair does not matter then
+    pair_seconds /= max(timed_pairs, 1)
+
+    start = time.perf_counter()
+    sample_pairs = _sample_candidates(matrix, num_bands, rows_per_band, num_trees)
+    band_seconds = (time.perf_counter() - start) / max(n * num_bands * num_trees, 1)
+
+    # Pairs found in several bands are counted once per band
+    collisions = sum(band["estimated_pairs"] for band in bands)
+    candidate_pairs = sample_pairs * scale
+    pair_bytes = candidate_pairs * PAIR_BYTES
+    if num_trees > 1:
+        # Each tree concatenates the int64 codes of all its bands before making them unique
+        pair_bytes += max(sum(band["estimated_pairs"] for band in bands if band["tree"] == tree)
+                          for tree in range(num_trees)) * 2 * 8
+    entries = sum(band["buckets"] for band in bands) / max(n, 1) * unique_docs
+    index_bytes = entries * ENTRY_BYTES + unique_docs * num_bands * num_trees * 8
+    signature_bytes = unique_docs * hashes * VALUE_BYTES
+    document_bytes = sample["num_docs"] * sample["doc_bytes"]
+    return {
+        "num_hashes": hashes,
+        "num_bands": num_bands,
+        "rows_per_band": rows_per_band,
+        "bands": bands,
+        "estimated_candidate_pairs": candidate_pairs,
+        "estimated_band_collisions": collisions,
+        "estimated_index_bytes": index_bytes,
+        "estimated_bytes": document_bytes + signature_bytes + index_bytes + pair_bytes,
+        "estimated_seconds": (unique_docs * (hashes * sample["sign_seconds"] + num_bands * num_trees * band_seconds) +
+                              collisions * pair_seconds),
+    }
+
+
+def _within_budget(estimate, time_budget, memory_budget):
+    over = []
+    if time_budget is not None and estimate["estimated_seconds"] > time_budget:
+        over.append("time")
+    if memory_budget is not None and estimate["estimated_bytes"] > memory_budget:
+        over.append("memory")
+    return over
+
+
+def tune_parameters(docs, threshold=0.8, num_hashes=100, k=8, num_trees=1, fn_weight=0.5, fp_weight=0.5,
+                    time_budget=None, memory_budget=None, sample_size=1000, num_candidates=10, seed=0):
+    """
+    Chooses (b, r) for a corpus from the S-curve, refined by a sampled measurement.
+
+    The `num_candidates` best (b, r) of `rank_parameters` are banded on a random sample of
+    `sample_size` documents (exact duplicates removed, as the LSH classes do), and their
+    cost on the whole collection is projected as in `estimate_cost`. The lowest-error
+    (b, r) within both budgets is chosen; if none fits, the cheapest one. For
+    `LSHImproved` the sampled volume is a lower bound, as probing adds candidates.
+
+    Args:
+        docs (dict): Document IDs to document strings.
+        threshold (float): Target Jaccard similarity.
+        num_hashes (int): Hash functions available (in total, for a forest).
+        k (int): Shingle size.
+        num_trees (int): Trees of an `LSHForest`, 1 for `LSH` and `LSHImproved`.
+        fn_weight (float): Weight of false negatives.
+        fp_weight (float): Weight of false positives.
+        time_budget (float): Seconds the full run may take, None for no limit.
+        memory_budget (float): Bytes the full run may use, None for no limit.
+        sample_size (int): Documents to sample.
+        num_candidates (int): Best theoretical (b, r) to measure on the sample.
+        seed (int): Seed of the sample.
+
+    Returns:
+        dict: `num_hashes` (the hash functions to compute, `b * r` per tree), `num_bands`,
+        `rows_per_band`, `expected_recall`, `false_positive_weight`, `false_negative_weight`,
+        the projections of `estimate_cost`, `within_budget` and `candidates`, the same
+        figures for every measured (b, r).
+    """
+    sample = _sign_sample(docs, num_hashes, k, sample_size, seed)
+
+    candidates = []
+    for error, b, r in rank_parameters(threshold, num_hashes, fn_weight, fp_weight, num_trees)[:num_candidates]:
+        false_positive, false_negative = error_weights(threshold, b, r, num_trees)
+        candidate = {
+            "error": error,
+            "expected_recall": expected_recall(threshold, b, r, num_trees),
+            "false_positive_weight": false_positive,
+            "false_negative_weight": false_negative,
+        }
+        candidate.update(_project(dict(sample, matrix=sample["matrix"][:, :b * r * num_trees]), b, r, num_trees))
+        candidate["within_budget"] = not _within_budget(candidate, time_budget, memory_budget)
+        candidates.append(candidate)
+
+    fitting = [candidate for candidate in candidates if candidate["within_budget"]]
+    if fitting:
+        best = min(fitting, key=lambda candidate: candidate["error"])
+    else:
+        cost = "estimated_seconds" if memory_budget is None else "estimated_bytes"
+        best = min(candidates, key=lambda candidate: candidate[cost])
+    return dict(best, candidates=candidates)
+
+
+def estimate_cost(docs, num_hashes=100, num_bands=20, rows_per_band=5, k=8, num_trees=1, num_docs=None,
+                  time_budget=None, memory_budget=None, sample_size=1000, seed=0):
+    """
+    Projects the cost of a full deduplication run from a sample, without running it.
+
+    A random sample of `docs` is signed and banded with (b, r), and the size of every
+    bucket of every band is measured. A band whose sample has buckets of sizes `c_i`
+    collides `sum c_i (c_i - 1) / 2` pairs, and scaling by `N_u (N_u - 1) / (n_u (n_u - 1))`
+    for `N_u` and `n_u` unique documents in the collection and the sample projects it to
+    the collection, so a band with a hot bucket (boilerplate, empty documents) shows up
+    long before it produces billions of pairs. Time is the measured signing time per hash
+    function and banding time per band scaled to the collection, plus the cost per band
+    collision of turning the sample's buckets into a set of pairs, timed on the sample. Memory counts the documents, signatures and band index as Python
+    objects and the candidate pairs as the classes hold them: a set of tuples, plus the
+    packed codes of the largest tree for a forest.
+
+    Args:
+        docs (dict): Document IDs to document strings, the whole collection or a sample of it.
+        num_hashes (int): Hash functions of the run (in total, for a forest).
+        num_bands (int): Number of bands (per tree).
+        rows_per_band (int): Rows in each band.
+        k (int): Shingle size.
+        num_trees (int): Trees of an `LSHForest`, 1 for `LSH` and `LSHImproved`.
+        num_docs (int): Documents in the collection when `docs` is a sample of it, None for `len(docs)`.
+        time_budget (float): Seconds the run may take, None for no limit.
+        memory_budget (float): Bytes the run may use, None for no limit.
+        sample_size (int): Documents to sample.
+        seed (int): Seed of the sample.
+
+    Returns:
+        dict: `num_docs`, `unique_docs`, `sample_size`, `num_hashes`, `num_bands`,
+        `rows_per_band`, `num_trees`, `bands` (buckets, mean bucket size, largest bucket
+        fraction and sampled and projected pairs of every band), `estimated_candidate_pairs`,
+        `estimated_band_collisions`, `estimated_index_bytes`, `estimated_bytes` (peak memory),
+        `estimated_seconds`, `over_budget` (the exceeded budgets, "time" and/or "memory") and
+        `within_budget`. When `docs` is empty every projection is zero and `bands` is empty.
+    """
+    if num_hashes // num_trees < num_bands * rows_per_band:
+        raise ValueError(f"{num_bands} bands of {rows_per_band} rows need more than {num_hashes // num_trees} "
+                         f"hash functions per tree")
+    if not docs:
+        # An empty collection (or an empty sample of one) costs nothing
+        return {"num_docs": num_docs or 0, "unique_docs": 0, "sample_size": 0, "num_trees": num_trees,
+                "num_hashes": num_hashes, "num_bands": num_bands, "rows_per_band": rows_per_band, "bands": [],
+                "estimated_candidate_pairs": 0, "estimated_band_collisions": 0, "estimated_index_bytes": 0,
+                "estimated_bytes": 0, "estimated_seconds": 0.0, "over_budget": [], "within_budget": True}
+    sample = _sign_sample(docs, num_hashes, k, sample_size, seed, num_docs)
+    estimate = {"num_docs": sample["num_docs"], "unique_docs": sample["unique_docs"], "sample_size": len(sample["matrix"]),
+                "num_trees": num_trees}
+    estimate.update(_project(sample, num_bands, rows_per_band, num_trees))
+    estimate["over_budget"] = _within_budget(estimate, time_budget, memory_budget)
+    estimate["within_budget"] = not estimate["over_budget"]
+    return estimate
+
+
+def format_estimate(estimate):
+    """Formats an `estimate_cost` result as lines of text for logs."""
+    if not estimate["bands"]:
+        return [f"Nothing to sign: the sample of {estimate['num_docs']} documents is empty"]
+    largest = max(estimate["bands"], key=lambda band: band["largest_bucket_fraction"])
+    lines = [
+        f"Signed {estimate['sample_size']} unique sampled documents of {estimate['num_docs']} "
+        f"(~{estimate['unique_docs']:.0f} unique after exact deduplication)",
+        f"Buckets per band: {min(band['buckets'] for band in estimate['bands'])}-"
+        f"{max(band['buckets'] for band in estimate['bands'])} in the sample; largest bucket holds "
+        f"{largest['largest_bucket_fraction']:.1%} of the sample (tree {largest['tree']}, band {largest['band']})",
+        f"Projected candidate pairs: {estimate['estimated_candidate_pairs']:,.0f} "
+        f"({estimate['estimated_band_collisions']:,.0f} band collisions)",
+        f"Projected index size: {estimate['estimated_index_bytes'] / 2 ** 20:,.1f} MB",
+        f"Projected peak memory: {estimate['estimated_bytes'] / 2 ** 20:,.1f} MB",
+        f"Projected runtime: {estimate['estimated_seconds']:,.1f} seconds",
+    ]
+    if estimate["over_budget"]:
+        lines.append(f"Over budget: {', '.join(estimate['over_budget'])}")
+    return lines
@@ -0,0 +1,201 @@
+"""
+Benchmark of the membership filters in `deduplication.bloom_filter`.
+
+For every filter class and every (n, f, k) of a grid, a filter is filled with `n` distinct
+strings and probed with strings that were never inserted, all through the batch
+`add_many`/`query_many` APIs in chunks, so `n = 10**7` runs in seconds per filter rather
+than hours. Grid points run in parallel worker processes. Run from the `src` directory:
+
+    python -m utils.bloom_benchmark --n 100000 1000000 --f 0.01 0.001 --k 3 5 7
+
+The results table is written to `<output>/results.csv` next to the plots.
+"""
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from joblib import Parallel, delayed
+
+from deduplication.bloom_filter import (BloomFilter, BloomFilter_KM_Opt, BloomFilter_Uni_Hash, BlockedBloomFilter,
+                                        ScalableBloomFilter, BloomFilter_QF, CuckooFilter)
+
+FILTER_CLASSES = {cls.__name__: cls for cls in (BloomFilter, BloomFilter_KM_Opt, BloomFilter_Uni_Hash, BlockedBloomFilter,
+                                                ScalableBloomFilter, BloomFilter_QF, CuckooFilter)}
+"""FILTER_CLASSES (dict): The benchmarked filter classes by name"""
+
+TUNABLE_K = (BloomFilter, BloomFilter_KM_Opt, BloomFilter_Uni_Hash, BlockedBloomFilter)
+"""TUNABLE_K (tuple): Filter classes that accept an explicit number of hash functions `k`"""
+
+CHUNK_SIZE = 1000000
+
+
+def _chunks(prefix, count):
+    # Single-token strings, so BloomFilter's n-grams are the items themselves
+    for start in range(0, count, CHUNK_SIZE):
+        yield [f"{prefix}{i}" for i in range(start, min(count, start + CHUNK_SIZE))]
+
+
+def measure_filter(cls, n, f, k=None, num_lookups=100000, seed=0):
+    """
+    Fills one filter with `n` items and measures it.
+
+    Args:
+        cls: filter class taking `(n, f)` (and `k` if it is in `TUNABLE_K`)
+        n: number of elements
+        f: desired false positive rate
+        k: number of hash functions, None for the class default
+        num_lookups: number of lookups of absent items
+        seed: varies the generated items between runs
+
+    Returns:
+        dict: `filter`, `n`, `f`, `k`, `n_bytes`, `bits_per_item`, `inserts_per_sec`,
+        `lookups_per_sec` and `false_positive_rate` (the empirical rate).
+    """
+    bf = cls(n, f, k=k) if k else cls(n, f)
+
+    insert_time = 0.0
+    for chunk in _chunks(f"member{seed}x", n):
+        start = time.perf_counter()
+        bf.add_many(chunk)
+        insert_time += time.perf_counter() - start
+
+    lookup_time, false_positives = 0.0, 0
+    for chunk in _chunks(f"absent{seed}x", num_lookups):
+        start = time.perf_counter()
+        false_positives += int(np.count_nonzero(bf.query_many(chunk)))
+        lookup_time += time.perf_counter() - start
+
+    return {
+        "filter": cls.__name__,
+        "n": n,
+        "f": f,
+        "k": getattr(bf, "k", None),
+        "n_bytes": bf.n_bytes,
+        "bits_per_item": 8 * bf.n_bytes / n,
+        "inserts_per_sec": n / insert_time,
+        "lookups_per_sec": num_lookups / lookup_time,
+        "false_positive_rate": false_positives / num_lookups,
+    }
+
+
+def run_benchmark(filters=None, n_values=(100000,), f_values=(0.01, 0.001), k_values=(None,), num_lookups=100000,
+                  n_jobs=-1, output_dir="bloom_benchmark"):
+    """
+    Measures every filter class over the grid of `n_values` x `f_values` x `k_values`.
+
+    Explicit values of k only apply to the classes in `TUNABLE_K`; the other classes run once
+    per (n, f). Workers share the CPU and memory bandwidth, so use `n_jobs=1` when the
+    throughput numbers matter more than the wall time.
+
+    Args:
+        filters: filter classes to measure, all of `FILTER_CLASSES` by default
+        n_values: numbers of elements
+        f_values: desired false positive rates
+        k_values: numbers of hash functions, None for each class's default
+        num_lookups: number of lookups of absent items per grid point
+        n_jobs: number of worker processes (joblib, -1 for all cores)
+        output_dir: directory for `results.csv` and the plots, None to skip writing
+
+    Returns:
+        pandas.DataFrame: One row per grid point, with the columns of `measure_filter`.
+    """
+    filters = filters or list(FILTER_CLASSES.values())
+    grid = [(cls, n, f, k) for cls in filters for n in n_values for f in f_values
+            for k in (k_values if cls in TUNABLE_K else (None,))]
+    # The same class may appear once per k = None in k_values
+    grid = list(dict.fromkeys(grid))
+
+    rows = Parallel(n_jobs=n_jobs)(delayed(measure_filter)(cls, n, f, k, num_lookups) for cls, n, f, k in grid)
+    results = pd.DataFrame(rows)
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        results.to_csv(os.path.join(output_dir, "results.csv"), index=False)
+        plot_benchmark(results, output_dir)
+    return results
+
+
+def plot_benchmark(results, output_dir):
+    """
+    Saves the plots of a `run_benchmark` table: observed vs target FPR (`fpr.png`),
+    throughput (`throughput.png`), space (`space.png`) and, when several k were
+    measured, FPR vs k (`fpr_vs_k.png`).
+
+    Args:
+        results (pandas.DataFrame): The output of `run_benchmark`.
+        output_dir: directory to save the plots in
+    """
+    defaults = results.groupby(["filter", "n", "f"], as_index=False).first()
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for name, rows in defaults.groupby("filter"):
+        rows = rows.groupby("f", as_index=False)["false_positive_rate"].mean()
+        ax.plot(rows["f"], rows["false_positive_rate"].clip(lower=1e-7), marker='o', label=name)
+    targets = np.sort(defaults["f"].unique())
+    ax.plot(targets, targets, linestyle='--', color='gray', label='Target')
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_xlabel('Target False Positive Rate (f)')
+    ax.set_ylabel('Observed False Positive Rate')
+    ax.set_title('Observed vs. Target False Positive Rate')
+    ax.legend()
+    ax.grid(True)
+    fig.savefig(os.path.join(output_dir, "fpr.png"), format='png')
+    plt.close(fig)
+
+    throughput = results.groupby("filter")[["inserts_per_sec", "lookups_per_sec"]].mean()
+    fig, ax = plt.subplots(figsize=(12, 6))
+    x = np.arange(len(throughput))
+    ax.bar(x - 0.2, throughput["inserts_per_sec"], width=0.4, label='Inserts')
+    ax.bar(x + 0.2, throughput["lookups_per_sec"], width=0.4, label='Lookups')
+    ax.set_xticks(x, throughput.index, rotation=15)
+    ax.set_ylabel('Operations per second')
+    ax.set_title('Batch Throughput (mean over the grid)')
+    ax.legend()
+    fig.savefig(os.path.join(output_dir, "throughput.png"), format='png')
+    plt.close(fig)
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for name, rows in defaults.groupby("filter"):
+        rows = rows.groupby("f", as_index=False)["bits_per_item"].mean()
+        ax.plot(rows["f"], rows["bits_per_item"], marker='o', label=name)
+    ax.set_xscale('log')
+    ax.set_xlabel('Target False Positive Rate (f)')
+    ax.set_ylabel('Bits per item')
+    ax.set_title('Space vs. Target False Positive Rate')
+    ax.legend()
+    ax.grid(True)
+    fig.savefig(os.path.join(output_dir, "space.png"), format='png')
+    plt.close(fig)
+
+    if results.groupby(["filter", "n", "f"])["k"].nunique().max() > 1:
+        fig, ax = plt.subplots(figsize=(10, 6))
+        for (name, n, f), rows in results.dropna(subset=["k"]).groupby(["filter", "n", "f"]):
+            rows = rows.sort_values("k")
+            ax.plot(rows["k"], rows["false_positive_rate"], marker='o', label=f'{name} (n={n}, f={f})')
+        ax.set_xlabel('Number of Hash Functions (k)')
+        ax.set_ylabel('Observed False Positive Rate')
+        ax.set_title('False Positive Rate vs. Number of Hash Functions')
+        ax.legend(fontsize='small')
+        ax.grid(True)
+        fig.savefig(os.path.join(output_dir, "fpr_vs_k.png"), format='png')
+        plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Bloom filter variants")
+    parser.add_argument("--filters", nargs="+", choices=list(FILTER_CLASSES), default=list(FILTER_CLASSES),
+                        help="Filter classes to benchmark (default: all)")
+    parser.add_argument("--n", nargs="+", type=int, default=[100000], help="Numbers of elements")
+    parser.add_argument("--f", nargs="+", type=float, default=[0.01, 0.001], help="Target false positive rates")
+    parser.add_argument("--k", nargs="+", type=int, default=[0], help="Numbers of hash functions, 0 for the default")
+    parser.add_argument("--lookups", type=int, default=100000, help="Lookups of absent items per grid point")
+    parser.add_argument("--jobs", type=int, default=-1, help="Worker processes (-1 for all cores)")
+    parser.add_argument("--output", default="bloom_benchmark", help="Directory for results.csv and the plots")
+    args = parser.parse_args()
+
+    results = run_benchmark([FILTER_CLASSES[name] for name in args.filters], args.n, args.f,
+                            [k or None for k in args.k], args.lookups, args.jobs, args.output)
+    print(results.to_string(index=False))
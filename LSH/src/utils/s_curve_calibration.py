@@ -0,0 +1,321 @@
+"""
+Empirical S-curves of the LSH classes.
+
+`utils.visualization_lsh.plot_s_curves` draws the theoretical probability `1 - (1 - s^r)^b`
+that a pair of documents with Jaccard similarity `s` becomes a candidate. This module
+measures it. Pairs of documents are sampled in strata of exact Jaccard similarity, computed
+by intersecting sorted arrays of integer shingle hashes. The documents of the sampled pairs
+are then signed and banded with the method under test (`LSH`, `LSHImproved` with its probes
+or `LSHForest` with its voting), and the fraction of each stratum's pairs that come out as
+candidates is plotted over the theoretical curve. Shingling, similarity and signing run in
+parallel worker processes. Run from the `src` directory:
+
+    python -m utils.s_curve_calibration --data ../data/files/onek.tsv --method LSH --bands 20 --rows 5
+
+The table is written to `<output>/calibration.csv` next to the plot.
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import xxhash
+from joblib import Parallel, delayed
+
+from deduplication.LSH import LSH
+from deduplication.LSHImproved import LSHImproved
+from deduplication.LSHForest import LSHForest
+from deduplication.tuning import candidate_probability
+from utils.utils import read_tsv, clean_document, shingle, minhash, remove_exact_duplicates
+
+METHODS = {cls.__name__: cls for cls in (LSH, LSHImproved, LSHForest)}
+"""METHODS (dict): The calibrated LSH classes by name"""
+
+CHUNK_SIZE = 1000
+
+
+def shingle_ids(text, k=8):
+    """
+    Returns the shingles of a document as a sorted array of unique 64-bit hashes.
+
+    The text is cleaned and shingled exactly as the LSH classes do before signing, so the
+    Jaccard similarity of two arrays is the similarity their MinHash signatures estimate.
+    """
+    return np.unique(np.fromiter((xxhash.xxh3_64_intdigest(s) for s in shingle(clean_document(text), k)), dtype=np.uint64))
+
+
+def exact_jaccard(a, b):
+    """Jaccard similarity of two sorted arrays of unique shingle hashes."""
+    common = len(np.intersect1d(a, b, assume_unique=True))
+    union = len(a) + len(b) - common
+    return common / union if union else 1.0
+
+
+def _shingle_chunk(texts, k):
+    return [shingle_ids(text, k) for text in texts]
+
+
+def _jaccard_chunk(pairs):
+    return [exact_jaccard(a, b) for a, b in pairs]
+
+
+def _sign_chunk(texts, k, num_hashes):
+    return [minhash(shingle(clean_document(text), k), num_hashes) for text in texts]
+
+
+def _chunks(items):
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield items[start:start + CHUNK_SIZE]
+
+
+def _blocking_pairs(sets, num_hashes, max_bucket, rng):
+    """
+    Pairs of documents that share the minimum of any of `num_hashes` integer hash functions.
+
+    A pair is found with probability `1 - (1 - s)^num_hashes`, close to 1 for all but the
+    lowest similarities, so similar pairs are found without comparing all pairs. Buckets
+    larger than `max_bucket` (boilerplate) contribute the pairs of a random subset.
+    """
+    n = len(sets)
+    values = np.concatenate(sets)
+    starts = np.concatenate(([0], np.cumsum([len(s) for s in sets])[:-1]))
+    codes = []
+    for _ in range(num_hashes):
+        a, b = rng.integers(1, 2 ** 63, size=2, dtype=np.uint64)
+        # Multiply-shift hashing: the products wrap around modulo 2^64
+        mins = np.minimum.reduceat(values * (a | np.uint64(1)) + b, starts)
+        order = np.argsort(mins, kind="stable")
+        sorted_mins = mins[order]
+        run_starts = np.concatenate(([0], np.flatnonzero(sorted_mins[1:] != sorted_mins[:-1]) + 1))
+        run_sizes = np.diff(np.concatenate((run_starts, [n])))
+        for start, size in zip(run_starts[run_sizes > 1], run_sizes[run_sizes > 1]):
+            members = order[start:start + size]
+            if size > max_bucket:
+                members = rng.choice(members, max_bucket, replace=False)
+            first, second = np.triu_indices(len(members), 1)
+            low, high = np.minimum(members[first], members[second]), np.maximum(members[first], members[second])
+            codes.append(low.astype(np.int64) * n + high)
+    return np.unique(np.concatenate(codes)) if codes else np.empty(0, dtype=np.int64)
+
+
+def sample_pairs(docs, k=8, strata=10, pairs_per_stratum=200, blocking_hashes=64, max_bucket=50, max_pairs=1000000,
+                 n_jobs=-1, seed=0):
+    """
+    Samples pairs of documents stratified by exact Jaccard similarity.
+
+    Random pairs are almost all dissimilar, so similar pairs are found by blocking on the
+    minima of cheap integer hash functions (see `_blocking_pairs`) and mixed with random
+    pairs for the low strata. The exact similarity of every pair is computed from the
+    documents' integer shingle arrays, and up to `pairs_per_stratum` pairs are drawn from
+    each of `strata` equal-width similarity intervals. Exact duplicates are removed first,
+    as the LSH classes do, as are documents with fewer than `k` words.
+
+    Args:
+        docs (dict): Document IDs to document strings.
+        k (int): Shingle size.
+        strata (int): Number of similarity intervals in [0, 1].
+        pairs_per_stratum (int): Pairs to sample from each interval.
+        blocking_hashes (int): Hash functions used to find similar pairs.
+        max_bucket (int): Documents taken from a blocking bucket, bounding boilerplate buckets.
+        max_pairs (int): Blocked pairs whose similarity is computed, sampled at random beyond that.
+        n_jobs (int): Number of worker processes (joblib, -1 for all cores).
+        seed (int): Seed of the sample.
+
+    Returns:
+        pandas.DataFrame: `doc_a`, `doc_b`, `jaccard` and `stratum` of every sampled pair.
+    """
+    rng = np.random.default_rng(seed)
+    unique_docs, _ = remove_exact_duplicates(docs)
+    doc_ids = list(unique_docs)
+    texts = list(unique_docs.values())
+    chunks = Parallel(n_jobs=n_jobs)(delayed(_shingle_chunk)(chunk, k) for chunk in _chunks(texts))
+    sets = [s for chunk in chunks for s in chunk]
+    keep = [i for i, s in enumerate(sets) if len(s)]
+    doc_ids, sets = [doc_ids[i] for i in keep], [sets[i] for i in keep]
+    n = len(sets)
+    if n < 2:
+        return pd.DataFrame(columns=["doc_a", "doc_b", "jaccard", "stratum"])
+
+    codes = _blocking_pairs(sets, blocking_hashes, max_bucket, rng)
+    if len(codes) > max_pairs:
+        codes = rng.choice(codes, max_pairs, replace=False)
+    first, second = rng.integers(n, size=(2, strata * pairs_per_stratum))
+    first, second = first[first != second], second[first != second]
+    codes = np.unique(np.concatenate((codes, np.minimum(first, second).astype(np.int64) * n + np.maximum(first, second))))
+    first, second = (codes // n).tolist(), (codes % n).tolist()
+
+    pairs = list(zip(first, second))
+    similarities = Parallel(n_jobs=n_jobs)(delayed(_jaccard_chunk)([(sets[a], sets[b]) for a, b in chunk])
+                                           for chunk in _chunks(pairs))
+    sampled = pd.DataFrame({
+        "doc_a": [doc_ids[a] for a in first],
+        "doc_b": [doc_ids[b] for b in second],
+        "jaccard": [s for chunk in similarities for s in chunk],
+    })
+    sampled["stratum"] = np.minimum((sampled["jaccard"] * strata).astype(int), strata - 1)
+    sampled = sampled.sample(frac=1, random_state=seed).groupby("stratum").head(pairs_per_stratum)
+    return sampled.sort_values(["stratum", "jaccard"]).reset_index(drop=True)
+
+
+def measure_candidates(docs, pairs, method="LSH", num_bands=20, rows_per_band=5, k=8, num_trees=1, num_probes=4,
+                       banding_method="query_directed", background=1000, n_jobs=-1, seed=0):
+    """
+    Checks which sampled pairs a method makes candidates.
+
+    Only the documents of the pairs are signed, plus `background` other documents drawn at
+    random from those `sample_pairs` keeps. Whether `LSH` and `LSHForest` pair two documents depends on their signatures
+    alone, so this gives the same answer as banding the whole corpus. `LSHImproved` probes
+    neighbouring buckets in the sorted order of all documents, which is sparser in a subset,
+    so its measured probability is an upper bound that tightens as `background` grows.
+
+    Args:
+        docs (dict): Document IDs to document strings.
+        pairs (pandas.DataFrame): The output of `sample_pairs`.
+        method (str): Name of the method (a key of `METHODS`).
+        num_bands (int): Number of bands (per tree).
+        rows_per_band (int): Rows in each band.
+        k (int): Shingle size.
+        num_trees (int): Trees of an `LSHForest`.
+        num_probes (int): Probes of `LSHImproved`.
+        banding_method (str): Probing strategy of `LSHImproved`.
+        background (int): Extra documents signed alongside the pairs.
+        n_jobs (int): Number of worker processes (joblib, -1 for all cores).
+        seed (int): Seed of the background sample.
+
+    Returns:
+        numpy.ndarray: Whether each pair of `pairs` is a candidate pair, in order.
+    """
+    num_hashes = num_bands * rows_per_band * (num_trees if method == "LSHForest" else 1)
+    involved = set(pairs["doc_a"]) | set(pairs["doc_b"])
+    # Draw the background from the documents `sample_pairs` keeps: one per exact duplicate
+    # group, with at least one shingle (minhash fails on an empty set)
+    unique_docs, _ = remove_exact_duplicates(docs)
+    others = [doc_id for doc_id in unique_docs if doc_id not in involved]
+    rng = np.random.default_rng(seed)
+    chosen = []
+    for i in rng.permutation(len(others)):
+        if len(chosen) == background:
+            break
+        if shingle(clean_document(docs[others[i]]), k):
+            chosen.append(others[i])
+    doc_ids = list(involved) + chosen
+
+    chunks = Parallel(n_jobs=n_jobs)(delayed(_sign_chunk)([docs[doc_id] for doc_id in chunk], k, num_hashes)
+                                     for chunk in _chunks(doc_ids))
+    signatures = dict(zip(doc_ids, (signature for chunk in chunks for signature in chunk)))
+
+    if method == "LSHForest":
+        model = LSHForest(num_hashes=num_hashes, num_bands=num_bands, rows_per_band=rows_per_band, num_trees=num_trees,
+                          k=k, n_jobs=n_jobs)
+    elif method == "LSHImproved":
+        model = LSHImproved(num_hashes=num_hashes, num_bands=num_bands, rows_per_band=rows_per_band, k=k,
+                            num_probes=num_probes, banding_method=banding_method)
+    else:
+        model = LSH(num_hashes=num_hashes, num_bands=num_bands, rows_per_band=rows_per_band, k=k)
+    candidates = set(model.banding(signatures))
+    return np.array([(a, b) in candidates or (b, a) in candidates for a, b in zip(pairs["doc_a"], pairs["doc_b"])], dtype=bool)
+
+
+def calibrate(docs, method="LSH", num_bands=20, rows_per_band=5, k=8, num_trees=1, num_probes=4,
+              banding_method="query_directed", strata=10, pairs_per_stratum=200, background=1000, n_jobs=-1, seed=0):
+    """
+    Measures the empirical S-curve of a method and the theoretical one for the same pairs.
+
+    Pairs drawn from the same near-duplicate cluster share documents and so hash values,
+    so their outcomes are correlated and `stderr` understates the spread of a corpus with
+    large clusters.
+
+    Args:
+        docs (dict): Document IDs to document strings.
+        method (str): Name of the method (a key of `METHODS`).
+        num_bands, rows_per_band, k, num_trees, num_probes, banding_method: parameters of the method
+        strata (int): Number of similarity intervals in [0, 1].
+        pairs_per_stratum (int): Pairs to sample from each interval.
+        background (int): Extra documents signed alongside the pairs (see `measure_candidates`).
+        n_jobs (int): Number of worker processes (joblib, -1 for all cores).
+        seed (int): Seed of the samples.
+
+    Returns:
+        pandas.DataFrame: One row per non-empty stratum with `low` and `high` (its interval),
+        `pairs`, `mean_jaccard`, `empirical` (the fraction of its pairs that are candidates),
+        `stderr` (the binomial standard error of `empirical`) and `theoretical` (the mean
+        probability of `deduplication.tuning.candidate_probability` over its pairs; probes of
+        `LSHImproved` are not part of it).
+    """
+    pairs = sample_pairs(docs, k, strata, pairs_per_stratum, n_jobs=n_jobs, seed=seed)
+    trees = num_trees if method == "LSHForest" else 1
+    pairs["candidate"] = measure_candidates(docs, pairs, method, num_bands, rows_per_band, k, num_trees, num_probes,
+                                            banding_method, background, n_jobs, seed)
+    pairs["theoretical"] = candidate_probability(pairs["jaccard"].to_numpy(), num_bands, rows_per_band, trees)
+
+    rows = []
+    for stratum, group in pairs.groupby("stratum"):
+        p = group["candidate"].mean()
+        rows.append({
+            "low": stratum / strata,
+            "high": (stratum + 1) / strata,
+            "pairs": len(group),
+            "mean_jaccard": group["jaccard"].mean(),
+            "empirical": p,
+            "stderr": np.sqrt(p * (1 - p) / len(group)),
+            "theoretical": group["theoretical"].mean(),
+        })
+    return pd.DataFrame(rows, columns=["low", "high", "pairs", "mean_jaccard", "empirical", "stderr", "theoretical"])
+
+
+def plot_calibration(results, num_bands, rows_per_band, num_trees=1, label="Empirical", output=None):
+    """
+    Plots a measured S-curve over the theoretical one.
+
+    Args:
+        results (pandas.DataFrame): The output of `calibrate`.
+        num_bands (int): Number of bands (per tree).
+        rows_per_band (int): Rows in each band.
+        num_trees (int): Trees of an `LSHForest`, 1 otherwise.
+        label (str): Legend label of the measured curve.
+        output (str): File to save the plot to, None to show it.
+    """
+    s_values = np.linspace(0, 1, 200)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.plot(s_values, candidate_probability(s_values, num_bands, rows_per_band, num_trees), color='gray',
+            label=f'Theoretical (b={num_bands}, r={rows_per_band}' + (f', {num_trees} trees)' if num_trees > 1 else ')'))
+    ax.errorbar(results["mean_jaccard"], results["empirical"], yerr=1.96 * results["stderr"], marker='o', capsize=3,
+                linestyle='-', label=label)
+    ax.set_xlabel('Jaccard Similarity')
+    ax.set_ylabel('Prob(Candidate Pair)')
+    ax.set_title('Empirical vs. Theoretical S-curve')
+    ax.set_xlim(0, 1)
+    ax.set_ylim(-0.02, 1.02)
+    ax.legend()
+    ax.grid(True)
+    if output:
+        fig.savefig(output, format='png')
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the S-curve of an LSH method on a corpus")
+    parser.add_argument("--data", required=True, help="TSV corpus")
+    parser.add_argument("--method", default="LSH", choices=list(METHODS), help="Method to calibrate")
+    parser.add_argument("--bands", type=int, default=20, help="Number of bands (per tree)")
+    parser.add_argument("--rows", type=int, default=5, help="Rows per band")
+    parser.add_argument("--k", type=int, default=8, help="Shingle size")
+    parser.add_argument("--trees", type=int, default=5, help="Trees of LSHForest")
+    parser.add_argument("--probes", type=int, default=4, help="Probes of LSHImproved")
+    parser.add_argument("--banding-method", default="query_directed", help="Probing strategy of LSHImproved")
+    parser.add_argument("--strata", type=int, default=10, help="Similarity intervals")
+    parser.add_argument("--pairs", type=int, default=200, help="Pairs sampled per interval")
+    parser.add_argument("--background", type=int, default=1000, help="Extra documents signed alongside the pairs")
+    parser.add_argument("--jobs", type=int, default=-1, help="Worker processes (-1 for all cores)")
+    parser.add_argument("--output", default="calibration", help="Directory for calibration.csv and s_curve.png")
+    args = parser.parse_args()
+
+    results = calibrate(read_tsv(args.data), args.method, args.bands, args.rows, args.k, args.trees, args.probes,
+                        args.banding_method, args.strata, args.pairs, args.background, args.jobs)
+    os.makedirs(args.output, exist_ok=True)
+    results.to_csv(os.path.join(args.output, "calibration.csv"), index=False)
+    plot_calibration(results, args.bands, args.rows, args.trees if args.method == "LSHForest" else 1,
+                     label=f'{args.method} (empirical)', output=os.path.join(args.output, "s_curve.png"))
+    print(results.to_string(index=False))
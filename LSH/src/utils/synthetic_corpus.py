@@ -0,0 +1,322 @@
+"""
+Synthetic near-duplicate corpora with ground truth.
+
+Documents are drawn word by word from a Zipf-weighted vocabulary, either a seed word list
+(or generated pseudo-words) or the vocabulary and document lengths of an existing TSV.
+Each original document starts a cluster that may grow with near-duplicates, made by word
+substitutions, insertions, truncations or block reorderings aimed at a target Jaccard
+similarity of word k-shingles, and with exact copies. Some originals share a boilerplate
+passage, which makes unrelated documents look alike without making them duplicates.
+
+Documents are written as they are generated, so memory does not grow with the corpus.
+Run from the `src` directory:
+
+    python -m utils.synthetic_corpus --num-docs 1000000 --output corpus.tsv
+
+This writes `corpus.tsv` (`id<TAB>text` lines, like `data/files/*.tsv`),
+`corpus.truth.txt` (one cluster of document IDs per line, the format of the CLI's
+`./output` files) and `corpus.meta.tsv` (`id, cluster, kind, target, jaccard` per document,
+where `jaccard` is the measured shingle similarity to the cluster's original).
+"""
+import argparse
+import itertools
+import math
+import os
+import numpy as np
+
+from utils.utils import clean_document, iter_tsv
+
+EDITS = ("substitute", "insert", "truncate", "reorder")
+"""EDITS (tuple): The edit operations that make near-duplicates"""
+
+SYLLABLES = [c + v for c in "bcdfghjklmnprstvwz" for v in "aeiou"]
+
+
+def shingle_set(words, k):
+    """Returns the word k-shingles of a list of words as a set of tuples."""
+    return set(zip(*(words[i:] for i in range(k))))
+
+
+def jaccard(a, b):
+    """Jaccard similarity of two sets, 1.0 if both are empty."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class CorpusGenerator:
+    """
+    Streams a synthetic corpus with known duplicate clusters.
+
+    After an original, every further member of its cluster is added with probability
+    `duplicate_rate + exact_rate` (up to `max_cluster_size`), so about that fraction of the
+    corpus are duplicates. A member is an exact copy of the original with probability
+    `exact_rate / (duplicate_rate + exact_rate)` and a near-duplicate otherwise, at a target
+    similarity drawn from `jaccard_levels` with one random edit type from `edits`. The
+    number of edits comes from the expected shingle damage of one edit and is topped up
+    until the measured similarity reaches the target. A near-duplicate never ends up more
+    than `tolerance` below its target: overshooting edits are redrawn with fewer edits, and
+    if even one edit overshoots (short documents, block moves) a single word is dropped.
+    """
+
+    def __init__(self, vocabulary=None, weights=None, doc_lengths=None, shingle_size=8, jaccard_levels=(0.9, 0.8, 0.7, 0.5),
+                 edits=EDITS, duplicate_rate=0.2, exact_rate=0.05, boilerplate_rate=0.1, num_boilerplates=20,
+                 max_cluster_size=10, tolerance=0.05, seed=0):
+        """
+        Args:
+            vocabulary (list): Words to draw from. Defaults to 50,000 generated pseudo-words.
+            weights (list): Relative word frequencies. Defaults to a Zipf law over the vocabulary order.
+            doc_lengths (list): Lengths to sample original documents from. Defaults to a log-normal around 200 words.
+            shingle_size (int): Words per shingle for the target similarity (the `k` of the LSH classes).
+            jaccard_levels (tuple): Target shingle similarities of near-duplicates to their original.
+            edits (tuple): Edit operations used for near-duplicates, a subset of `EDITS`.
+            duplicate_rate (float): Approximate fraction of near-duplicates in the corpus.
+            exact_rate (float): Approximate fraction of exact duplicates in the corpus.
+            boilerplate_rate (float): Fraction of originals that get a boilerplate passage.
+            num_boilerplates (int): Number of distinct boilerplate passages.
+            max_cluster_size (int): Largest number of documents in a cluster.
+            tolerance (float): How far below its target the similarity of a near-duplicate may fall.
+            seed (int): Seed of the random generator.
+        """
+        assert set(edits) <= set(EDITS), f"edits must be in {EDITS}"
+        assert duplicate_rate + exact_rate < 1, "duplicate_rate + exact_rate must be below 1"
+        self.rng = np.random.default_rng(seed)
+        """rng (numpy.random.Generator): Random generator of every choice."""
+        if vocabulary is None:
+            vocabulary = self._pseudo_words(50000)
+        self.vocabulary = np.asarray(vocabulary, dtype=object)
+        """vocabulary (numpy.ndarray): Words to draw from."""
+        if weights is None:
+            weights = 1.0 / np.arange(1, len(self.vocabulary) + 1) ** 1.07
+        self.cdf = np.cumsum(weights, dtype=np.float64)
+        self.cdf /= self.cdf[-1]
+        """cdf (numpy.ndarray): Cumulative word distribution, sampled by binary search."""
+        self.doc_lengths = np.asarray(doc_lengths if doc_lengths is not None else
+                                      np.round(self.rng.lognormal(math.log(200), 0.5, 10000)), dtype=np.int64)
+        """doc_lengths (numpy.ndarray): Lengths that original documents are sampled from."""
+        self.shingle_size = shingle_size
+        """shingle_size (int): Words per shingle for the target similarity."""
+        self.jaccard_levels = tuple(jaccard_levels)
+        """jaccard_levels (tuple): Target shingle similarities of near-duplicates."""
+        # A reordering cannot change a set of single words
+        self.edits = tuple(edit for edit in edits if shingle_size > 1 or edit != "reorder") or ("substitute",)
+        """edits (tuple): Edit operations used for near-duplicates."""
+        self.duplicate_rate = duplicate_rate
+        """duplicate_rate (float): Approximate fraction of near-duplicates."""
+        self.exact_rate = exact_rate
+        """exact_rate (float): Approximate fraction of exact duplicates."""
+        self.boilerplate_rate = boilerplate_rate
+        """boilerplate_rate (float): Fraction of originals with a boilerplate passage."""
+        self.boilerplates = [self._words(30) for _ in range(num_boilerplates)]
+        """boilerplates (list): The boilerplate passages, as lists of words."""
+        self.max_cluster_size = max_cluster_size
+        """max_cluster_size (int): Largest number of documents in a cluster."""
+        self.tolerance = tolerance
+        """tolerance (float): How far below its target the similarity of a near-duplicate may fall."""
+
+    @classmethod
+    def from_tsv(cls, path, sample_docs=100000, **kwargs):
+        """
+        Creates a generator with the vocabulary, word frequencies and document lengths of a TSV corpus.
+
+        Args:
+            path (str): A TSV file of `id<TAB>text` lines.
+            sample_docs (int): Number of leading documents to learn from.
+            **kwargs: Other arguments of `CorpusGenerator`.
+        """
+        counts, lengths = {}, []
+        for _, text in itertools.islice(iter_tsv(path), sample_docs):
+            words = clean_document(text).split()
+            lengths.append(len(words))
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+        vocabulary = sorted(counts, key=counts.get, reverse=True)
+        return cls(vocabulary, [counts[word] for word in vocabulary], lengths, **kwargs)
+
+    def _pseudo_words(self, size):
+        words = {}
+        while len(words) < size:
+            syllables = self.rng.integers(0, len(SYLLABLES), (size, 4))
+            for row, length in zip(syllables.tolist(), self.rng.integers(1, 5, size).tolist()):
+                words[''.join(SYLLABLES[i] for i in row[:length])] = None
+        return sorted(itertools.islice(words, size), key=len)
+
+    def _words(self, count):
+        return list(self.vocabulary[np.searchsorted(self.cdf, self.rng.random(count))])
+
+    def original(self):
+        """Draws an original document as a list of words, sometimes with a boilerplate passage."""
+        length = max(int(self.rng.choice(self.doc_lengths)), 2 * self.shingle_size)
+        words = self._words(length)
+        if self.rng.random() < self.boilerplate_rate:
+            passage = self.boilerplates[self.rng.integers(len(self.boilerplates))]
+            words = passage + words if self.rng.random() < 0.5 else words + passage
+        return words
+
+    def _edit(self, words, edit, count):
+        count = max(1, count)
+        if edit == "substitute":
+            words = list(words)
+            for position in self.rng.choice(len(words), min(count, len(words)), replace=False):
+                words[position] = self._words(1)[0]
+        elif edit == "insert":
+            words = list(words)
+            for word, position in zip(self._words(count), self.rng.integers(0, len(words) + 1, count)):
+                words.insert(position, word)
+        elif edit == "truncate":
+            count = min(count, len(words) - 1)
+            words = words[count:] if self.rng.random() < 0.5 else words[:len(words) - count]
+        else:
+            for _ in range(count):
+                size = max(1, len(words) // 10)
+                start = self.rng.integers(0, len(words) - size + 1)
+                block, rest = words[start:start + size], words[:start] + words[start + size:]
+                position = self.rng.integers(0, len(rest) + 1)
+                words = rest[:position] + block + rest[position:]
+        return words
+
+    def near_duplicate(self, words, target):
+        """
+        Edits a document towards a target shingle similarity.
+
+        Args:
+            words (list): The original document.
+            target (float): The target Jaccard similarity of the word shingles.
+
+        Returns:
+            tuple: (edited words, measured similarity to the original)
+        """
+        k = self.shingle_size
+        edit = self.edits[self.rng.integers(len(self.edits))]
+        original = shingle_set(words, k)
+        damage = len(original) * (1 - target)
+        # Shingles one edit removes: k for a substitution or insertion, 1 per truncated word, 3(k - 1) per block move
+        per_edit = {"substitute": k * (1 + target), "insert": k * (1 + target), "truncate": 1, "reorder": 3 * (k - 1) * (1 + target)}[edit]
+        count = max(1, round(damage / per_edit))
+
+        edited, similarity = self._edit_towards(words, original, edit, count, target)
+        while similarity < target - self.tolerance and count > 1:
+            count //= 2
+            edited, similarity = self._edit_towards(words, original, edit, count, target)
+        if similarity < target - self.tolerance:
+            # Even one edit of this kind overshoots; dropping a word removes a single shingle
+            edited = self._edit(words, "truncate", 1)
+            similarity = jaccard(original, shingle_set(edited, k))
+        return edited, similarity
+
+    def _edit_towards(self, words, original, edit, count, target):
+        k = self.shingle_size
+        edited = self._edit(words, edit, count)
+        similarity = jaccard(original, shingle_set(edited, k))
+        for _ in range(5):
+            if similarity <= target + 0.02 or len(edited) <= k:
+                break
+            # Edits overlap, so top up in proportion to the damage still missing
+            extra = max(1, min(len(edited), round(count * ((1 - target) / max(1 - similarity, 1e-9) - 1))))
+            topped_up = self._edit(edited, edit, extra)
+            topped_up_similarity = jaccard(original, shingle_set(topped_up, k))
+            if topped_up_similarity < target - self.tolerance:
+                break  # Keep the lighter edit, which is closer to the target
+            edited, similarity = topped_up, topped_up_similarity
+            count += extra
+        return edited, similarity
+
+    def documents(self, num_docs):
+        """
+        Generates the documents of a corpus in clusters.
+
+        Args:
+            num_docs (int): Number of documents.
+
+        Yields:
+            tuple: (cluster number, kind, target similarity, measured similarity to the original, words),
+            where kind is 'original', 'near' or 'exact'. The members of a cluster are consecutive.
+        """
+        continue_rate = self.duplicate_rate + self.exact_rate
+        exact_share = self.exact_rate / continue_rate if continue_rate else 0.0
+        produced = 0
+        for cluster in itertools.count():
+            if produced >= num_docs:
+                return
+            words = self.original()
+            yield cluster, "original", 1.0, 1.0, words
+            produced += 1
+            size = 1
+            while produced < num_docs and size < self.max_cluster_size and self.rng.random() < continue_rate:
+                if self.rng.random() < exact_share:
+                    yield cluster, "exact", 1.0, 1.0, words
+                else:
+                    target = self.jaccard_levels[self.rng.integers(len(self.jaccard_levels))]
+                    edited, similarity = self.near_duplicate(words, target)
+                    yield cluster, "near", target, similarity, edited
+                produced += 1
+                size += 1
+
+    def write(self, num_docs, output, truth=None, metadata=None):
+        """
+        Writes a corpus, its ground-truth clusters and per-document metadata.
+
+        Lines are written in generation order, but IDs (1 to `num_docs`) are assigned by an
+        affine permutation, so the members of a cluster do not have consecutive IDs.
+
+        Args:
+            num_docs (int): Number of documents.
+            output (str): Path of the TSV corpus.
+            truth (str): Path of the cluster file, `<output stem>.truth.txt` if None.
+            metadata (str): Path of the metadata TSV, `<output stem>.meta.tsv` if None.
+        """
+        stem = os.path.splitext(output)[0]
+        truth = truth or f"{stem}.truth.txt"
+        metadata = metadata or f"{stem}.meta.tsv"
+
+        # An empty corpus still gets its (empty) files, with the metadata header
+        multiplier, offset = 1, 0
+        if num_docs > 0:
+            multiplier = int(self.rng.integers(1, num_docs + 1))
+            while math.gcd(multiplier, num_docs) != 1:
+                multiplier += 1
+            offset = int(self.rng.integers(num_docs))
+
+        with open(output, 'w', encoding='utf-8') as corpus, open(truth, 'w') as truth_file, open(metadata, 'w') as meta_file:
+            meta_file.write("id\tcluster\tkind\ttarget\tjaccard\n")
+            members, current = [], None
+            for position, (cluster, kind, target, similarity, words) in enumerate(self.documents(num_docs)):
+                doc_id = (multiplier * position + offset) % num_docs + 1
+                if cluster != current and members:
+                    truth_file.write(' '.join(map(str, members)) + "\n")
+                    members = []
+                current = cluster
+                members.append(doc_id)
+                corpus.write(f"{doc_id}\t{' '.join(words)}\n")
+                meta_file.write(f"{doc_id}\t{cluster}\t{kind}\t{target}\t{similarity:.4f}\n")
+            if members:
+                truth_file.write(' '.join(map(str, members)) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic near-duplicate corpus with ground truth")
+    parser.add_argument("--num-docs", type=int, required=True, help="Number of documents")
+    parser.add_argument("--output", required=True, help="Path of the TSV corpus")
+    parser.add_argument("--source", help="TSV corpus to learn the vocabulary and document lengths from")
+    parser.add_argument("--vocab", help="Seed vocabulary, one word per line, most frequent first")
+    parser.add_argument("--shingle-size", type=int, default=8, help="Words per shingle for the target similarity")
+    parser.add_argument("--jaccard", nargs="+", type=float, default=[0.9, 0.8, 0.7, 0.5], help="Target similarities of near-duplicates")
+    parser.add_argument("--edits", nargs="+", choices=EDITS, default=list(EDITS), help="Edit operations for near-duplicates")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2, help="Approximate fraction of near-duplicates")
+    parser.add_argument("--exact-rate", type=float, default=0.05, help="Approximate fraction of exact duplicates")
+    parser.add_argument("--boilerplate-rate", type=float, default=0.1, help="Fraction of originals with a boilerplate passage")
+    parser.add_argument("--max-cluster-size", type=int, default=10, help="Largest number of documents in a cluster")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    options = dict(shingle_size=args.shingle_size, jaccard_levels=args.jaccard, edits=args.edits,
+                   duplicate_rate=args.duplicate_rate, exact_rate=args.exact_rate, boilerplate_rate=args.boilerplate_rate,
+                   max_cluster_size=args.max_cluster_size, seed=args.seed)
+    if args.source:
+        generator = CorpusGenerator.from_tsv(args.source, **options)
+    elif args.vocab:
+        with open(args.vocab, encoding='utf-8') as file:
+            generator = CorpusGenerator([line.strip() for line in file if line.strip()], **options)
+    else:
+        generator = CorpusGenerator(**options)
+    generator.write(args.num_docs, args.output)
@@ -38,8 +38,10 @@
     
 #     return candidate_pairs
 
+import hashlib
 from collections import defaultdict
 from utils.utils import UnionFind, clean_document, shingle, minhash
+from utils.instrumentation import span
 
 # Use Case 1
 def collection_deduplication(lsh):
@@ -69,26 +71,27 @@ def collection_deduplication(lsh):
             >>> print(f"Cluster with root document {root}: {docs}")
     """
     # Step 5: Use Union-Find to cluster documents
-    uf = UnionFind()
-    for doc1, doc2 in lsh.candidate_pairs:
-        uf.union(doc1, doc2)
+    with span("cluster", len(lsh.unique_docs)):
+        uf = UnionFind()
+        for doc1, doc2 in lsh.candidate_pairs:
+            uf.union(doc1, doc2)
     
-    # Group documents by their root in Union-Find
-    clusters = defaultdict(list)
-    for doc_id in lsh.unique_docs:
-        root = uf.find(doc_id)
-        clusters[root].append(doc_id)
+        # Group documents by their root in Union-Find
+        clusters = defaultdict(list)
+        for doc_id in lsh.unique_docs:
+            root = uf.find(doc_id)
+            clusters[root].append(doc_id)
     
-    # Now include the exact duplicates
-    for original_id, duplicate_ids in lsh.exact_duplicates.items():
-        root = uf.find(original_id)
-        clusters[root].extend(duplicate_ids)  # Add the duplicates to the cluster of their original doc
+        # Now include the exact duplicates
+        for original_id, duplicate_ids in lsh.exact_duplicates.items():
+            root = uf.find(original_id)
+            clusters[root].extend(duplicate_ids)  # Add the duplicates to the cluster of their original doc
 
     return clusters
 
 
 # Use Case 2
-def nearest_neighbor_search(query_doc, lsh):
+def nearest_neighbor_search(query_doc, lsh, top_k=10):
     """Finds approximate nearest neighbors for a given query document using LSH.
     
     This function performs an approximate nearest neighbor search for the input query document.
@@ -105,9 +108,12 @@ def nearest_neighbor_search(query_doc, lsh):
         query_doc (str): The text of the query document for which to find approximate nearest neighbors.
         lsh (LSH): An instance of the LSH class containing the precomputed MinHash signatures 
                    and the banding index for efficient nearest neighbor search.
+        top_k (int): Number of neighbours returned by an LSHForest, which searches its prefix trees
+                   instead of the banding index.
 
     Returns:
         set: A set of document IDs representing the candidate nearest neighbors for the query document.
+             For an LSHForest, a list of the `top_k` document IDs ranked by estimated similarity.
     
     Example:
         >>> query_document = "This is a sample document text for searching."
@@ -117,13 +123,22 @@ def nearest_neighbor_search(query_doc, lsh):
     query_doc_cleaned = clean_document(query_doc)
     query_shingles = shingle(query_doc_cleaned, lsh.k)
     query_signature = minhash(query_shingles, lsh.num_hashes)
+
+    # Multi-probe indexes (LSHImproved) choose their own buckets to read
+    if hasattr(lsh, 'probe'):
+        return lsh.probe(query_signature)
+
+    # LSH Forest answers top-k queries from its prefix trees
+    if hasattr(lsh, 'query'):
+        return [doc_id for doc_id, _ in lsh.query(query_signature, top_k=top_k)]
     
     candidate_pairs = set()
-    # Find candidate pairs from the index
+    # Find candidate pairs from the index, keyed like LSH.banding keys its buckets
     for band_idx in range(lsh.num_bands):
         start = band_idx * lsh.rows_per_band
         band = tuple(query_signature[start:start + lsh.rows_per_band])
-        if (band_idx, band) in lsh.index:
-            candidate_pairs.update(lsh.index[(band_idx, band)])
+        band_hash = hashlib.md5(str(band).encode()).hexdigest()
+        if (band_idx, band_hash) in lsh.index:
+            candidate_pairs.update(lsh.index[(band_idx, band_hash)])
     
     return candidate_pairs
@@ -1,6 +1,8 @@
 import hashlib
 import re
+import unicodedata
 import xxhash
+import numpy as np
 from collections import Counter
 
 # Helper functions
@@ -24,6 +26,66 @@ def clean_document(text):
     text = re.sub(r'[^a-z\s]', '', text.lower())
     return text
 
+def normalize_text(text):
+    """Normalize a document for exact-duplicate detection.
+
+    Unlike `clean_document`, this keeps every character that carries content and only removes
+    differences that do not: Unicode compatibility forms (NFKC), letter case and runs of whitespace.
+
+    Args:
+        text (str): The input document text.
+
+    Returns:
+        str: The normalized text.
+
+    Example:
+        >>> normalize_text("  Hello,\tWORLD! ")
+        'hello, world!'
+    """
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+def content_hash(text):
+    """Hash the normalized text of a document to a 128-bit integer with xxh3-128.
+
+    Args:
+        text (str): The input document text.
+
+    Returns:
+        int: The 128-bit content hash.
+    """
+    return xxhash.xxh3_128_intdigest(normalize_text(text))
+
+def remove_exact_duplicates(docs):
+    """Group exact duplicates before any shingling or MinHash is done.
+
+    Documents are compared by `content_hash`, so only one 128-bit integer per distinct text is kept
+    in memory rather than a second copy of the corpus. The first document of each group is its
+    representative; only representatives need to be signed, and the duplicates are merged back
+    into the representative's cluster at the end.
+
+    Args:
+        docs (dict): A dictionary where keys are document IDs and values are document contents.
+
+    Returns:
+        tuple: `(unique_docs, exact_duplicates)`, where `unique_docs` maps the representative IDs to
+               their contents and `exact_duplicates` maps each representative ID with duplicates to
+               the list of their IDs.
+
+    Example:
+        >>> remove_exact_duplicates({1: "We like McDonalds.", 2: "KFC", 3: "we like  McDonalds."})
+        ({1: 'We like McDonalds.', 2: 'KFC'}, {1: [3]})
+    """
+    unique_docs = {}
+    exact_duplicates = {}
+    first_seen = {}
+    for doc_id, doc in docs.items():
+        original_id = first_seen.setdefault(content_hash(doc), doc_id)
+        if original_id == doc_id:
+            unique_docs[doc_id] = doc
+        else:
+            exact_duplicates.setdefault(original_id, []).append(doc_id)
+    return unique_docs, exact_duplicates
+
 def shingle(text, k=5):
     """Generate k-shingles (or k-grams) from a given text.
     
@@ -72,6 +134,63 @@ def minhash(shingles, num_hashes=100):
         signature.append(min(hash_vals))
     return signature
 
+def pack_bands(rows):
+    """Pack the rows of each band into a single 64-bit key.
+
+    The last axis of `rows` holds the hash values of one band. They are folded into one key with
+    an FNV-style multiply-xor mix, so equal bands always get equal keys and different bands collide
+    with probability of roughly 2**-64. Packed keys can be sorted and binary-searched as a flat array.
+
+    Args:
+        rows (numpy.ndarray): An array of shape `(..., rows_per_band)` of MinHash values.
+
+    Returns:
+        numpy.ndarray: A uint64 array of shape `rows.shape[:-1]` with one key per band.
+
+    Example:
+        >>> keys = pack_bands(np.array([[1, 2], [1, 2], [2, 1]]))
+        >>> keys[0] == keys[1], keys[0] == keys[2]
+        (True, False)
+    """
+    rows = np.asarray(rows, dtype=np.uint64)
+    flat = rows.reshape(-1, rows.shape[-1])  # Array arithmetic wraps silently, scalar arithmetic warns
+    keys = np.full(len(flat), 0xcbf29ce484222325, dtype=np.uint64)
+    for j in range(flat.shape[1]):
+        keys = (keys ^ flat[:, j]) * np.uint64(0x100000001b3)
+        keys ^= keys >> np.uint64(29)
+    return keys.reshape(rows.shape[:-1])
+
+def prefix_ranges(rows, query):
+    """Binary-search a query into lexicographically sorted rows, one column at a time.
+
+    This is the descent of a prefix tree stored as a sorted array: after matching the first `d` values
+    of the query, every row sharing that prefix lies in one contiguous range, and the next column of that
+    range is sorted, so it can be narrowed again with `np.searchsorted`.
+
+    Args:
+        rows (numpy.ndarray): A 2-D array whose rows are sorted lexicographically.
+        query (sequence): The values to match against the leading columns of `rows`.
+
+    Returns:
+        list: The `(lo, hi)` range of rows sharing the first `d` query values, for `d = 0` up to the
+        longest prefix that matches at least one row.
+
+    Example:
+        >>> prefix_ranges(np.array([[1, 2], [1, 3], [2, 1]]), [1, 3])
+        [(0, 3), (0, 2), (1, 2)]
+    """
+    lo, hi = 0, len(rows)
+    ranges = [(lo, hi)]
+    for depth, value in enumerate(query):
+        column = rows[lo:hi, depth]
+        new_lo = lo + int(np.searchsorted(column, value, side='left'))
+        new_hi = lo + int(np.searchsorted(column, value, side='right'))
+        if new_lo == new_hi:
+            break
+        lo, hi = new_lo, new_hi
+        ranges.append((lo, hi))
+    return ranges
+
 class UnionFind:
     """Union-Find (Disjoint Set) data structure with path compression for efficient merging and finding.
     
@@ -154,59 +273,146 @@ def read_tsv(tsv):
         >>> read_tsv('documents.tsv')
         {1: 'This is the first document.', 2: 'Another document with different content.'}
     """
+    return dict(iter_tsv(tsv))
+
+def iter_tsv(tsv):
+    """Read a TSV (tab-separated values) file one line at a time.
+
+    Like `read_tsv`, but yields the documents instead of building a dictionary, so files
+    larger than memory can be streamed.
+
+    Args:
+        tsv (str): The file path to the TSV file.
+
+    Yields:
+        tuple: (integer index, text) for every non-empty line.
+    """
     with open(tsv, 'r', encoding='utf-8') as file:
-        tsv_dict = {}
         for line in file:
             if line.strip():  # To skip empty lines
                 index, text = line.split('\t', 1)
-                tsv_dict[int(index)] = text
-    return tsv_dict
+                yield int(index), text
+
+def stack_signatures(signatures, num_hashes):
+    """Stack a dictionary of MinHash signatures into one uint64 matrix.
+
+    Args:
+        signatures (dict): A dictionary where keys are document IDs and values are MinHash signatures.
+        num_hashes (int): Length of each signature.
+
+    Returns:
+        tuple: The list of document IDs and the `(len(doc_ids), num_hashes)` uint64 matrix whose
+        row `i` is the signature of `doc_ids[i]`.
+    """
+    doc_ids = list(signatures.keys())
+    matrix = np.fromiter((value for doc_id in doc_ids for value in signatures[doc_id]), dtype=np.uint64, count=len(doc_ids) * num_hashes)
+    return doc_ids, matrix.reshape(len(doc_ids), num_hashes)
+
+def split_columns(num_columns, num_splits, interleave=False):
+    """Assign the columns of a signature matrix to a number of splits.
 
-def split_dict(input_dict, num_splits):
+    Contiguous splits spread any remainder over the first splits, so their sizes differ by at most one.
+    Interleaved splits take every `num_splits`-th column, which spreads hash functions across trees
+    when neighbouring hash functions are correlated. Either way every split is a `slice`, so indexing
+    a NumPy matrix with it returns a view rather than a copy.
+
+    Args:
+        num_columns (int): Number of columns (hash functions) to split.
+        num_splits (int): The number of splits.
+        interleave (bool): Assign columns round-robin instead of in contiguous ranges.
+
+    Returns:
+        list: One `slice` of column indices per split.
+
+    Example:
+        >>> split_columns(10, 3)
+        [slice(0, 4, None), slice(4, 7, None), slice(7, 10, None)]
+        >>> split_columns(10, 3, interleave=True)
+        [slice(0, 10, 3), slice(1, 10, 3), slice(2, 10, 3)]
+    """
+    if interleave:
+        return [slice(i, num_columns, num_splits) for i in range(num_splits)]
+    size, remainder = divmod(num_columns, num_splits)
+    bounds = [i * size + min(i, remainder) for i in range(num_splits + 1)]
+    return [slice(bounds[i], bounds[i + 1]) for i in range(num_splits)]
+
+def split_signatures(matrix, num_splits, interleave=False):
     """
-    Splits a dictionary into a specified number of smaller dictionaries.
+    Splits a signature matrix into column-range views, one per split.
 
     Args:
-        input_dict (dict): The input dictionary to be split.
+        matrix (numpy.ndarray): The `(num_docs, num_hashes)` signature matrix.
         num_splits (int): The number of splits.
+        interleave (bool): Assign columns round-robin instead of in contiguous ranges.
 
     Returns:
-        list: A list of dictionaries with split entries.
+        list: A list of views of `matrix`, sharing its memory.
     """
-    # Calculate the split size for each smaller dictionary
-    split_size = len(next(iter(input_dict.values()))) // num_splits
-    result = []
-    
-    for i in range(num_splits):
-        # Calculate the start and end indices for the current split
-        start = i * split_size
-        end = (i + 1) * split_size
-        
-        # Create a new dictionary for each split
-        split_dict = {key: value[start:end] for key, value in input_dict.items()}
-        result.append(split_dict)
+    return [matrix[:, columns] for columns in split_columns(matrix.shape[1], num_splits, interleave)]
 
-    return result
+def pack_pairs(first, second, num_docs):
+    """Encode pairs of document positions as single int64 codes.
+
+    The pair is ordered so the smaller position comes first and encoded as `low * num_docs + high`,
+    so codes of the same pair are equal whatever the orientation and sorting codes sorts the pairs.
+    This holds for up to about three billion documents.
+
+    Args:
+        first (numpy.ndarray): Positions of the first document of each pair.
+        second (numpy.ndarray): Positions of the second document of each pair.
+        num_docs (int): Number of documents the positions index into.
+
+    Returns:
+        numpy.ndarray: An int64 array with one code per pair.
+
+    Example:
+        >>> pack_pairs(np.array([3, 1]), np.array([1, 3]), 10).tolist()
+        [13, 13]
+    """
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    return np.minimum(first, second) * num_docs + np.maximum(first, second)
+
+def unpack_pairs(codes, num_docs):
+    """Decode int64 pair codes produced by `pack_pairs`.
+
+    Args:
+        codes (numpy.ndarray): Pair codes.
+        num_docs (int): Number of documents used when packing.
+
+    Returns:
+        tuple: Two arrays holding the smaller and the larger position of each pair.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    return codes // num_docs, codes % num_docs
 
 def majority_vote(candidate_sets):
     """
     This function performs a majority vote on a list of sets of candidate pairs.
 
+    Candidate sets given as NumPy arrays of packed pair codes (see `pack_pairs`) are counted
+    with `np.unique`, without building any Python objects per pair. Each array must hold
+    unique codes, as a set would.
+
     Args:
-        candidate_sets (list of sets): List of sets containing candidate pairs.
+        candidate_sets (list of sets or numpy.ndarray): List of sets containing candidate pairs.
 
     Returns:
-        list: The pairs that appear in the majority of sets.
+        list: The pairs that appear in the majority of sets (a sorted array of codes for NumPy input).
     """
+    # Determine the majority threshold (more than half of the sets)
+    majority_threshold = len(candidate_sets) / 2
+
+    if candidate_sets and all(isinstance(candidate_set, np.ndarray) for candidate_set in candidate_sets):
+        codes, counts = np.unique(np.concatenate(candidate_sets), return_counts=True)
+        return codes[counts > majority_threshold]
+
     # Flatten the list of sets into a list of pairs
     all_pairs = [pair for candidate_set in candidate_sets for pair in candidate_set]
 
     # Count occurrences of each pair
     pair_counts = Counter(all_pairs)
 
-    # Determine the majority threshold (more than half of the sets)
-    majority_threshold = len(candidate_sets) / 2
-
     # Select pairs that meet the majority threshold
     majority_pairs = [pair for pair, count in pair_counts.items() if count > majority_threshold]
 
@@ -4,6 +4,7 @@ import matplotlib.pyplot as plt
 def plot_s_curves(fixed_r, fixed_b, s_range):
     """
     Plots S-curves for two configurations: varying b with fixed r and varying r with fixed b.
+    `utils.s_curve_calibration` measures the curve of a method on a real corpus.
     
     Args:
         fixed_r: The fixed r value to plot S-curves while varying b.
@@ -36,4 +37,77 @@ def plot_s_curves(fixed_r, fixed_b, s_range):
     axes[1].legend()
 
     plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    plt.show()
+
+def benchmark_multi_probe(docs, probe_range=range(0, 9), threshold=0.5, num_hashes=100, num_bands=20, rows_per_band=5, k=5, banding_method='query_directed'):
+    """
+    Measures recall, candidate volume and index size of LSHImproved as the probe budget grows.
+
+    Ground truth is every pair of documents whose shingle sets have an exact Jaccard
+    similarity of at least `threshold`, so this is meant for samples of a few thousand
+    documents. Signatures are computed once and re-banded for each probe budget.
+
+    Args:
+        docs (dict): A dictionary where keys are document IDs and values are document contents.
+        probe_range (iterable): Probe budgets (`num_probes`) to evaluate.
+        threshold (float): Jaccard similarity above which a pair counts as a true near-duplicate.
+        num_hashes, num_bands, rows_per_band, k: LSHImproved parameters.
+        banding_method (str): Probing strategy passed to LSHImproved.
+
+    Returns:
+        list: One dictionary per probe budget with `num_probes`, `recall`, `candidates`,
+        `index_bytes` and `index_time_entries` (the bucket entries the previous
+        index-time perturbation needed for the same budget).
+    """
+    from itertools import combinations
+    from deduplication.LSHImproved import LSHImproved
+
+    lsh = LSHImproved(num_hashes=num_hashes, num_bands=num_bands, rows_per_band=rows_per_band, k=k, banding_method=banding_method)
+    signatures = lsh.compute_minhash_signatures(docs)
+
+    true_pairs = set()
+    for a, b in combinations(lsh.shingle_sets, 2):
+        sa, sb = lsh.shingle_sets[a], lsh.shingle_sets[b]
+        union = len(sa | sb)
+        if union and len(sa & sb) / union >= threshold:
+            true_pairs.add((a, b))
+
+    results = []
+    for num_probes in probe_range:
+        lsh.num_probes = num_probes
+        candidates = lsh.banding(signatures)
+        found = sum(1 for a, b in true_pairs if (a, b) in candidates or (b, a) in candidates)
+        results.append({
+            "num_probes": num_probes,
+            "recall": found / len(true_pairs) if true_pairs else 1.0,
+            "candidates": len(candidates),
+            "index_bytes": lsh.index_size(),
+            "index_time_entries": len(signatures) * num_bands * (1 + num_probes),
+        })
+    return results
+
+
+def plot_multi_probe(results):
+    """
+    Plots recall and candidate volume against the probe budget from `benchmark_multi_probe`.
+
+    Args:
+        results (list): The output of `benchmark_multi_probe`.
+    """
+    probes = [r["num_probes"] for r in results]
+
+    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+
+    axes[0].plot(probes, [r["recall"] for r in results], marker='o')
+    axes[0].set_title(f'Recall vs probes (index size {results[0]["index_bytes"] / 1024:.0f} KB)')
+    axes[0].set_xlabel('Probes per side')
+    axes[0].set_ylabel('Recall')
+
+    axes[1].plot(probes, [r["candidates"] for r in results], marker='o', label='Candidate pairs')
+    axes[1].plot(probes, [r["index_time_entries"] for r in results], marker='o', linestyle='--', label='Index-time perturbation entries')
+    axes[1].set_title('Candidates and index-time entries vs probes')
+    axes[1].set_xlabel('Probes per side')
+    axes[1].legend()
+
+    plt.tight_layout()
+    plt.show()
@@ -1,60 +1,11 @@
-import mmh3
-import math
-import bitarray
-import random
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
 import plotly.io as pio
 import numpy as np
+from deduplication.bloom_filter import BloomFilter_KM_Opt
+from utils.bloom_benchmark import measure_filter, run_benchmark
 
-class BloomFilter:
-    def __init__(self, n: int, f: float, k: int = None):
-        """
-        Creates a Bloom Filter object that takes k.
-        """
-        self.n = n
-        """int: Maximum number of elements the filter is designed to hold."""
-        self.f = f
-        """float: Desired false positive rate for the filter."""
-        # Size of bit array
-        self.m = int(-math.log(self.f) * self.n / (math.log(2)**2))
-        """int: Size of the bit array, calculated based on `f` and `n` to meet the desired false positive rate."""
-        # Number of hash functions
-        self.k = k
-        """int: Number of hash functions used in the filter. If not provided, it is calculated."""
-        # Create the bit array
-        self.bit_array = bitarray.bitarray(self.m)
-        """bitarray: Bit array used to store hashed indices, with a size of `m`."""
-        self.bit_array.setall(0)  # Set all bits to 0
-
-    def add(self, item: str):
-        """
-        Adds an item to the bloom filter.
-        
-        Args:
-            item: the string to add
-        """
-        for i in range(self.k):
-            index = mmh3.hash(item, i) % self.m
-            self.bit_array[index] = 1
-
-    def query(self, item: str) -> bool:
-        """
-        Checks if an item might be in the bloom filter (may have false positives).
-        
-        Args:
-            item: the string to query
-            
-        Returns:
-            bool: True if item might be in the bloom filter, False if it definitely isn't
-        """
-        for i in range(self.k):
-            index = mmh3.hash(item, i) % self.m
-            if not self.bit_array[index]:
-                return False
-        return True
-
-def calculate_false_positive_rate(n, f, k):
+def calculate_false_positive_rate(n, f, k, num_lookups=10000):
     """
     Calculates the false positive rate for a Bloom Filter given n, f, and k.
     
@@ -62,26 +13,12 @@ def calculate_false_positive_rate(n, f, k):
         n: number of elements
         f: desired false positive rate
         k: number of hash functions
+        num_lookups: number of lookups of absent elements
     
     Returns:
         The observed false positive rate.
     """
-    bf = BloomFilter(n, f, k)
-    
-    # Add n random elements to the Bloom filter
-    inserted_elements = [str(random.randint(0, 10**12)) for _ in range(n)]
-    for elem in inserted_elements:
-        bf.add(elem)
-
-    # Perform random lookups to calculate false positive rate
-    false_positives = 0
-    num_lookups = 10000
-    for _ in range(num_lookups):
-        elem = str(random.randint(0, 10**12))
-        if bf.query(elem):
-            false_positives += 1
-
-    return false_positives / num_lookups
+    return measure_filter(BloomFilter_KM_Opt, n, f, k, num_lookups)["false_positive_rate"]
 
 def plot_false_positive_rate_vs_hash_functions(n, f, max_k):
     """
@@ -93,7 +30,8 @@ def plot_false_positive_rate_vs_hash_functions(n, f, max_k):
         max_k: maximum number of hash functions to test
     """
     ks = range(1, max_k + 1)
-    false_positive_rates = [calculate_false_positive_rate(n, f, k) for k in ks]
+    results = run_benchmark([BloomFilter_KM_Opt], [n], [f], ks, num_lookups=10000, output_dir=None)
+    false_positive_rates = results.sort_values("k")["false_positive_rate"].tolist()
 
     plt.figure(figsize=(10, 6))
     plt.plot(ks, false_positive_rates, marker='o')
@@ -106,6 +44,93 @@ def plot_false_positive_rate_vs_hash_functions(n, f, max_k):
     
     plt.show()
 
+def benchmark_filters(filter_classes, n=100000, f=0.01, num_lookups=100000):
+    """
+    Measures insert and lookup throughput, space and observed false positive rate of membership filters.
+
+    Every filter is sized for `n` items at rate `f`, filled with `n` strings through
+    `add_many` and probed with `num_lookups` strings that were never inserted through
+    `query_many` (see `utils.bloom_benchmark.measure_filter`).
+
+    Args:
+        filter_classes: filter classes taking `(n, f)`, e.g. `BloomFilter_KM_Opt` or `BloomFilter_QF`
+        n: number of elements
+        f: desired false positive rate
+        num_lookups: number of lookups of absent items
+
+    Returns:
+        list: One dictionary per class with `filter`, `n`, `f`, `k`, `inserts_per_sec`,
+        `lookups_per_sec`, `n_bytes`, `bits_per_item` and `false_positive_rate`.
+    """
+    return [measure_filter(cls, n, f, num_lookups=num_lookups) for cls in filter_classes]
+
+def plot_filter_benchmark(results):
+    """
+    Plots throughput and space of the filters measured by `benchmark_filters`.
+
+    Args:
+        results (list): The output of `benchmark_filters`.
+    """
+    names = [r["filter"] for r in results]
+    x = np.arange(len(names))
+
+    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+
+    axes[0].bar(x - 0.2, [r["inserts_per_sec"] for r in results], width=0.4, label='Inserts')
+    axes[0].bar(x + 0.2, [r["lookups_per_sec"] for r in results], width=0.4, label='Lookups')
+    axes[0].set_xticks(x, names, rotation=15)
+    axes[0].set_ylabel('Operations per second')
+    axes[0].set_title('Throughput')
+    axes[0].legend()
+
+    axes[1].bar(x, [r["bits_per_item"] for r in results])
+    axes[1].set_xticks(x, names, rotation=15)
+    axes[1].set_ylabel('Bits per item')
+    axes[1].set_title('Space (observed FPR above bars)')
+    for i, r in enumerate(results):
+        axes[1].annotate(f'{r["false_positive_rate"]:.4f}', (i, r["bits_per_item"]), ha='center', va='bottom')
+
+    plt.tight_layout()
+    plt.show()
+
+def benchmark_fpr_throughput(filter_classes, n=1000000, f_values=(0.1, 0.05, 0.01, 0.005, 0.001), num_lookups=1000000):
+    """
+    Runs `benchmark_filters` for several target false positive rates, e.g. to compare
+    `BlockedBloomFilter` with `BloomFilter_KM_Opt`.
+
+    Args:
+        filter_classes: filter classes taking `(n, f)`
+        n: number of elements
+        f_values: desired false positive rates to size the filters for
+        num_lookups: number of lookups of absent items per filter
+
+    Returns:
+        list: The `benchmark_filters` results of every `f`, concatenated.
+    """
+    results = []
+    for f in f_values:
+        results.extend(benchmark_filters(filter_classes, n=n, f=f, num_lookups=num_lookups))
+    return results
+
+def plot_fpr_vs_throughput(results):
+    """
+    Plots observed false positive rate against lookup throughput, one line per filter class.
+
+    Args:
+        results (list): The output of `benchmark_fpr_throughput`.
+    """
+    plt.figure(figsize=(10, 6))
+    for name in dict.fromkeys(r["filter"] for r in results):
+        rows = [r for r in results if r["filter"] == name]
+        plt.plot([r["lookups_per_sec"] for r in rows], [r["false_positive_rate"] for r in rows], marker='o', label=name)
+    plt.yscale('log')
+    plt.xlabel('Lookups per second')
+    plt.ylabel('Observed False Positive Rate')
+    plt.title('False Positive Rate vs. Lookup Throughput')
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+
 # if __name__ == "__main__":
 #     n = 10**7     # Number of elements
 #     f = 0.02      # Desired false positive rate
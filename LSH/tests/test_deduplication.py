@@ -1,7 +1,33 @@
 from deduplication.dedup import Baseline
 from deduplication.LSH import LSH
+from deduplication.LSHImproved import LSHImproved
+from deduplication.LSHForest import LSHForest
 from utils.use_cases import collection_deduplication, nearest_neighbor_search
-from utils.utils import UnionFind
+from utils.bloom_benchmark import run_benchmark
+from deduplication.bench import run_method, compare, format_report
+from utils.synthetic_corpus import CorpusGenerator
+from utils.instrumentation import Instrumentation, set_instrumentation, span
+from utils.profiling import StageProfiler, profiler_from_env
+from utils.s_curve_calibration import sample_pairs, measure_candidates, calibrate, shingle_ids
+from deduplication.tuning import rank_parameters, tune_parameters, candidate_probability, estimate_cost, format_estimate
+from deduplication.evaluate import evaluate_clusters, pareto_frontier, sweep
+from utils.utils import clean_document, shingle, minhash, UnionFind, remove_exact_duplicates, majority_vote, pack_pairs, unpack_pairs, split_signatures, read_tsv
+import importlib.util
+import json
+import os
+import threading
+import numpy as np
+from collections import Counter, defaultdict
+from itertools import combinations
+
+def _toy_docs(n, variants=1):
+    """
+    Documents 1..n in four groups of identical text (by `i % 4`). With `variants` > 1 each
+    document ends in one of that many extra words, so the groups hold near-duplicates.
+    """
+    suffixes = [""] if variants == 1 else [f" {letter}" for letter in "qrstuvwxyz"[:variants]]
+    return {i: " ".join("abcd"[i % 4] + letter for letter in "efghijklmnop") + suffixes[i % variants]
+            for i in range(1, n + 1)}
 
 def test_exact_duplicates():
     documents = [
@@ -56,7 +82,270 @@ def test_word_count_based_duplicates():
     # assert duplicates[0] == ("We like McDonalds.", "McDonalds like we.")  # The correct duplicate pair should be identified
 
 
-from deduplication.bloom_filter import BloomFilter
+def test_stream_clusters_spills_to_disk(tmp_path):
+    documents = {i: f"document {i % 7}" for i in range(100)}
+    expected = sorted([i for i in range(100) if i % 7 == r] for r in range(7))
+
+    # 240 bytes hold 10 records, so the 100 documents spill into 10 sorted runs
+    assert sorted(Baseline().stream_clusters(iter(documents.items()), memory_budget=240, tmp_dir=tmp_path)) == expected
+    assert sorted(Baseline().collection_deduplication(documents).values()) == expected
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_bench_run_method_and_compare():
+    docs = {i: f"the quick brown fox number {i % 5} jumps over the lazy dog again and again" for i in range(12)}
+    results = {method: run_method(method, docs, n_jobs=1) for method in ("Baseline", "LSH", "LSHImproved", "LSHForest")}
+
+    # Stages are the spans the CLI and load.py report
+    assert list(results["LSH"]["stages"]) == ["clean", "shingle", "sign", "band", "cluster"]
+    assert results["LSH"]["stages"]["sign"]["items"] == 5 and set(results["Baseline"]["stages"]) == {"sign", "cluster"}
+    assert results["Baseline"]["clusters"] == 5
+    assert all(result["index_bytes"] > 0 and result["peak_rss_mb"] > 0 for result in results.values())
+
+    old = {"results": [results["LSH"]]}
+    slower = dict(results["LSH"], total_seconds=results["LSH"]["total_seconds"] * 2 + 1)
+    rows = compare(old, {"results": [slower]})
+    assert [row["metric"] for row in rows if row["regression"]] == ["total_seconds"]
+    assert not any(row["regression"] for row in compare(old, old))
+    # Only the LSH index size is a sys.getsizeof estimate
+    assert [method for method, result in results.items() if result["index_bytes_estimated"]] == ["LSH"]
+    assert "index_bytes (estimate)" in format_report(rows)
+
+
+def test_synthetic_corpus_ground_truth(tmp_path):
+    generator = CorpusGenerator(vocabulary=[f"w{i}" for i in range(500)], shingle_size=3, jaccard_levels=(0.7,),
+                                duplicate_rate=0.4, exact_rate=0.1, seed=1)
+    generator.write(300, str(tmp_path / "corpus.tsv"))
+
+    docs = read_tsv(tmp_path / "corpus.tsv")
+    clusters = [list(map(int, line.split())) for line in open(tmp_path / "corpus.truth.txt")]
+    assert sorted(docs) == list(range(1, 301))
+    assert sorted(doc_id for cluster in clusters for doc_id in cluster) == list(range(1, 301))
+    assert any(len(cluster) > 1 for cluster in clusters)
+
+    rows = [line.rstrip("\n").split("\t") for line in open(tmp_path / "corpus.meta.tsv")][1:]
+    near = [float(row[4]) for row in rows if row[2] == "near"]
+    assert near and abs(np.mean(near) - 0.7) < 0.1
+    for row in rows:
+        if row[2] == "exact":
+            original = next(other for other in rows if other[1] == row[1] and other[2] == "original")
+            assert docs[int(row[0])] == docs[int(original[0])]
+
+    # Block moves damage many shingles at once, yet no near-duplicate lands far below its target
+    generator = CorpusGenerator(shingle_size=3, jaccard_levels=(0.9, 0.5), edits=("reorder", "substitute"),
+                                duplicate_rate=0.6, seed=3)
+    generator.write(300, str(tmp_path / "blocks.tsv"))
+    rows = [line.rstrip("\n").split("\t") for line in open(tmp_path / "blocks.meta.tsv")][1:]
+    assert all(float(row[4]) >= float(row[3]) - generator.tolerance - 1e-4 for row in rows if row[2] == "near")
+
+    generator.write(0, str(tmp_path / "empty.tsv"))
+    assert open(tmp_path / "empty.tsv").read() == open(tmp_path / "empty.truth.txt").read() == ""
+    assert open(tmp_path / "empty.meta.tsv").read() == "id\tcluster\tkind\ttarget\tjaccard\n"
+
+
+def test_evaluate_clusters_and_sweep():
+    truth = [[1, 2, 3], [4, 5], [6]]
+    scores = evaluate_clusters([[1, 2], [3, 4, 5]], truth)
+    # Predicted pairs (1,2) (3,4) (3,5) (4,5); true pairs (1,2) (1,3) (2,3) (4,5)
+    assert (scores["true_positive_pairs"], scores["precision"], scores["recall"]) == (2, 0.5, 0.5)
+    assert scores["purity"] == 5 / 6  # 6 is missing from the prediction and counts as a singleton
+
+    docs = _toy_docs(12)
+    truth = [[i for i in docs if i % 4 == r] for r in range(4)]
+    results = sweep(docs, truth, methods=("Baseline", "LSH"), bands=(5,), rows=(2, 4), shingle_sizes=(3,), n_jobs=1)
+    assert len(results) == 3
+    assert (results["f1"] == 1.0).all() and (results["num_hashes"].dropna() == [10, 20]).all()
+
+    frontier = pareto_frontier(results)
+    assert len(frontier) == 1 and frontier.iloc[0]["total_seconds"] == results["total_seconds"].min()
+
+
+def test_tune_parameters():
+    error, b, r = rank_parameters(0.8, 100)[0]
+    assert b * r <= 100 and abs(0.8 - (1 / b) ** (1 / r)) < 0.1
+    # Favouring recall moves the S-curve to lower similarities
+    _, b_recall, r_recall = rank_parameters(0.8, 100, fn_weight=0.9, fp_weight=0.1)[0]
+    assert candidate_probability(0.7, b_recall, r_recall) > candidate_probability(0.7, b, r)
+    # Majority voting steepens the curve on both sides
+    assert candidate_probability(0.3, 5, 4, num_trees=3) < candidate_probability(0.3, 5, 4)
+    assert candidate_probability(0.9, 5, 4, num_trees=3) > candidate_probability(0.9, 5, 4)
+
+    docs = _toy_docs(40)
+    tuned = tune_parameters(docs, threshold=0.8, num_hashes=40, k=3, sample_size=20, num_candidates=5)
+    assert tuned["num_hashes"] == tuned["num_bands"] * tuned["rows_per_band"] <= 40
+    assert tuned["within_budget"] and len(tuned["candidates"]) == 5
+    assert tuned["error"] == min(candidate["error"] for candidate in tuned["candidates"])
+    cheapest = tune_parameters(docs, threshold=0.8, num_hashes=40, k=3, sample_size=20, num_candidates=5, time_budget=0)
+    assert not cheapest["within_budget"]
+    assert cheapest["estimated_seconds"] == min(candidate["estimated_seconds"] for candidate in cheapest["candidates"])
+
+
+def test_estimate_cost_projects_candidate_pairs():
+    docs = _toy_docs(40, variants=10)
+    lsh = LSH(num_hashes=20, num_bands=5, rows_per_band=4, k=3)
+    lsh.compute_minhash_signatures(docs)
+    lsh.banding()
+
+    estimate = estimate_cost(docs, num_hashes=20, num_bands=5, rows_per_band=4, k=3, sample_size=40)
+    assert estimate["unique_docs"] == len(lsh.unique_docs) and len(estimate["bands"]) == 5
+    assert estimate["estimated_candidate_pairs"] == len(lsh.candidate_pairs)
+    assert estimate["estimated_band_collisions"] >= len(lsh.candidate_pairs)
+
+    # Projected to a collection 100 times larger, pairs grow with the square of its size
+    larger = estimate_cost(docs, num_hashes=20, num_bands=5, rows_per_band=4, k=3, num_docs=4000, sample_size=40,
+                           memory_budget=2 ** 20)
+    n = len(lsh.unique_docs)
+    expected = len(lsh.candidate_pairs) * (100 * n) * (100 * n - 1) / (n * (n - 1))
+    assert abs(larger["estimated_candidate_pairs"] - expected) < 1e-6 * expected
+    assert larger["over_budget"] == ["memory"] and not larger["within_budget"]
+
+
+def test_estimate_cost_empty_collection():
+    # load.py estimates every collection, empty ones included
+    estimate = estimate_cost({}, num_hashes=20, num_bands=5, rows_per_band=4, k=3, num_docs=0, time_budget=1, memory_budget=1)
+    assert estimate["sample_size"] == 0 and estimate["bands"] == []
+    assert estimate["estimated_candidate_pairs"] == 0 and estimate["estimated_seconds"] == 0
+    assert estimate["within_budget"] and estimate["over_budget"] == []
+    assert format_estimate(estimate) == ["Nothing to sign: the sample of 0 documents is empty"]
+
+
+def test_s_curve_calibration():
+    generator = CorpusGenerator(shingle_size=3, jaccard_levels=(0.9, 0.7, 0.5, 0.3), duplicate_rate=0.5, seed=2)
+    docs = {i: " ".join(words) for i, (*_, words) in enumerate(generator.documents(200), 1)}
+
+    pairs = sample_pairs(docs, k=3, strata=5, pairs_per_stratum=20, n_jobs=1)
+    assert pairs.groupby("stratum").size().max() <= 20 and pairs["stratum"].nunique() >= 4
+    for a, b, jaccard in pairs[["doc_a", "doc_b", "jaccard"]].itertuples(index=False):
+        sa, sb = shingle(clean_document(docs[a]), 3), shingle(clean_document(docs[b]), 3)
+        assert abs(jaccard - len(sa & sb) / len(sa | sb)) < 1e-12 and len(shingle_ids(docs[a], 3)) == len(sa)
+
+    # LSH pairs two documents exactly when one of their bands is equal
+    found = measure_candidates(docs, pairs, "LSH", num_bands=5, rows_per_band=3, k=3, background=20, n_jobs=1)
+    for (a, b), candidate in zip(pairs[["doc_a", "doc_b"]].itertuples(index=False), found):
+        sa = np.array(minhash(shingle(clean_document(docs[a]), 3), 15)).reshape(5, 3)
+        sb = np.array(minhash(shingle(clean_document(docs[b]), 3), 15)).reshape(5, 3)
+        assert candidate == (sa == sb).all(axis=1).any()
+    # Documents shorter than k and exact duplicates are never drawn into the background
+    padded = {**docs, 1001: "too short", 1002: docs[1]}
+    again = measure_candidates(padded, pairs, "LSH", num_bands=5, rows_per_band=3, k=3, background=len(padded), n_jobs=1)
+    assert (again == found).all()
+
+    results = calibrate(docs, "LSHForest", num_bands=5, rows_per_band=2, k=3, num_trees=3, strata=5,
+                        pairs_per_stratum=20, background=0, n_jobs=1)
+    assert results["pairs"].sum() == len(pairs) and (results["low"] <= results["mean_jaccard"]).all()
+    assert results.iloc[0]["empirical"] <= results.iloc[-1]["empirical"] and results.iloc[-1]["theoretical"] > 0.9
+
+
+def test_instrumentation_spans(tmp_path):
+    instrumentation = Instrumentation(run="test")
+    previous = set_instrumentation(instrumentation)
+    try:
+        docs = _toy_docs(12)
+        lsh = LSH(num_hashes=10, num_bands=5, rows_per_band=2, k=3, batch_size=5)
+        lsh.banding(lsh.compute_minhash_signatures(docs))
+        collection_deduplication(lsh)
+        for _ in range(2):
+            with span("write") as stage:
+                stage.items = 3
+    finally:
+        set_instrumentation(previous)
+
+    spans = instrumentation.spans
+    assert list(spans) == ["clean", "shingle", "sign", "band", "cluster", "write"]
+    # Only the 4 unique documents are signed, and the two write spans are added up
+    assert spans["sign"].items == 4 and spans["write"].count == 2 and spans["write"].items == 6
+    assert all(totals.wall_seconds >= 0 and totals.cpu_seconds >= 0 for totals in spans.values())
+
+    instrumentation.write_json(tmp_path / "report.json")
+    report = json.load(open(tmp_path / "report.json"))
+    assert [entry["name"] for entry in report["spans"]] == list(spans) and report["peak_rss_mb"] > 0
+    metrics = instrumentation.prometheus()
+    assert 'dedup_span_items_total{run="test",span="write"} 6' in metrics
+    assert "# TYPE dedup_span_wall_seconds_total counter" in metrics
+
+
+def test_stage_profiler(tmp_path):
+    assert profiler_from_env({}) is None and profiler_from_env({"DEDUP_PROFILE": "memory"}).mode == "memory"
+    docs = _toy_docs(12)
+    for mode in ("cpu", "sample", "memory"):
+        profiler = StageProfiler(mode, tmp_path / mode, top=5, interval=0.001)
+        instrumentation = Instrumentation(run="test", profiler=profiler)
+        previous = set_instrumentation(instrumentation)
+        try:
+            lsh = LSH(num_hashes=10, num_bands=5, rows_per_band=2, k=3, batch_size=5)
+            lsh.banding(lsh.compute_minhash_signatures(docs))
+            with span("write"):
+                # Nested spans are counted in the outermost one
+                with span("verify"):
+                    sum(len(shingle(doc, 3)) for _ in range(2000) for doc in docs.values())
+        finally:
+            set_instrumentation(previous)
+            profiler.close()
+
+        paths = profiler.dump()
+        assert set(profiler.profiles) == {"clean", "shingle", "sign", "band", "write"}
+        assert set(instrumentation.spans) == {"clean", "shingle", "sign", "band", "write", "verify"}
+        extension = ".pstats" if mode == "cpu" else ".collapsed"
+        assert sorted(paths) == sorted(str(tmp_path / mode / f"{name}{suffix}") for name in profiler.profiles for suffix in (".txt", extension))
+        table = open(tmp_path / mode / "write.txt").read()
+        # The verify span's work shows up in the write profile
+        assert {"cpu": "(shingle)", "sample": "utils.py", "memory": "Stage write"}[mode] in table
+    assert "shingle" in open(tmp_path / "sample" / "write.collapsed").read()
+
+
+def test_stage_profiler_dump_while_profiling(tmp_path):
+    # The Flask apps dump after every request while other requests are still in spans
+    profiler = StageProfiler("sample", tmp_path, interval=0.0005)
+    instrumentation = Instrumentation(run="test", profiler=profiler)
+    done = threading.Event()
+
+    def request():
+        for i in range(200):
+            with instrumentation.span(f"stage{i}"):
+                sum(len(shingle("a b c d e f g h", 2)) for _ in range(100))
+        done.set()
+
+    worker = threading.Thread(target=request)
+    worker.start()
+    while not done.is_set():
+        profiler.dump()
+    worker.join()
+    profiler.close()
+    assert not any(thread.name == "stage-profiler" for thread in threading.enumerate())
+    assert len(profiler.dump()) == 2 * len(profiler.profiles)
+
+    # A cProfile profile that is still running is written by the next dump
+    profiler = StageProfiler("cpu", tmp_path / "cpu")
+    token = profiler.start("sign")
+    assert profiler.dump() == []
+    profiler.stop("sign", token)
+    assert len(profiler.dump()) == 2
+
+
+def test_similarity_join_matches_all_pairs():
+    rng = np.random.default_rng(0)
+    vocab = [f"w{i}" for i in range(30)]
+    base = [list(rng.choice(vocab, size=8)) for _ in range(5)]
+    documents = []
+    for _ in range(40):
+        words = list(base[rng.integers(len(base))])
+        words[rng.integers(len(words))] = str(rng.choice(vocab))
+        documents.append(" ".join(words[:int(rng.integers(5, 9))]))
+
+    for threshold in (0.5, 0.75, 1.0):
+        expected = []
+        for i in range(len(documents)):
+            for j in range(i + 1, len(documents)):
+                a, b = Counter(documents[i].split()), Counter(documents[j].split())
+                if sum((a & b).values()) / sum((a | b).values()) >= threshold:
+                    expected.append((documents[i], documents[j]))
+        assert Baseline().word_count_baseline(documents, threshold) == expected
+
+    ids = {f"doc{i}": text for i, text in enumerate(documents)}
+    assert all(a in ids and b in ids and ratio >= 0.75 for a, b, ratio in Baseline().similarity_join(ids, 0.75))
+
+
+from deduplication.bloom_filter import BloomFilter, BloomFilter_KM_Opt, BloomFilter_Uni_Hash, ScalableBloomFilter, BloomFilter_QF, CuckooFilter, BlockedBloomFilter
 
 def test_bloom_filter_add_query():
     bf = BloomFilter(n=100, f=0.01)
@@ -160,3 +449,338 @@ def test_union_find():
     uf.union(4, 1)
     assert uf.find(4) == uf.find(1)
     assert uf.find(4) == uf.find(3)
+
+
+def test_lsh_improved_index_independent_of_probes():
+    docs = {
+        1: "the quick brown fox jumps over the lazy dog",
+        2: "the quick brown fox jumps over the lazy lazy dog",
+        3: "a fast dark brown fox leaps over the lazy hound",
+        4: "the lazy dog jumps over the quick brown fox",
+    }
+    sizes = []
+    pair_sets = []
+    for num_probes in (0, 4):
+        lsh = LSHImproved(num_hashes=100, num_bands=20, rows_per_band=5, k=3, num_probes=num_probes)
+        signatures = lsh.compute_minhash_signatures(docs)
+        pair_sets.append(lsh.banding(signatures))
+        sizes.append(lsh.index_size())
+
+    # Probing happens at query time, so the index does not grow with the budget
+    assert sizes[0] == sizes[1]
+    assert (1, 2) in pair_sets[0]
+    assert pair_sets[0] <= pair_sets[1]
+
+def test_lsh_improved_query_directed_keeps_dissimilar_pairs_apart():
+    # Random 12-word documents over 150 words: nearly all pairs have Jaccard below 0.2,
+    # and with k=1 many documents share the first row of a band
+    rng = np.random.default_rng(0)
+    vocab = [a + b + c for a in "abcdef" for b in "ghijk" for c in "lmnop"]
+    docs = {i: " ".join(rng.choice(vocab, size=12)) for i in range(1, 121)}
+    lsh = LSHImproved(num_hashes=100, num_bands=20, rows_per_band=5, k=1, num_probes=4, banding_method='query_directed')
+    pairs = lsh.banding(lsh.compute_minhash_signatures(docs))
+    sets = {doc_id: shingle(clean_document(doc), 1) for doc_id, doc in lsh.unique_docs.items()}
+    low = [(a, b) for a, b in combinations(sorted(sets), 2) if len(sets[a] & sets[b]) / len(sets[a] | sets[b]) < 0.2]
+
+    # The S-curve of b=20, r=5 is below 0.01 here; probing buckets that share only the
+    # first row of a band made about 40% of these pairs candidates
+    assert len(low) > 1000
+    assert sum(pair in pairs for pair in low) / len(low) < 0.01
+
+def test_lsh_improved_nn():
+    docs = {
+        1: "the quick brown fox jumps over the lazy dog",
+        2: "the quick brown fox jumped over the lazy dog ",
+        3: "a fast dark brown fox leaps over the lazy hound",
+        4: "the lazy dog jumps over the quick brown fox",
+    }
+    lsh = LSHImproved(num_hashes=100, num_bands=20, rows_per_band=5, k=3, num_probes=0)
+    signatures = lsh.compute_minhash_signatures(docs)
+    lsh.banding(signatures)
+
+    candidates = nearest_neighbor_search("the quick brown fox jumps over the lazy", lsh)
+
+    assert candidates == {1}
+
+def test_lsh_improved_perturbation_reproducible():
+    docs = {
+        1: "the quick brown fox jumps over the lazy dog",
+        2: "the quick brown fox jumps over the lazy lazy dog",
+        3: "a fast dark brown fox leaps over the lazy hound",
+    }
+    results = []
+    for _ in range(2):
+        lsh = LSHImproved(num_hashes=100, num_bands=20, rows_per_band=5, k=3, banding_method='gaussian', seed=7)
+        signatures = lsh.compute_minhash_signatures(docs)
+        lsh.banding(signatures)
+        results.append((lsh.candidate_pairs, lsh.perturbed_keys(lsh.index[0][1]).tolist()))
+
+    assert results[0] == results[1]
+    assert len(results[0][1][0]) == lsh.num_probes
+
+def test_lsh_forest_top_k_query():
+    docs = {
+        1: "the quick brown fox jumps over the lazy dog",
+        2: "the quick brown fox jumped over the lazy dog ",
+        3: "a fast dark brown fox leaps over the lazy hound",
+        4: "the lazy dog jumps over the quick brown fox",
+    }
+    lsh = LSHForest(num_hashes=200, num_bands=10, rows_per_band=4, num_trees=5, k=3)
+    lsh.compute_minhash_signatures(docs)
+
+    neighbours = lsh.query(lsh.get_minhash_signature("the quick brown fox jumps over the lazy"), top_k=2)
+
+    # Neighbours sharing no prefix with the query in any tree are never returned
+    assert 1 <= len(neighbours) <= 2
+    assert neighbours[0][0] == 1
+    assert neighbours == sorted(neighbours, key=lambda n: -n[1])
+    assert nearest_neighbor_search("the quick brown fox jumps over the lazy", lsh, top_k=1) == [1]
+
+def test_majority_vote_packed_matches_sets():
+    candidate_sets = [{(0, 1), (1, 2)}, {(0, 1), (2, 3)}, {(0, 1), (1, 2)}]
+    packed = [np.unique(pack_pairs([a for a, _ in pairs], [b for _, b in pairs], 4)) for pairs in candidate_sets]
+
+    first, second = unpack_pairs(majority_vote(packed), 4)
+
+    assert set(zip(first.tolist(), second.tolist())) == set(majority_vote(candidate_sets)) == {(0, 1), (1, 2)}
+
+def test_lsh_forest_banding():
+    docs = {
+        1: "the quick brown fox jumps over the lazy dog",
+        2: "the quick brown fox jumps over the lazy dog today",
+        3: "a fast dark brown fox leaps over the lazy hound",
+        4: "The quick brown fox jumps over the lazy dog",  # Exact duplicate, never signed
+    }
+    lsh = LSHForest(num_hashes=200, num_bands=10, rows_per_band=4, num_trees=5, k=3, n_jobs=1)
+    signatures = lsh.compute_minhash_signatures(docs)
+
+    assert lsh.banding(signatures) == [(1, 2)]
+    assert lsh.exact_duplicates == {1: [4]}
+
+def test_split_signatures_views():
+    matrix = np.arange(30, dtype=np.uint64).reshape(3, 10)
+
+    contiguous = split_signatures(matrix, 3)
+    interleaved = split_signatures(matrix, 3, interleave=True)
+
+    assert [split.shape[1] for split in contiguous] == [4, 3, 3]
+    assert interleaved[1][0].tolist() == [1, 4, 7]
+    assert all(np.shares_memory(split, matrix) for split in contiguous + interleaved)
+
+def test_bloom_filter_batch_matches_single():
+    items = [f"Document {i}" for i in range(200)]
+    for cls in (BloomFilter, BloomFilter_KM_Opt, BloomFilter_Uni_Hash):
+        bf = cls(n=1000, f=0.01)
+        bf.add_many(items[:100])
+        bf.add(items[100])
+
+        result = bf.query_many(items)
+
+        assert result[:101].all()  # No false negatives
+        assert result.tolist() == [bf.query(item) for item in items]
+
+def test_bloom_filter_containment():
+    bf = BloomFilter(n=1000, f=0.01)
+    bf.add("the quick brown fox jumps over the lazy dog")
+
+    assert bf.containment("the quick brown fox jumps over the lazy dog") == 1.0
+    assert 0.5 < bf.containment("the quick brown fox jumps over the lazy cat") < 1.0
+    assert bf.query("the quick brown fox jumps over the lazy cat") == False
+
+def test_bloom_filter_save_open_union(tmp_path):
+    shard_a = BloomFilter_KM_Opt(n=1000, f=0.01)
+    shard_b = BloomFilter_KM_Opt(n=1000, f=0.01)
+    shard_a.add_many(["Document 1", "Document 2"])
+    shard_b.add("Document 3")
+
+    path = tmp_path / "shard_a.bloom"
+    shard_a.save(path)
+    loaded = BloomFilter_KM_Opt.open(path, mmap=True)
+
+    assert loaded.query_many(["Document 1", "Document 2", "Document 3"]).tolist() == [True, True, False]
+    assert (loaded | shard_b).query_many(["Document 1", "Document 3"]).all()
+
+    # Universal-hash shards built apart agree on their coefficients through the seed
+    shard_a, shard_b = BloomFilter_Uni_Hash(n=1000, f=0.01), BloomFilter_Uni_Hash(n=1000, f=0.01)
+    shard_a.add_many(["Document 1", "Document 2"])
+    shard_b.add("Document 3")
+    assert (shard_a | shard_b).query_many(["Document 1", "Document 2", "Document 3"]).all()
+    assert shard_a.seeds != BloomFilter_Uni_Hash(n=1000, f=0.01, seed=1).seeds
+
+def test_scalable_bloom_filter_grows():
+    sbf = ScalableBloomFilter(n=100, f=0.01)
+    items = [f"Document {i}" for i in range(1000)]
+    sbf.add_many(items[:900])
+    for item in items[900:]:
+        sbf.add(item)
+
+    assert len(sbf.filters) > 1
+    assert sbf.query_many(items).all()  # No false negatives
+    assert sbf.add("Document 1") == True
+    assert sbf.estimated_fpr() < 0.01
+    assert 0 < sbf.fill_ratio() < 1
+
+def test_quotient_filter_delete_and_resize():
+    qf = BloomFilter_QF(n=50, f=0.01)
+    items = [f"Document {i}" for i in range(500)]
+    qf.add_many(items[:400])
+    for item in items[400:]:
+        qf.add(item)
+
+    assert qf.size == 1024  # Doubled from 128 slots to stay under 75% load
+    assert qf.query_many(items).all()  # No false negatives after resizing
+    assert sum(qf.query(f"Other {i}") for i in range(1000)) < 100
+
+    assert qf.delete("Document 7") == True
+    assert qf.query("Document 7") == False
+    assert qf.delete("Document 7") == False
+    assert qf.query_many(items[8:]).all()
+    assert len(qf) == 499
+
+def test_cuckoo_filter_delete_and_save(tmp_path):
+    cf = CuckooFilter(n=1000, f=0.001)
+    items = [f"Document {i}" for i in range(1000)]
+    cf.add_many(items[:900])
+    for item in items[900:]:
+        cf.add(item)
+
+    assert cf.query_many(items).all()  # No false negatives at full capacity
+    assert cf.query_many(items).tolist() == [cf.query(item) for item in items]
+    assert cf.n_bytes < BloomFilter_KM_Opt(n=1000, f=0.001).n_bytes
+
+    assert cf.delete("Document 7") == True
+    assert cf.query("Document 7") == False
+    assert len(cf) == 999
+
+    path = tmp_path / "docs.cuckoo"
+    cf.save(path)
+    loaded = CuckooFilter.open(path, mmap=True, writable=True)
+    assert len(loaded) == 999
+    assert loaded.delete("Document 8") == True
+    assert loaded.query_many(items[9:]).all()
+
+def test_blocked_bloom_filter_one_block_per_item():
+    bf = BlockedBloomFilter(n=1000, f=0.01)
+    items = [f"Document {i}" for i in range(1000)]
+    bf.add_many(items[:500])
+    for item in items[500:]:
+        bf.add(item)
+
+    assert bf.m % 512 == 0
+    assert bf.query_many(items).all()  # No false negatives
+    blocks = bf._block_indices_many(items) // 512
+    assert (blocks == blocks[:, :1]).all()  # All k bits of an item share a block
+    assert bf.query_many([f"Other {i}" for i in range(1000)]).mean() < 0.05
+
+def test_bloom_benchmark_writes_results(tmp_path):
+    results = run_benchmark([BloomFilter_KM_Opt, CuckooFilter], n_values=[2000], f_values=[0.01], k_values=[None, 3],
+                            num_lookups=2000, n_jobs=1, output_dir=tmp_path)
+
+    assert sorted(zip(results["filter"], results["k"].fillna(0))) == [("BloomFilter_KM_Opt", 3), ("BloomFilter_KM_Opt", 6), ("CuckooFilter", 0)]
+    assert (results["false_positive_rate"] < 0.05).all()
+    assert (tmp_path / "results.csv").exists() and (tmp_path / "fpr.png").exists()
+
+def test_exact_duplicates_merged_back():
+    docs = {
+        1: "the quick brown fox jumps over the lazy dog",
+        2: "the quick  brown fox jumps over the LAZY dog",  # Same normalized text
+        3: "the quick brown fox jumps over the lazy lazy dog",
+        4: "a fast dark brown fox leaps over the lazy hound",
+        5: "the quick brown fox jumps over the lazy dog",
+    }
+    unique_docs, exact_duplicates = remove_exact_duplicates(docs)
+    assert list(unique_docs) == [1, 3, 4]
+    assert exact_duplicates == {1: [2, 5]}
+
+    lsh = LSH(num_hashes=100, num_bands=20, rows_per_band=5, k=3)
+    signatures = lsh.compute_minhash_signatures(docs)
+    lsh.banding(signatures)
+    clusters = collection_deduplication(lsh)
+
+    assert sorted(signatures) == [1, 3, 4]  # Only representatives are signed
+    assert sorted(map(sorted, clusters.values())) == [[1, 2, 3, 5], [4]]
+
+def _load_data_module():
+    # data/load_data.py is a script of the loader image, not part of the package
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "data", "load_data.py")
+    spec = importlib.util.spec_from_file_location("load_data", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)  # MongoClient connects lazily, so no server is needed
+    return module
+
+class _FakeCollection:
+    """The part of a pymongo collection the loader uses."""
+
+    def __init__(self):
+        self.documents = {}
+
+    def find(self, query, projection=None):
+        digests = set(query["content_hash"]["$in"])
+        return [document for document in self.documents.values() if document.get("content_hash") in digests]
+
+    def insert_many(self, documents, ordered=True):
+        for document in documents:
+            assert document["_id"] not in self.documents, "duplicate _id"
+            self.documents[document["_id"]] = document
+
+    def delete_many(self, query):
+        self.documents.clear()
+
+    def estimated_document_count(self):
+        return len(self.documents)
+
+    def create_index(self, key):
+        pass
+
+def test_load_data_duplicate_gate(tmp_path):
+    load_data = _load_data_module()
+    collection, duplicates = _FakeCollection(), _FakeCollection()
+    content_filter = load_data.ContentFilter(1000, 0.001)
+
+    def batch(ids_and_texts):
+        return [{"_id": i, "text": text, "content_hash": load_data.content_hash(text)} for i, text in ids_and_texts]
+
+    # In-batch duplicate: the same text after normalization
+    diverted = load_data.insert_batch(collection, batch([(1, "Hello  World"), (2, "hello world"), (3, "other")]),
+                                      content_filter, duplicates)
+    assert diverted == 1 and sorted(collection.documents) == [1, 3]
+    assert duplicates.documents == {2: {"_id": 2, "original": 1}}
+
+    # Duplicate of a document stored by an earlier batch, confirmed through find()
+    diverted = load_data.insert_batch(collection, batch([(4, "OTHER"), (5, "new text")]), content_filter, duplicates)
+    assert diverted == 1 and sorted(collection.documents) == [1, 3, 5] and duplicates.documents[4]["original"] == 3
+
+    # A filter positive that the collection does not confirm is still inserted
+    saturated = load_data.ContentFilter(1000, 0.001)
+    saturated.bits = bytearray(b"\xff" * len(saturated.bits))
+    unique, found = load_data.split_duplicates(collection, saturated, batch([(6, "never seen")]))
+    assert [document["_id"] for document in unique] == [6] and found == []
+
+    # The filter survives a save/load round trip
+    content_filter.save(tmp_path / "docs.bloom")
+    loaded = load_data.ContentFilter.load(tmp_path / "docs.bloom")
+    assert (loaded.m, loaded.k, loaded.bits) == (content_filter.m, content_filter.k, content_filter.bits)
+    assert loaded.query(load_data.content_hash("new text")) and not loaded.query(load_data.content_hash("absent"))
+
+def test_load_data_reload_clears_duplicates(tmp_path, monkeypatch):
+    load_data = _load_data_module()
+    db = defaultdict(_FakeCollection)
+    monkeypatch.setattr(load_data, "db", db)
+    monkeypatch.setattr(load_data, "dedup_gate", True)
+    monkeypatch.setattr(load_data, "dedup_filter_dir", str(tmp_path))
+    (tmp_path / "docs.tsv").write_text("1\tsame text\n2\tSame  text\n3\tother\n")
+
+    load_data.load_tsv_files(str(tmp_path))
+    assert sorted(db["docs"].documents) == [1, 3] and list(db["docs_duplicates"].documents) == [2]
+
+    # The main collection is dropped and reloaded while its side collection is kept
+    db["docs"].documents.clear()
+    load_data.load_tsv_files(str(tmp_path))
+    assert sorted(db["docs"].documents) == [1, 3] and list(db["docs_duplicates"].documents) == [2]
+
+    # The reload starts a fresh filter, so the texts of the earlier load are gone from it
+    db["docs"].documents.clear()
+    (tmp_path / "docs.tsv").write_text("1\tnew text\n2\tNEW TEXT\n")
+    load_data.load_tsv_files(str(tmp_path))
+    saved = load_data.ContentFilter.load(tmp_path / "docs.bloom")
+    assert saved.query(load_data.content_hash("new text")) and not saved.query(load_data.content_hash("same text"))
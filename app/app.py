@@ -1,13 +1,21 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response
 import os
 import pymongo
 from collections import defaultdict
 from utils.utils import clean_document, shingle, minhash
+from utils.instrumentation import Instrumentation, set_instrumentation, span
+from utils.profiling import profiler_from_env
 import hashlib
 
 # Initialize Flask app
 app = Flask(__name__)
 
+# Time and memory of every request stage, served at /metrics
+# With DEDUP_PROFILE=cpu|sample|memory, every stage is also profiled to DEDUP_PROFILE_DIR
+profiler = profiler_from_env()
+instrumentation = Instrumentation(run="frontend", profiler=profiler)
+set_instrumentation(instrumentation)
+
 # MongoDB connection details
 mongo_host = os.getenv("MONGO_HOST", "localhost")
 mongo_port = int(os.getenv("MONGO_PORT", "27017"))
@@ -59,20 +67,24 @@ def fetch_index_from_mongodb(index_name):
 
 # Function to generate MinHash signature
 def get_minhash_signature(text):
-    cleaned_text = clean_document(text)
-    shingles = shingle(cleaned_text, k)
-    return minhash(shingles, num_hashes)
+    with span("clean", 1):
+        cleaned_text = clean_document(text)
+    with span("shingle", 1):
+        shingles = shingle(cleaned_text, k)
+    with span("sign", 1):
+        return minhash(shingles, num_hashes)
 
 # Function to find candidates for input text
 def find_candidates_for_text(index, text):
     text_signature = get_minhash_signature(text)
     candidate_docs = set()
-    for band_idx in range(num_bands):
-        start = band_idx * rows_per_band
-        band = tuple(text_signature[start:start + rows_per_band])
-        band_hash = hashlib.md5(str(band).encode()).hexdigest()
-        if (band_idx, band_hash) in index:
-            candidate_docs.update(index[(band_idx, band_hash)])
+    with span("band", 1):
+        for band_idx in range(num_bands):
+            start = band_idx * rows_per_band
+            band = tuple(text_signature[start:start + rows_per_band])
+            band_hash = hashlib.md5(str(band).encode()).hexdigest()
+            if (band_idx, band_hash) in index:
+                candidate_docs.update(index[(band_idx, band_hash)])
     return candidate_docs
 
 # Flask route for the web interface
@@ -83,8 +95,10 @@ def index():
         selected_index = request.form.get('selected_index')
 
         # Fetch the data dictionary and index based on the selected index
-        data_dict = fetch_data_from_collection(selected_index.replace('_index', ''))
-        reconstructed_index = fetch_index_from_mongodb(selected_index)
+        with span("read") as stage:
+            data_dict = fetch_data_from_collection(selected_index.replace('_index', ''))
+            reconstructed_index = fetch_index_from_mongodb(selected_index)
+            stage.items = len(data_dict)
         
         candidates = find_candidates_for_text(reconstructed_index, input_text)
         results = [(i, data_dict[i]) for i in candidates]
@@ -93,6 +107,23 @@ def index():
     
     return render_template('index.html', filtered_collections=filtered_collections)
 
+# Stage metrics of all requests so far, for Prometheus to scrape
+@app.route('/metrics')
+def metrics():
+    return Response(instrumentation.prometheus(), mimetype='text/plain; version=0.0.4')
+
+# The same figures as a JSON report
+@app.route('/metrics.json')
+def metrics_json():
+    return jsonify(instrumentation.report())
+
+# Rewrite the profiles after every request, so they are current whenever the app is stopped
+if profiler is not None:
+    @app.after_request
+    def dump_profiles(response):
+        profiler.dump()
+        return response
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
 
@@ -0,0 +1,256 @@
+"""
+Named spans for timing the stages of a deduplication run.
+
+Code marks a stage with `span(name)` and may report how many items it processed:
+
+    with span("sign") as stage:
+        signatures = ...
+        stage.items = len(signatures)
+
+Each span records its wall time, CPU time of this process, how far it raised the peak
+resident set size, and items per second. Spans of the same name are added up, so a stage
+run once per batch is reported once. Spans go to the active `Instrumentation` (see
+`set_instrumentation`); by default that is a process-wide one that nobody reports, which
+costs two clock reads and a `getrusage` call per span. A run reports its spans as log
+lines (`log_summary`), a JSON run report (`write_json`) or Prometheus text (`prometheus`).
+An `Instrumentation` given a `utils.profiling.StageProfiler` also profiles every span.
+
+This module only uses the standard library (psutil where `resource` is missing), so the
+Flask apps can use a copy of it.
+"""
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SPANS = ("read", "clean", "shingle", "sign", "band", "verify", "cluster", "write")
+"""SPANS (tuple): The stage names used by the library, the CLI, `load.py` and the Flask apps, in pipeline order"""
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process so far, in megabytes."""
+    if resource is None:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+class Span:
+    """Totals of every span of one name."""
+
+    def __init__(self, name):
+        self.name = name
+        """name (str): The stage name."""
+        self.count = 0
+        """count (int): How many times the span was entered."""
+        self.wall_seconds = 0.0
+        """wall_seconds (float): Elapsed time."""
+        self.cpu_seconds = 0.0
+        """cpu_seconds (float): CPU time of this process (not of worker processes it started)."""
+        self.rss_delta_mb = 0.0
+        """rss_delta_mb (float): How much the peak resident set size grew while the span ran."""
+        self.items = 0
+        """items (int): Items processed, as reported by the code in the span."""
+
+    @property
+    def throughput(self):
+        """float: Items per second of wall time, None when no items were reported."""
+        return self.items / self.wall_seconds if self.items and self.wall_seconds else None
+
+    def to_dict(self):
+        """Returns the totals as a dictionary, as in the JSON report."""
+        return {
+            "name": self.name,
+            "count": self.count,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "rss_delta_mb": self.rss_delta_mb,
+            "items": self.items,
+            "throughput": self.throughput,
+        }
+
+    def __str__(self):
+        text = f"{self.name}: {self.wall_seconds:.2f} s wall, {self.cpu_seconds:.2f} s CPU, +{self.rss_delta_mb:.1f} MB peak RSS"
+        if self.throughput is not None:
+            text += f", {self.items} items ({self.throughput:,.1f}/s)"
+        return text
+
+
+class _Active:
+    # What the code inside a span sees: it only sets the number of items
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        self.items = items
+
+
+class Instrumentation:
+    """
+    Collects the spans of a run.
+
+    Args:
+        run (str): Name of the run, for the reports.
+        metadata (dict): Anything to include in the JSON report, e.g. the CLI arguments.
+        log_spans (bool): Log every span as it ends (at INFO level), not only in `log_summary`.
+        profiler: A `utils.profiling.StageProfiler` to profile every span with, or None.
+    """
+
+    def __init__(self, run="deduplication", metadata=None, log_spans=False, profiler=None):
+        self.run = run
+        """run (str): Name of the run."""
+        self.metadata = dict(metadata or {})
+        """metadata (dict): Extra fields of the JSON report."""
+        self.log_spans = log_spans
+        """log_spans (bool): Whether every span is logged as it ends."""
+        self.profiler = profiler
+        """profiler: The `utils.profiling.StageProfiler` of the spans, None when profiling is off."""
+        self.spans = {}
+        """spans (dict): `Span` totals by name, in the order they were first entered."""
+        self.started = time.time()
+        """started (float): Creation time, as a Unix timestamp."""
+        self._start_peak_rss_mb = peak_rss_mb()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, items=0):
+        """
+        Times the code in a `with` block as the span `name`.
+
+        Args:
+            name (str): The stage name (see `SPANS`).
+            items (int): Items processed, if already known; the block can set `.items` instead.
+
+        Yields:
+            An object whose `items` attribute the block may set.
+        """
+        active = _Active(items)
+        profiling = self.profiler.start(name) if self.profiler is not None else None
+        peak = peak_rss_mb()
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        try:
+            yield active
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            peak = peak_rss_mb() - peak
+            if profiling is not None:
+                self.profiler.stop(name, profiling)
+            with self._lock:
+                totals = self.spans.setdefault(name, Span(name))
+                totals.count += 1
+                totals.wall_seconds += wall
+                totals.cpu_seconds += cpu
+                totals.rss_delta_mb += peak
+                totals.items += active.items or 0
+            if self.log_spans:
+                logger.info("%s: %.2f s wall, %.2f s CPU, +%.1f MB peak RSS, %d items", name, wall, cpu, peak, active.items or 0)
+
+    def report(self):
+        """
+        Returns the JSON run report.
+
+        Returns:
+            dict: `run`, `started`, `python`, `platform`, `pid`, `metadata`, `spans` (the
+            totals of every span), `wall_seconds` (since creation), `peak_rss_mb` and
+            `rss_delta_mb` (growth of the peak since creation).
+        """
+        with self._lock:
+            spans = [totals.to_dict() for totals in self.spans.values()]
+        peak = peak_rss_mb()
+        return {
+            "run": self.run,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pid": os.getpid(),
+            "metadata": self.metadata,
+            "spans": spans,
+            "wall_seconds": time.time() - self.started,
+            "peak_rss_mb": peak,
+            "rss_delta_mb": peak - self._start_peak_rss_mb,
+        }
+
+    def write_json(self, path):
+        """Writes the JSON run report to `path`."""
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2, default=str)
+
+    def prometheus(self, prefix="dedup"):
+        """
+        Returns the spans in the Prometheus text exposition format.
+
+        Every total becomes a metric labelled with the run and span name, e.g.
+        `dedup_span_wall_seconds_total{run="deduplication",span="sign"} 12.5`.
+        """
+        metrics = (
+            ("span_count_total", "counter", "Times the span was entered", "count"),
+            ("span_wall_seconds_total", "counter", "Wall time spent in the span", "wall_seconds"),
+            ("span_cpu_seconds_total", "counter", "CPU time of this process spent in the span", "cpu_seconds"),
+            ("span_rss_delta_megabytes_total", "counter", "Growth of the peak resident set size during the span", "rss_delta_mb"),
+            ("span_items_total", "counter", "Items processed in the span", "items"),
+        )
+        with self._lock:
+            spans = list(self.spans.values())
+        run = self.run.replace("\\", "\\\\").replace('"', '\\"')
+        lines = []
+        for metric, kind, description, attribute in metrics:
+            lines.append(f"# HELP {prefix}_{metric} {description}")
+            lines.append(f"# TYPE {prefix}_{metric} {kind}")
+            for totals in spans:
+                lines.append(f'{prefix}_{metric}{{run="{run}",span="{totals.name}"}} {getattr(totals, attribute)}')
+        lines.append(f"# HELP {prefix}_peak_rss_megabytes Peak resident set size of the process")
+        lines.append(f"# TYPE {prefix}_peak_rss_megabytes gauge")
+        lines.append(f'{prefix}_peak_rss_megabytes{{run="{run}"}} {peak_rss_mb()}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="dedup"):
+        """Writes the Prometheus text to `path`, e.g. for the node exporter's textfile collector."""
+        with open(path, "w") as file:
+            file.write(self.prometheus(prefix))
+
+    def log_summary(self, log=None):
+        """Logs one line per span, in the order they were first entered, and the peak RSS."""
+        log = log or logger
+        with self._lock:
+            spans = list(self.spans.values())
+        for totals in spans:
+            log.info("%s", totals)
+        log.info("Peak memory usage: %.2f MB", peak_rss_mb())
+
+
+_current = Instrumentation("default")
+
+
+def get_instrumentation():
+    """Returns the active `Instrumentation`."""
+    return _current
+
+
+def set_instrumentation(instrumentation):
+    """
+    Makes `instrumentation` the one that `span` records to.
+
+    Returns:
+        Instrumentation: The previously active one, to restore later.
+    """
+    global _current
+    previous, _current = _current, instrumentation
+    return previous
+
+
+def span(name, items=0):
+    """Times a `with` block as the span `name` of the active `Instrumentation` (see `Instrumentation.span`)."""
+    return _current.span(name, items)
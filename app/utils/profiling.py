@@ -0,0 +1,255 @@
+"""
+Per-stage profiles of a deduplication run.
+
+A `StageProfiler` attached to an `utils.instrumentation.Instrumentation` profiles every
+span of the run on its own, so a slow production run can be profiled by turning a switch
+rather than by rerunning it by hand under cProfile. Three modes are supported:
+
+- `cpu`: deterministic profiling with `cProfile`. Writes `<stage>.pstats` (for `pstats`
+  or snakeviz) and `<stage>.txt`, the top functions by cumulative time.
+- `sample`: a thread samples the stack of the profiled thread every few milliseconds.
+  Writes `<stage>.collapsed` (for flamegraph.pl or speedscope) and `<stage>.txt`, the
+  functions most often on top of the stack. Its overhead does not depend on how many
+  function calls the stage makes.
+- `memory`: `tracemalloc` snapshots at the start and end of every span. Writes
+  `<stage>.txt`, the lines that allocated the most memory that was still held when the
+  span ended, with the peak of traced memory, and `<stage>.collapsed`, the same bytes by
+  allocation stack.
+
+Only the outermost span of a thread is profiled; stages nested inside it are counted in
+it. Work done in worker processes (the joblib workers of the `sign` stage) is not seen.
+Without a profiler the spans do not check anything else, so profiling costs nothing when
+it is off. The CLI takes `--profile`; `load.py` and the Flask apps read `profiler_from_env`.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+
+MODES = ("cpu", "sample", "memory")
+"""MODES (tuple): The supported profiling modes"""
+
+TRACEMALLOC_FRAMES = 10
+"""TRACEMALLOC_FRAMES (int): Frames kept per allocation in `memory` mode; more frames make tracing slower"""
+
+
+def profiler_from_env(environ=None):
+    """
+    Creates a `StageProfiler` from environment variables, or returns None if profiling is off.
+
+    `DEDUP_PROFILE` selects the mode (one of `MODES`), `DEDUP_PROFILE_DIR` the output
+    directory (default `profiles`) and `DEDUP_PROFILE_TOP` the length of the tables
+    (default 25).
+    """
+    environ = os.environ if environ is None else environ
+    mode = environ.get("DEDUP_PROFILE", "").strip().lower()
+    if not mode or mode in ("0", "off", "none"):
+        return None
+    return StageProfiler(mode, environ.get("DEDUP_PROFILE_DIR", "profiles"), int(environ.get("DEDUP_PROFILE_TOP", "25")))
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StageProfiler:
+    """
+    Profiles the spans of a run, one profile per stage name.
+
+    Args:
+        mode (str): One of `MODES`.
+        output_dir (str): Directory for the profile files, created when they are written.
+        top (int): Rows of the top-N tables.
+        interval (float): Seconds between two stack samples in `sample` mode.
+    """
+
+    def __init__(self, mode="cpu", output_dir="profiles", top=25, interval=0.005):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, not {mode!r}")
+        self.mode = mode
+        """mode (str): The profiling mode."""
+        self.output_dir = output_dir
+        """output_dir (str): Directory for the profile files."""
+        self.top = top
+        """top (int): Rows of the top-N tables."""
+        self.interval = interval
+        """interval (float): Seconds between two stack samples in `sample` mode."""
+        self.profiles = {}
+        """profiles (dict): Stage name -> `cProfile.Profile` (`cpu`), Counter of collapsed stacks (`sample`)
+            or Counter of allocation stacks to bytes (`memory`)."""
+        self.peaks = defaultdict(int)
+        """peaks (dict): Stage name -> highest traced memory during the stage, in bytes (`memory`)."""
+        self._active = {}  # thread id -> stage name of its outermost span
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop_sampler = threading.Event()
+        self._started_tracemalloc = False
+
+    def start(self, name):
+        """
+        Starts profiling a span.
+
+        Returns:
+            A token to pass to `stop`, or None if the span is not profiled (it is nested in
+            another span of the thread, or another profiler is already running).
+        """
+        thread = threading.get_ident()
+        with self._lock:
+            if thread in self._active:
+                return None
+            self._active[thread] = name
+            profile = self.profiles.setdefault(name, cProfile.Profile() if self.mode == "cpu" else Counter())
+
+        if self.mode == "cpu":
+            try:
+                profile.enable()
+            except ValueError:  # Another profiler is active (Python 3.12+ allows only one)
+                with self._lock:
+                    del self._active[thread]
+                return None
+            return (thread, profile)
+        if self.mode == "sample":
+            self._start_sampler()
+            return (thread, None)
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        return (thread, tracemalloc.take_snapshot())
+
+    def stop(self, name, token):
+        """Stops profiling the span started with `start`."""
+        thread, state = token
+        if self.mode == "cpu":
+            state.disable()
+        elif self.mode == "memory":
+            peak = tracemalloc.get_traced_memory()[1]
+            # Dropping the profiler's own allocations after grouping is much faster than
+            # Snapshot.filter_traces, which matches every trace against the filenames
+            stats = [stat for stat in tracemalloc.take_snapshot().compare_to(state, "traceback")
+                     if stat.size_diff and stat.traceback[-1].filename not in (tracemalloc.__file__, __file__)]
+        with self._lock:
+            if self.mode == "memory":
+                for stat in stats:
+                    self.profiles[name][tuple(stat.traceback)] += stat.size_diff
+                self.peaks[name] = max(self.peaks[name], peak)
+            del self._active[thread]
+
+    def _start_sampler(self):
+        with self._lock:
+            if self._sampler is None:
+                self._stop_sampler.clear()
+                self._sampler = threading.Thread(target=self._sample, name="stage-profiler", daemon=True)
+                self._sampler.start()
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self._stop_sampler.wait(self.interval):
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            stacks = []
+            for thread, name in active:
+                frame = frames.get(thread)
+                if thread == me or frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stacks.append((name, ";".join(reversed(stack))))
+            del frames
+            with self._lock:
+                for name, stack in stacks:
+                    self.profiles[name][stack] += 1
+
+    def dump(self):
+        """
+        Writes the profile files of every stage profiled so far.
+
+        Safe to call while other threads are in spans. In `cpu` mode a stage that is being
+        profiled at that moment is skipped, as writing a `cProfile.Profile` disables it; it
+        is written by the next call.
+
+        Returns:
+            list: Paths of the written files.
+        """
+        # Copy under the lock, since the sampler thread and other spans keep adding to them
+        with self._lock:
+            running = set(self._active.values())
+            if self.mode == "cpu":
+                profiles = {name: profile for name, profile in self.profiles.items() if name not in running}
+            else:
+                profiles = {name: Counter(counts) for name, counts in self.profiles.items()}
+            peaks = dict(self.peaks)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        paths = []
+        for name, profile in profiles.items():
+            base = os.path.join(self.output_dir, name)
+            if self.mode == "cpu":
+                profile.dump_stats(base + ".pstats")
+                stream = io.StringIO()
+                pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(self.top)
+                table = stream.getvalue()
+                paths.append(base + ".pstats")
+            elif self.mode == "sample":
+                table = self._sample_table(name, profile)
+                self._write_collapsed(base + ".collapsed", profile.items())
+                paths.append(base + ".collapsed")
+            else:
+                table = self._memory_table(name, profile, peaks.get(name, 0))
+                self._write_collapsed(base + ".collapsed", (
+                    (";".join(f"{frame.filename}:{frame.lineno}" for frame in traceback), size)
+                    for traceback, size in profile.items() if size > 0))
+                paths.append(base + ".collapsed")
+            with open(base + ".txt", "w") as file:
+                file.write(table)
+            paths.append(base + ".txt")
+        return paths
+
+    @staticmethod
+    def _write_collapsed(path, stacks):
+        with open(path, "w") as file:
+            for stack, weight in stacks:
+                file.write(f"{stack} {weight}\n")
+
+    def _sample_table(self, name, samples):
+        total = sum(samples.values())
+        leaves = Counter()
+        for stack, count in samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        lines = [f"Stage {name}: {total} samples every {self.interval * 1000:g} ms", f"{'samples':>8} {'%':>6}  function"]
+        for function, count in leaves.most_common(self.top):
+            lines.append(f"{count:>8} {100 * count / total:>6.1f}  {function}")
+        return "\n".join(lines) + "\n"
+
+    def _memory_table(self, name, allocations, peak):
+        lines_by_site = Counter()
+        for traceback, size in allocations.items():
+            frame = traceback[-1]  # The most recent frame is the allocation site
+            lines_by_site[f"{frame.filename}:{frame.lineno}"] += size
+        lines = [f"Stage {name}: peak traced memory {peak / 2 ** 20:.1f} MB, "
+                 f"{sum(lines_by_site.values()) / 2 ** 20:+.1f} MB held at the end",
+                 f"{'KB':>12}  allocation site"]
+        for site, size in sorted(lines_by_site.items(), key=lambda item: -abs(item[1]))[:self.top]:
+            lines.append(f"{size / 1024:>+12.1f}  {site}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """Stops the sampler thread, and `tracemalloc` if this profiler started it."""
+        with self._lock:
+            sampler, self._sampler = self._sampler, None
+        if sampler is not None:
+            self._stop_sampler.set()
+            sampler.join()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
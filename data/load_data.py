@@ -1,4 +1,8 @@
 import os
+import math
+import struct
+import hashlib
+import unicodedata
 import pymongo
 from collections import defaultdict
 
@@ -8,9 +12,115 @@ mongo_port = int(os.getenv("MONGO_PORT", "27017"))
 client = pymongo.MongoClient(f"mongodb://{mongo_host}:{mongo_port}")
 db = client['data_db']
 
+# Exact-duplicate gate: set DEDUP_GATE=1 to keep exact duplicates out of the main collections.
+# Duplicates go to '<collection>_duplicates' as {"_id": duplicate id, "original": original id}.
+dedup_gate = os.getenv("DEDUP_GATE", "0").lower() in ("1", "true", "yes")
+dedup_filter_dir = os.getenv("DEDUP_FILTER_DIR", "/data")
+dedup_fpr = float(os.getenv("DEDUP_FPR", "0.001"))
 
-def load_tsv_files():
-    data_dir = '/data'
+
+def normalize_text(text):
+    """Normalizes text for exact-duplicate detection, with the same rule as `utils.utils.normalize_text`."""
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+
+def content_hash(text):
+    """
+    Returns the 128-bit BLAKE2b hash of the normalized text as a hex string.
+
+    This is not `utils.utils.content_hash` (xxh3-128): the loader image is built from this
+    directory alone and installs only pymongo, so neither the LSH package nor xxhash is
+    available here. The hashes are only compared with each other, in the `content_hash`
+    field and the saved filter, so the two never need to agree.
+    """
+    return hashlib.blake2b(normalize_text(text).encode(), digest_size=16).hexdigest()
+
+
+class ContentFilter:
+    """
+    A Bloom filter over content hashes that is saved next to the TSV files between runs.
+
+    The k bit indices are derived from the two 64-bit halves of the content hash
+    (Kirsch-Mitzenmacher double hashing), so no extra hashing is needed. It only uses
+    the standard library, like the rest of the loader image.
+    """
+
+    def __init__(self, n, f):
+        self.m = max(64, int(-math.log(f) * n / (math.log(2) ** 2)))
+        self.k = max(1, round(self.m * math.log(2) / n))
+        self.bits = bytearray((self.m + 7) // 8)
+
+    def _indices(self, digest):
+        h1, h2 = struct.unpack('<QQ', bytes.fromhex(digest))
+        return [((h1 + i * h2) & 0xFFFFFFFFFFFFFFFF) % self.m for i in range(self.k)]
+
+    def add(self, digest):
+        for i in self._indices(digest):
+            self.bits[i >> 3] |= 1 << (i & 7)
+
+    def query(self, digest):
+        return all(self.bits[i >> 3] & (1 << (i & 7)) for i in self._indices(digest))
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(struct.pack('<QQ', self.m, self.k) + self.bits)
+
+    @classmethod
+    def load(cls, path):
+        content_filter = cls.__new__(cls)
+        with open(path, 'rb') as file:
+            content_filter.m, content_filter.k = struct.unpack('<QQ', file.read(16))
+            content_filter.bits = bytearray(file.read())
+        return content_filter
+
+
+def split_duplicates(collection, content_filter, batch):
+    """
+    Separates the exact duplicates from a batch of documents that carry a `content_hash`.
+
+    A filter positive is only a suspect: it is confirmed against the collection's
+    `content_hash` index (or the earlier documents of the same batch), so false positives
+    are still inserted.
+
+    Returns:
+        tuple: (documents to insert, duplicate records for the side collection)
+    """
+    suspects = [document["content_hash"] for document in batch if content_filter.query(document["content_hash"])]
+    originals = {}
+    if suspects:
+        for stored in collection.find({"content_hash": {"$in": suspects}}, {"content_hash": 1}):
+            originals.setdefault(stored["content_hash"], stored["_id"])
+
+    unique, duplicates = [], []
+    for document in batch:
+        digest = document["content_hash"]
+        if digest in originals:
+            duplicates.append({"_id": document["_id"], "original": originals[digest]})
+            continue
+        originals[digest] = document["_id"]
+        content_filter.add(digest)
+        unique.append(document)
+    return unique, duplicates
+
+
+def insert_batch(collection, batch, content_filter=None, duplicate_collection=None):
+    """
+    Inserts a batch of documents. With a content filter, exact duplicates go to `duplicate_collection` instead.
+
+    Returns:
+        int: The number of duplicates diverted.
+    """
+    duplicates = []
+    if content_filter is not None:
+        batch, duplicates = split_duplicates(collection, content_filter, batch)
+        if duplicates:
+            duplicate_collection.insert_many(duplicates, ordered=False)
+    if batch:
+        collection.insert_many(batch, ordered=False)
+    return len(duplicates)
+
+
+def load_tsv_files(data_dir='/data'):
     for filename in os.listdir(data_dir):
         if filename.endswith(".tsv"):
             collection_name = os.path.splitext(filename)[0]
@@ -23,22 +133,41 @@ def load_tsv_files():
 
             print(f"Loading data from {filename} into collection '{collection_name}'")
 
+            content_filter = duplicate_collection = None
+            if dedup_gate:
+                collection.create_index("content_hash")
+                duplicate_collection = db[f"{collection_name}_duplicates"]
+                # The collection is empty, so records and filter bits of an earlier load describe
+                # documents that are gone: start both afresh (the filter file is overwritten below)
+                duplicate_collection.delete_many({})
+                with open(os.path.join(data_dir, filename), 'r') as file:
+                    num_lines = sum(1 for _ in file)
+                content_filter = ContentFilter(max(num_lines, 1000), dedup_fpr)
+                filter_path = os.path.join(dedup_filter_dir, f"{collection_name}.bloom")
+
             # Batch insert documents
             batch = []
+            num_duplicates = 0
             with open(os.path.join(data_dir, filename), 'r') as file:
                 for line in file:
                     index, text = line.strip().split('\t')
                     # document = {"index": int(index), "text": text}
                     document = {"_id": int(index), "text": text}
+                    if dedup_gate:
+                        document["content_hash"] = content_hash(text)
                     batch.append(document)
                     # Insert in batches of 1000
                     if len(batch) >= 1000:
-                        collection.insert_many(batch, ordered=False)
+                        num_duplicates += insert_batch(collection, batch, content_filter, duplicate_collection)
                         batch = []
 
                 # Insert any remaining documents
                 if batch:
-                    collection.insert_many(batch)
+                    num_duplicates += insert_batch(collection, batch, content_filter, duplicate_collection)
+
+            if dedup_gate:
+                content_filter.save(filter_path)
+                print(f"Moved {num_duplicates} exact duplicates to '{collection_name}_duplicates'.")
             print(f"Data from {filename} loaded into collection '{collection_name}'.")
 
 